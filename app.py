@@ -1,10 +1,11 @@
 import os
-from flask import Flask, render_template, request, jsonify, send_file
-from datetime import datetime
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, url_for
+from datetime import datetime, timedelta
+from decimal import Decimal
 import matplotlib.pyplot as plt
 from io import BytesIO
 import base64
-from flask import make_response
+from flask import make_response, has_request_context
 import csv
 from io import StringIO
 from reportlab.pdfgen import canvas
@@ -14,10 +15,61 @@ from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.units import cm, mm
+from reportlab.graphics.shapes import Drawing, Group, String
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.piecharts import Pie
+from reportlab import rl_config
+import numpy as np
 import matplotlib
 matplotlib.use('Agg') 
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from PIL import Image as ImagemPIL
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text, func, event, create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from contextlib import contextmanager
+from collections import defaultdict
+import atexit
+import bisect
+import math
+import re
+import unicodedata
+import threading
+import queue
+import time
+import json
+import hashlib
+import gzip
+import mimetypes
+import hmac
+import sys
+import socket
+import zipfile
+import click
+import shutil
+import copy
+from functools import wraps, lru_cache
+from xml.sax.saxutils import escape
+try:
+    import brotli
+except ImportError:  # opcional: sem ele as páginas são servidas só com gzip
+    brotli = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # opcional: sem ele o evento congelado sai só com CSV
+    pa = pq = None
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos (e sem gunicorn)
+    fcntl = None
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
+from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 
 app = Flask(__name__)
 
@@ -194,9 +246,144 @@ else:
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///calculadora_co2.db'
         print(f"⚠️  Erro .env: {e}, usando SQLite")
 
+# ===== POOLS DE CONEXÃO E RÉPLICA DE LEITURA =====
+# Cada bind tem seu próprio pool, configurado por variáveis de ambiente:
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE (primário)
+#   DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, ... (réplica)
+def _normalizar_url_banco(url):
+    """Corrige o prefixo postgres:// usado por alguns provedores"""
+    if url and url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def _opcoes_pool(prefixo):
+    """Lê as opções de pool do SQLAlchemy para um bind a partir do ambiente"""
+    opcoes = {}
+    for opcao, variavel in (('pool_size', 'POOL_SIZE'),
+                            ('max_overflow', 'MAX_OVERFLOW'),
+                            ('pool_timeout', 'POOL_TIMEOUT'),
+                            ('pool_recycle', 'POOL_RECYCLE')):
+        valor = os.environ.get(f'{prefixo}_{variavel}')
+        if valor:
+            opcoes[opcao] = int(valor)
+    if opcoes:
+        opcoes['pool_pre_ping'] = True
+    return opcoes
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _opcoes_pool('DB')
+
+# Tempo máximo (s) para abrir uma conexão com a réplica: uma réplica fora do ar não
+# deve prender a thread de verificação nem as leituras pelo timeout padrão do driver
+REPLICA_TIMEOUT_CONEXAO = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', '3'))
+
+replica_url = _normalizar_url_banco(os.environ.get('DATABASE_REPLICA_URL'))
+if replica_url:
+    opcoes_replica = _opcoes_pool('DB_REPLICA')
+    if replica_url.startswith('postgresql'):
+        opcoes_replica['connect_args'] = {'connect_timeout': REPLICA_TIMEOUT_CONEXAO}
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': {'url': replica_url, **opcoes_replica}
+    }
+    print(f"✅ Réplica de leitura: {replica_url.split('@')[1] if '@' in replica_url else replica_url}")
+
+# Atraso máximo tolerado (s) antes de voltar a ler do primário
+REPLICA_ATRASO_MAXIMO = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+REPLICA_INTERVALO_VERIFICACAO = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '10'))
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
+_estado_replica = {'verificado_em': None, 'saudavel': False, 'atraso': None, 'pid': None}
+_lock_replica = threading.Lock()
+
+def _medir_atraso_replica(engine):
+    """Retorna o atraso de replicação em segundos (0 quando não se aplica)"""
+    if engine.dialect.name != 'postgresql':
+        # SQLite ou outro banco sem replicação nativa: considera sempre em dia
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return 0.0
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT pg_is_in_recovery()")).scalar():
+            return 0.0
+        atraso = conn.execute(text(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+        )).scalar()
+        return float(atraso or 0.0)
+
+def verificar_replica(replica):
+    """Mede o atraso da réplica, atualiza _estado_replica e devolve (saudavel, atraso)
+
+    A trava só protege a atualização.
+    """
+    try:
+        atraso = _medir_atraso_replica(replica)
+        saudavel = atraso <= REPLICA_ATRASO_MAXIMO
+        if not saudavel:
+            print(f"⚠️  Réplica atrasada {atraso:.1f}s, lendo do primário")
+    except Exception as e:
+        atraso, saudavel = None, False
+        print(f"⚠️  Réplica indisponível ({e}), lendo do primário")
+    with _lock_replica:
+        _estado_replica.update(verificado_em=time.monotonic(), saudavel=saudavel, atraso=atraso)
+    return saudavel, atraso
+
+def _monitorar_replica(replica):
+    while True:
+        verificar_replica(replica)
+        time.sleep(REPLICA_INTERVALO_VERIFICACAO)
+
+def engine_leitura():
+    """Engine para consultas somente leitura: réplica se estiver em dia, senão o primário
+
+    A verificação de atraso roda numa thread de cada processo; a requisição só lê o
+    último resultado e nunca espera a réplica responder. Até a primeira verificação
+    as leituras vão para o primário.
+    """
+    replica = db.engines.get('replica')
+    if replica is None:
+        return db.engine
+
+    if _estado_replica['pid'] != os.getpid():
+        # Uma thread por processo; após o fork do gunicorn ela precisa ser recriada
+        with _lock_replica:
+            if _estado_replica['pid'] != os.getpid():
+                _estado_replica.update(pid=os.getpid(), verificado_em=None, saudavel=False, atraso=None)
+                threading.Thread(target=_monitorar_replica, args=(replica,), name='verificar-replica',
+                                 daemon=True).start()
+
+    return replica if _estado_replica['saudavel'] else db.engine
+
+@contextmanager
+def sessao_leitura():
+    """Sessão para rotas somente leitura e agregações (não usar para escrita)"""
+    sessao = Session(bind=engine_leitura())
+    try:
+        yield sessao
+    finally:
+        sessao.close()
+
+# ===== SQLITE (MODO LOCAL / FALLBACK) =====
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+# Com vários workers do gunicorn, grava pelo escritor único (ver EscritorSQLite)
+SQLITE_ESCRITOR_UNICO = os.environ.get('SQLITE_ESCRITOR_UNICO', '1') != '0'
+
+def configurar_conexao_sqlite(dbapi_connection, connection_record=None):
+    """PRAGMAs para leituras em paralelo com um escritor (WAL) e espera em vez de 'database is locked'"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+with app.app_context():
+    for _engine in db.engines.values():
+        if _engine.dialect.name == 'sqlite':
+            event.listen(_engine, 'connect', configurar_conexao_sqlite)
+
 class RespostaEmissao(db.Model):
     __tablename__ = 'respostas_emissao'
     
@@ -204,7 +391,8 @@ class RespostaEmissao(db.Model):
     email = db.Column(db.String(255), nullable=False)
     pais_origem_pt = db.Column(db.String(100), nullable=False)
     pais_origem_en = db.Column(db.String(100), nullable=False)
-  #  estado_origem = db.Column(db.String(100), nullable=False)
+    # Só para quem vem do Brasil (nulo para estrangeiros e respostas anteriores à migração 4)
+    estado_origem = db.Column(db.String(100), nullable=True)
     tipo_participante = db.Column(db.String(50), nullable=False)
     transporte_cidade = db.Column(db.String(50), nullable=False)
     distancia_cidade = db.Column(db.Numeric(10, 2), nullable=False)
@@ -224,12 +412,32 @@ class RespostaEmissao(db.Model):
 
     emissao_total = db.Column(db.Numeric(10, 2), nullable=False)
     #created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # "<id do evento>:<email normalizado>"; nula quando o evento não deduplica
+    chave_unica = db.Column(db.String(300), nullable=True)
+
+    # 'aceita', 'sinalizada' (entra nos agregados, aguarda revisão), 'pendente' (fora dos
+    # agregados até a revisão) ou 'rejeitada'; veja VALIDAÇÃO E VALORES ATÍPICOS
+    situacao = db.Column(db.String(20), nullable=False, default='aceita', server_default='aceita')
+    motivos_revisao = db.Column(db.Text, nullable=True)
+
+    # Bancos já existentes recebem os índices pela migração 1 (MIGRACOES). Os de
+    # tipo/transporte/país incluem emissao_total para os GROUP BY dos agregados
+    # serem respondidos só pelo índice.
+    __table_args__ = (
+        db.Index('ix_respostas_email', func.lower(email)),
+        db.Index('ix_respostas_tipo_participante', tipo_participante, emissao_total),
+        db.Index('ix_respostas_transporte_cidade', transporte_cidade, emissao_total),
+        db.Index('ix_respostas_pais_origem', pais_origem_pt, emissao_total),
+        db.Index('ux_respostas_chave_unica', chave_unica, unique=True),
+        db.Index('ix_respostas_situacao', situacao),
+    )
     
     def to_dict(self):
         return {
             'id': self.id,
             'email': self.email,
-#           'estado_origem': self.estado_origem,
+            'estado_origem': self.estado_origem,
             'pais_origem_pt': self.pais_origem_pt,
             'pais_origem_en': self.pais_origem_en,
             'tipo_participante': self.tipo_participante,
@@ -249,8 +457,288 @@ class RespostaEmissao(db.Model):
             'pontos_turisticos': self.pontos_turisticos,
 
             'emissao_total': float(self.emissao_total),
+            'situacao': self.situacao,
+            'motivos_revisao': self.motivos_revisao,
+        }
+
+class Evento(db.Model):
+    __tablename__ = 'eventos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(150), nullable=False, unique=True)
+    # As respostas de um evento são o intervalo de ids [id_inicial, id_final];
+    # id_final fica nulo enquanto o evento está aberto
+    id_inicial = db.Column(db.Integer, nullable=False)
+    id_final = db.Column(db.Integer, nullable=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    # Reenvio do mesmo email no evento: 'substituir', 'manter' ou 'desligada' (nulo: DEDUPLICACAO_PADRAO)
+    deduplicacao = db.Column(db.String(20), nullable=True)
+    # Local do evento, para estimar e conferir a distância de cada participante
+    local_latitude = db.Column(db.Float, nullable=True)
+    local_longitude = db.Column(db.Float, nullable=True)
+
+    @property
+    def encerrado(self):
+        return self.id_final is not None
+
+    @property
+    def modo_deduplicacao(self):
+        return self.deduplicacao or DEDUPLICACAO_PADRAO
+
+    @property
+    def local(self):
+        if self.local_latitude is None or self.local_longitude is None:
+            return None
+        return self.local_latitude, self.local_longitude
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'nome': self.nome,
+            'id_inicial': self.id_inicial,
+            'id_final': self.id_final,
+            'encerrado': self.encerrado,
+            'deduplicacao': self.modo_deduplicacao,
+            'local': self.local,
+        }
+
+def intervalo_respostas(evento=None, id_inicio=None, id_fim=None):
+    """Resolve o intervalo de ids de respostas de um evento (ou devolve o intervalo informado)"""
+    if evento:
+        registro_evento = Evento.query.filter_by(nome=evento).first()
+        if registro_evento is None:
+            raise ValueError(f"Evento não encontrado: {evento}")
+        return registro_evento.id_inicial, registro_evento.id_final
+    return id_inicio, id_fim
+
+def filtrar_intervalo(consulta, id_inicio=None, id_fim=None):
+    """Aplica um intervalo de ids (limites opcionais) a uma consulta de respostas"""
+    if id_inicio is not None:
+        consulta = consulta.filter(RespostaEmissao.id >= id_inicio)
+    if id_fim is not None:
+        consulta = consulta.filter(RespostaEmissao.id <= id_fim)
+    return consulta
+
+class ChaveIdempotencia(db.Model):
+    """Chave enviada pelo navegador com cada resposta, para reenvios não duplicarem linhas"""
+    __tablename__ = 'chaves_idempotencia'
+
+    chave = db.Column(db.String(64), primary_key=True)
+    resposta_id = db.Column(db.Integer, nullable=False)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class AlteracaoResposta(db.Model):
+    """Cada inserção, alteração ou remoção de resposta, em ordem; base do feed incremental"""
+    __tablename__ = 'alteracoes_respostas'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = db.Column(db.Integer, primary_key=True)
+    resposta_id = db.Column(db.Integer, nullable=False)
+    operacao = db.Column(db.String(10), nullable=False)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class GeracaoDados(db.Model):
+    """Contador (linha única) das mudanças em massa que não passam pelo feed: arquivar e restaurar"""
+    __tablename__ = 'geracao_dados'
+
+    id = db.Column(db.Integer, primary_key=True)
+    geracao = db.Column(db.Integer, nullable=False, default=0)
+
+def avancar_geracao_dados():
+    """Muda versao_dados() na mesma transação da mudança em massa (db.session)"""
+    linha = db.session.get(GeracaoDados, 1)
+    if linha is None:
+        db.session.add(GeracaoDados(id=1, geracao=1))
+    else:
+        linha.geracao += 1
+
+class ArquivoEvento(db.Model):
+    """Evento arquivado: as respostas estão num .npz e os agregados ficam guardados aqui"""
+    __tablename__ = 'arquivos_eventos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(150), nullable=False, unique=True)
+    id_inicial = db.Column(db.Integer, nullable=False)
+    id_final = db.Column(db.Integer, nullable=False)
+    total_respostas = db.Column(db.Integer, nullable=False)
+    agregados = db.Column(db.Text, nullable=False)  # JSON no formato de calcular_agregados
+    arquivo = db.Column(db.String(500), nullable=False)
+    arquivado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class InscricaoCarona(db.Model):
+    """Participante que aceitou ser sugerido para carona solidária"""
+    __tablename__ = 'caronas_inscricoes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    resposta_id = db.Column(db.Integer, nullable=False, unique=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Tarefa(db.Model):
+    """Tarefa pesada de manutenção, executada em lotes por `flask worker-tarefas`; veja TAREFAS EM SEGUNDO PLANO"""
+    __tablename__ = 'tarefas'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    parametros = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    # 'pendente', 'executando', 'concluida', 'falhou' ou 'cancelada'
+    situacao = db.Column(db.String(20), nullable=False, default='pendente')
+    cancelamento_pedido = db.Column(db.Boolean, nullable=False, default=False)
+    # Onde o último lote confirmado parou (JSON); uma tarefa interrompida recomeça daqui
+    checkpoint = db.Column(db.Text, nullable=True)
+    processados = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    lotes = db.Column(db.Integer, nullable=False, default=0)
+    # Tempo gasto nos lotes (sem as pausas entre eles), base da vazão
+    segundos_execucao = db.Column(db.Float, nullable=False, default=0.0)
+    falhas = db.Column(db.Integer, nullable=False, default=0)
+    erro = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    # Renovado a cada lote; uma tarefa 'executando' sem batimento há TAREFAS_LEASE_SEGUNDOS é retomada
+    batimento_em = db.Column(db.DateTime, nullable=True)
+    executar_apos = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciado_em = db.Column(db.DateTime, nullable=True)
+    concluido_em = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_tarefas_situacao', situacao, executar_apos),
+    )
+
+    def to_dict(self):
+        vazao = self.processados / self.segundos_execucao if self.segundos_execucao else None
+        restantes = self.total - self.processados if self.total is not None else None
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'parametros': json.loads(self.parametros),
+            'situacao': self.situacao,
+            'cancelamento_pedido': self.cancelamento_pedido,
+            'processados': self.processados,
+            'total': self.total,
+            'progresso': round(self.processados / self.total, 4) if self.total else None,
+            'lotes': self.lotes,
+            'segundos_execucao': round(self.segundos_execucao, 3),
+            'itens_por_segundo': round(vazao, 1) if vazao else None,
+            'eta_segundos': round(max(restantes, 0) / vazao, 1) if vazao and restantes is not None else None,
+            'falhas': self.falhas,
+            'erro': self.erro,
+            'worker': self.worker,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'iniciado_em': self.iniciado_em.isoformat() if self.iniciado_em else None,
+            'concluido_em': self.concluido_em.isoformat() if self.concluido_em else None,
         }
 
+class VersaoEsquema(db.Model):
+    """Migrações já aplicadas neste banco"""
+    __tablename__ = 'versao_esquema'
+
+    versao = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    descricao = db.Column(db.String(200), nullable=False)
+    aplicada_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# ===== MIGRAÇÕES DO ESQUEMA =====
+# db.create_all() só cria o que falta; mudanças em tabelas existentes (índices, colunas)
+# entram aqui, numeradas, e cada banco guarda em versao_esquema até onde já foi.
+def _criar_indices(conexao, tabela, nomes):
+    # IF NOT EXISTS e não checkfirst: a reflexão do SQLAlchemy não enxerga índices de expressão
+    for indice in tabela.indexes:
+        if indice.name in nomes:
+            conexao.execute(CreateIndex(indice, if_not_exists=True))
+
+def _adicionar_coluna(conexao, coluna):
+    """ALTER TABLE ... ADD COLUMN, se a coluna ainda não existir (bancos novos já a têm pelo create_all)"""
+    tabela = coluna.table.name
+    if coluna.name not in {c['name'] for c in inspect(conexao).get_columns(tabela)}:
+        # CreateColumn inclui DEFAULT e NOT NULL; as linhas existentes recebem o default
+        definicao = CreateColumn(coluna).compile(dialect=conexao.dialect)
+        conexao.exec_driver_sql(f"ALTER TABLE {tabela} ADD COLUMN {definicao}")
+
+def _migracao_indices_respostas(conexao):
+    _criar_indices(conexao, RespostaEmissao.__table__, {
+        'ix_respostas_email', 'ix_respostas_tipo_participante',
+        'ix_respostas_transporte_cidade', 'ix_respostas_pais_origem',
+    })
+
+def _migracao_deduplicacao(conexao):
+    # Respostas antigas ficam com chave_unica nula: duplicatas já gravadas não são fundidas
+    _adicionar_coluna(conexao, Evento.__table__.c.deduplicacao)
+    _adicionar_coluna(conexao, RespostaEmissao.__table__.c.chave_unica)
+    _criar_indices(conexao, RespostaEmissao.__table__, {'ux_respostas_chave_unica'})
+
+def _migracao_revisao(conexao):
+    # Respostas existentes ficam 'aceitas': a verificação de valores atípicos vale dos novos envios em diante
+    _adicionar_coluna(conexao, RespostaEmissao.__table__.c.situacao)
+    _adicionar_coluna(conexao, RespostaEmissao.__table__.c.motivos_revisao)
+    _criar_indices(conexao, RespostaEmissao.__table__, {'ix_respostas_situacao'})
+
+def _migracao_origem_e_local(conexao):
+    _adicionar_coluna(conexao, RespostaEmissao.__table__.c.estado_origem)
+    _adicionar_coluna(conexao, Evento.__table__.c.local_latitude)
+    _adicionar_coluna(conexao, Evento.__table__.c.local_longitude)
+
+MIGRACOES = [
+    (1, 'Índices de respostas_emissao (email, tipo, transporte, país)', _migracao_indices_respostas),
+    (2, 'Deduplicação por email e evento (eventos.deduplicacao, respostas_emissao.chave_unica)', _migracao_deduplicacao),
+    (3, 'Revisão de respostas atípicas (respostas_emissao.situacao, motivos_revisao)', _migracao_revisao),
+    (4, 'Estado de origem e local do evento (respostas_emissao.estado_origem, eventos.local_*)', _migracao_origem_e_local),
+]
+
+@contextmanager
+def _trava_migracoes(engine):
+    """Um worker migra por vez (os outros esperam e encontram tudo aplicado)"""
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as conexao:
+            conexao.execute(text("SELECT pg_advisory_lock(4202)"))
+            try:
+                yield
+            finally:
+                conexao.execute(text("SELECT pg_advisory_unlock(4202)"))
+        return
+    caminho = f"{engine.url.database}.migracoes" if engine.url.database not in (None, '', ':memory:') else None
+    if caminho is None or fcntl is None:
+        yield
+        return
+    with open(caminho, 'a') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(trava, fcntl.LOCK_UN)
+
+def aplicar_migracoes(engine=None):
+    """Aplica as migrações pendentes, cada uma na própria transação; retorna as aplicadas"""
+    engine = engine or db.engine
+    VersaoEsquema.__table__.create(bind=engine, checkfirst=True)
+    aplicadas = []
+    with _trava_migracoes(engine):
+        with engine.connect() as conexao:
+            feitas = set(conexao.execute(db.select(VersaoEsquema.versao)).scalars())
+        for versao, descricao, migrar in MIGRACOES:
+            if versao in feitas:
+                continue
+            with engine.begin() as conexao:
+                migrar(conexao)
+                conexao.execute(VersaoEsquema.__table__.insert().values(
+                    versao=versao, descricao=descricao, aplicada_em=datetime.utcnow()))
+            aplicadas.append((versao, descricao))
+    return aplicadas
+
+def filtrar_respostas(consulta, email=None, tipo=None, transporte=None, pais=None):
+    """Filtros de /dados e /download; cada um tem índice próprio em respostas_emissao"""
+    if email:
+        consulta = consulta.filter(func.lower(RespostaEmissao.email) == email.strip().lower())
+    if tipo:
+        consulta = consulta.filter(RespostaEmissao.tipo_participante == tipo)
+    if transporte:
+        consulta = consulta.filter(RespostaEmissao.transporte_cidade == transporte)
+    if pais:
+        consulta = consulta.filter(RespostaEmissao.pais_origem_pt == pais)
+    return consulta
+
+def filtros_da_requisicao():
+    return {nome: request.args.get(nome) for nome in ('email', 'tipo', 'transporte', 'pais')}
+
 # Dados de emissão por transporte (gCO2/km)
 EMISSOES_TRANSPORTE = {
     "carro": 97.8,
@@ -349,7 +837,7 @@ PAISES_INGLES = [
 "--Saint Vincent and the Grenadines", "--Seychelles", "--Senegal", "--Sierra Leone", "--Serbia", "--Singapore", "--Syria", 
 "--Somalia", "--Sri Lanka", "--Sudan", "--South Sudan", "--Sweden", "--Switzerland", "--Suriname", "--Thailand", "--Tajikistan", 
 "--Tanzania", "--Timor-Leste", "--Togo", "--Tonga", "--Trinidad and Tobago", "--Tunisia", "--Turkmenistan", "--Turkey", 
-"--Tuvalu", "--Ukraine", "--Uganda", "--Uruguay", "--Uzbequistão", "--Vanuatu", "--Holy See (Vatican City)", "--Venezuela", 
+"--Tuvalu", "--Ukraine", "--Uganda", "--Uruguay", "--Uzbekistan", "--Vanuatu", "--Holy See (Vatican City)", "--Venezuela", 
 "--Vietnam", "--Zambia", "--Zimbabwe"
 ]
 
@@ -359,869 +847,3914 @@ for pt, en in PAISES_DICT.items():
     translations[pt] = en
 
 
+# ===== DISTÂNCIA ATÉ O LOCAL DO EVENTO =====
+# Coordenadas (lat, lon) de referência de cada origem, sem serviço externo de geocodificação.
+# Em vez do centroide geográfico usamos a capital ou a principal cidade/aeroporto internacional:
+# em países grandes o centroide cai no interior, longe de onde as viagens começam.
+COORDENADAS_PAISES = {
+    "Afeganistão": (34.53, 69.17), "África do Sul": (-26.20, 28.05), "Albânia": (41.33, 19.82),
+    "Alemanha": (52.52, 13.40), "Andorra": (42.51, 1.52), "Angola": (-8.84, 13.23),
+    "Antígua e Barbuda": (17.12, -61.85), "Arábia Saudita": (24.71, 46.68), "Argélia": (36.75, 3.06),
+    "Argentina": (-34.60, -58.38), "Armênia": (40.18, 44.51), "Austrália": (-33.87, 151.21),
+    "Áustria": (48.21, 16.37), "Azerbaijão": (40.41, 49.87), "Bahamas": (25.05, -77.35),
+    "Bahrein": (26.23, 50.59), "Bangladesh": (23.81, 90.41), "Barbados": (13.10, -59.62),
+    "Bélgica": (50.85, 4.35), "Belize": (17.25, -88.77), "Benim": (6.37, 2.39),
+    "Bielorrússia": (53.90, 27.56), "Bolívia": (-16.50, -68.15), "Bósnia e Herzegovina": (43.86, 18.41),
+    "Botsuana": (-24.63, 25.92), "Brasil": (-15.79, -47.88), "Brunei": (4.90, 114.94),
+    "Bulgária": (42.70, 23.32), "Burkina Faso": (12.37, -1.52), "Burundi": (-3.38, 29.36),
+    "Butão": (27.47, 89.64), "Cabo Verde": (14.93, -23.51), "Camarões": (3.85, 11.50),
+    "Camboja": (11.56, 104.92), "Canadá": (43.65, -79.38), "Catar": (25.29, 51.53),
+    "Cazaquistão": (43.24, 76.89), "Chade": (12.13, 15.06), "Chile": (-33.45, -70.67),
+    "China": (39.90, 116.41), "Chipre": (35.19, 33.38), "Colômbia": (4.71, -74.07),
+    "Comores": (-11.70, 43.26), "Congo (Congo-Brazzaville)": (-4.27, 15.28), "Coreia do Norte": (39.04, 125.76),
+    "Coreia do Sul": (37.57, 126.98), "Costa do Marfim": (5.36, -4.01), "Costa Rica": (9.93, -84.08),
+    "Croácia": (45.81, 15.98), "Cuba": (23.11, -82.37), "Dinamarca": (55.68, 12.57),
+    "Djibouti": (11.59, 43.15), "Dominica": (15.30, -61.39), "Egito": (30.04, 31.24),
+    "El Salvador": (13.69, -89.22), "Emirados Árabes Unidos": (25.20, 55.27), "Equador": (-0.18, -78.47),
+    "Eritreia": (15.32, 38.93), "Eslováquia": (48.15, 17.11), "Eslovênia": (46.06, 14.51),
+    "Espanha": (40.42, -3.70), "Essuatíni": (-26.31, 31.14), "Estados Unidos": (38.91, -77.04),
+    "Estônia": (59.44, 24.75), "Etiópia": (9.03, 38.74), "Fiji": (-18.14, 178.44),
+    "Filipinas": (14.60, 120.98), "Finlândia": (60.17, 24.94), "França": (48.86, 2.35),
+    "Gabão": (0.42, 9.47), "Gâmbia": (13.45, -16.58), "Gana": (5.60, -0.19),
+    "Geórgia": (41.72, 44.79), "Granada": (12.06, -61.75), "Grécia": (37.98, 23.73),
+    "Guatemala": (14.63, -90.51), "Guiana": (6.80, -58.16), "Guiné": (9.64, -13.58),
+    "Guiné Equatorial": (3.75, 8.78), "Guiné-Bissau": (11.86, -15.60), "Haiti": (18.59, -72.31),
+    "Holanda (Países Baixos)": (52.37, 4.90), "Honduras": (14.07, -87.19), "Hungria": (47.50, 19.04),
+    "Iêmen": (15.37, 44.19), "Ilhas Marshall": (7.09, 171.38), "Ilhas Salomão": (-9.43, 159.95),
+    "Índia": (28.61, 77.21), "Indonésia": (-6.21, 106.85), "Irã": (35.69, 51.39),
+    "Iraque": (33.31, 44.36), "Irlanda": (53.35, -6.26), "Islândia": (64.15, -21.94),
+    "Israel": (32.09, 34.78), "Itália": (41.90, 12.50), "Jamaica": (18.00, -76.79),
+    "Japão": (35.68, 139.69), "Jordânia": (31.95, 35.93), "Kiribati": (1.33, 172.98),
+    "Kuwait": (29.38, 47.99), "Laos": (17.98, 102.63), "Lesoto": (-29.31, 27.48),
+    "Letônia": (56.95, 24.11), "Líbano": (33.89, 35.50), "Libéria": (6.30, -10.80),
+    "Líbia": (32.89, 13.19), "Liechtenstein": (47.14, 9.52), "Lituânia": (54.69, 25.28),
+    "Luxemburgo": (49.61, 6.13), "Macedônia do Norte": (42.00, 21.43), "Madagascar": (-18.88, 47.51),
+    "Malásia": (3.14, 101.69), "Malawi": (-13.96, 33.79), "Maldivas": (4.18, 73.51),
+    "Mali": (12.64, -8.00), "Malta": (35.90, 14.51), "Marrocos": (33.57, -7.59),
+    "Maurício": (-20.16, 57.50), "Mauritânia": (18.08, -15.98), "México": (19.43, -99.13),
+    "Micronésia": (6.92, 158.16), "Moçambique": (-25.97, 32.57), "Moldávia": (47.01, 28.86),
+    "Mônaco": (43.74, 7.42), "Mongólia": (47.89, 106.91), "Montenegro": (42.44, 19.26),
+    "Myanmar (Birmânia)": (16.87, 96.20), "Namíbia": (-22.56, 17.08), "Nauru": (-0.53, 166.93),
+    "Nepal": (27.72, 85.32), "Nicarágua": (12.11, -86.24), "Níger": (13.51, 2.11),
+    "Nigéria": (6.52, 3.38), "Noruega": (59.91, 10.75), "Nova Zelândia": (-36.85, 174.76),
+    "Omã": (23.59, 58.41), "Palau": (7.50, 134.62), "Palestina (Estado da)": (31.90, 35.20),
+    "Panamá": (8.98, -79.52), "Papua-Nova Guiné": (-9.44, 147.18), "Paquistão": (24.86, 67.01),
+    "Paraguai": (-25.26, -57.58), "Peru": (-12.05, -77.04), "Polônia": (52.23, 21.01),
+    "Portugal": (38.72, -9.14), "Quênia": (-1.29, 36.82), "Quirguistão": (42.87, 74.59),
+    "Reino Unido": (51.51, -0.13), "República Centro-Africana": (4.39, 18.56),
+    "República Democrática do Congo": (-4.44, 15.27), "República Dominicana": (18.49, -69.93),
+    "República Tcheca": (50.08, 14.44), "Romênia": (44.43, 26.10), "Ruanda": (-1.94, 30.06),
+    "Rússia": (55.76, 37.62), "Samoa": (-13.83, -171.76), "Santa Lúcia": (14.01, -60.99),
+    "São Cristóvão e Névis": (17.30, -62.72), "São Marinho": (43.94, 12.45), "São Tomé e Príncipe": (0.34, 6.73),
+    "São Vicente e Granadinas": (13.16, -61.23), "Seicheles": (-4.62, 55.45), "Senegal": (14.72, -17.47),
+    "Serra Leoa": (8.48, -13.23), "Sérvia": (44.79, 20.45), "Singapura": (1.35, 103.82),
+    "Síria": (33.51, 36.29), "Somália": (2.05, 45.32), "Sri Lanka": (6.93, 79.86),
+    "Sudão": (15.50, 32.56), "Sudão do Sul": (4.85, 31.58), "Suécia": (59.33, 18.07),
+    "Suíça": (47.38, 8.54), "Suriname": (5.85, -55.20), "Tailândia": (13.76, 100.50),
+    "Tajiquistão": (38.56, 68.79), "Tanzânia": (-6.79, 39.21), "Timor-Leste": (-8.56, 125.56),
+    "Togo": (6.13, 1.22), "Tonga": (-21.14, -175.20), "Trinidad e Tobago": (10.65, -61.51),
+    "Tunísia": (36.81, 10.18), "Turcomenistão": (37.96, 58.33), "Turquia": (41.01, 28.98),
+    "Tuvalu": (-8.52, 179.20), "Ucrânia": (50.45, 30.52), "Uganda": (0.35, 32.58),
+    "Uruguai": (-34.90, -56.16), "Uzbequistão": (41.30, 69.24), "Vanuatu": (-17.73, 168.32),
+    "Vaticano (Santa Sé)": (41.90, 12.45), "Venezuela": (10.48, -66.90), "Vietnã": (21.03, 105.85),
+    "Zâmbia": (-15.39, 28.32), "Zimbábue": (-17.83, 31.05),
+}
 
+# Capitais dos estados: para quem vem do Brasil, o estado substitui o país
+COORDENADAS_ESTADOS = {
+    "Acre": (-9.97, -67.81), "Alagoas": (-9.67, -35.74), "Amapá": (0.03, -51.07),
+    "Amazonas": (-3.12, -60.02), "Bahia": (-12.97, -38.50), "Ceará": (-3.73, -38.52),
+    "Distrito Federal": (-15.79, -47.88), "Espírito Santo": (-20.32, -40.34), "Goiás": (-16.69, -49.26),
+    "Maranhão": (-2.53, -44.30), "Mato Grosso": (-15.60, -56.10), "Mato Grosso do Sul": (-20.47, -54.62),
+    "Minas Gerais": (-19.92, -43.94), "Pará": (-1.46, -48.50), "Paraíba": (-7.12, -34.86),
+    "Paraná": (-25.43, -49.27), "Pernambuco": (-8.05, -34.88), "Piauí": (-5.09, -42.80),
+    "Rio de Janeiro": (-22.91, -43.17), "Rio Grande do Norte": (-5.79, -35.21), "Rio Grande do Sul": (-30.03, -51.23),
+    "Rondônia": (-8.76, -63.90), "Roraima": (2.82, -60.67), "Santa Catarina": (-27.60, -48.55),
+    "São Paulo": (-23.55, -46.63), "Sergipe": (-10.91, -37.07), "Tocantins": (-10.18, -48.33),
+}
 
+RAIO_TERRA_KM = 6371.0
+# Trajeto real / distância em linha reta: estradas e trilhos fazem curvas, voos quase não
+FATORES_ROTA = {'avião': 1.1}
+FATOR_ROTA_TERRESTRE = 1.3
+# Abaixo disso (ida, em linha reta) a referência é imprecisa demais para conferir a resposta:
+# quem mora perto do evento, ou no próprio país quando só o país é conhecido
+VERIFICACAO_DISTANCIA_MINIMA_KM = {'estado': 150, 'pais': 1000}
+# A distância informada (ida e volta) é sinalizada fora de [estimada / fator, estimada * fator]
+VERIFICACAO_DISTANCIA_FATOR = 3.0
 
+# Origens numa ordem fixa, com as coordenadas em radianos prontas para o cálculo vetorizado
+ORIGENS_DISTANCIA = [('estado', nome) for nome in COORDENADAS_ESTADOS] + [('pais', nome) for nome in COORDENADAS_PAISES]
+_COORDENADAS_ORIGENS = np.radians(np.array(
+    [COORDENADAS_ESTADOS[nome] if tipo == 'estado' else COORDENADAS_PAISES[nome] for tipo, nome in ORIGENS_DISTANCIA]))
 
+def distancias_grande_circulo(latitude, longitude, coordenadas_rad=None):
+    """Distância em linha reta (km, fórmula de haversine) de cada origem até o ponto, de uma vez"""
+    origens = _COORDENADAS_ORIGENS if coordenadas_rad is None else coordenadas_rad
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    dlat = origens[:, 0] - lat
+    dlon = origens[:, 1] - lon
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(origens[:, 0]) * np.sin(dlon / 2) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
 
-def gerar_grafico_base64():
-    """Gera 4 gráficos: transportes (chegada/diário), emissões por transporte e econômico"""
-    try:
-        with app.app_context():
-            respostas = RespostaEmissao.query.all()
-        
-        if not respostas:
-            return None
-        
-        # ===== PREPARAÇÃO DOS DADOS =====
-        transporte_chegada = {}
-        transporte_diario = {}
-        
-        emissoes_transporte = {transp: 0 for transp in EMISSOES_TRANSPORTE.keys()}
-        
-        # Acumuladores para dados econômicos
-        gastos = {
-            'alimentacao': 0,
-            'equipamentos': 0,
-            'botes': 0,
-            'hospedagem': 0,
-            'transporte_chegada': 0,
-            'transporte_diario': 0
-        }
-        
-        total_respostas = len(respostas)
-        
-        for resposta in respostas:
-            # Contagem de transportes (chegada)
-            transp_chegada = resposta.transporte_cidade
-            transporte_chegada[transp_chegada] = transporte_chegada.get(transp_chegada, 0) + 1
-            
-            # Contagem de transportes (diário)
-            transp_diario = resposta.transporte_local
-            transporte_diario[transp_diario] = transporte_diario.get(transp_diario, 0) + 1
-            
-            # Emissões por tipo de transporte (usando o transporte de chegada)
-            if transp_chegada in emissoes_transporte:
-                emissoes_transporte[transp_chegada] += float(resposta.emissao_total)
-            
-            # Acumular gastos econômicos
-            if resposta.custo_transporte:
-                # 🚗 Transporte de Chegada: multiplicado por 1.5
-                gastos['transporte_chegada'] += float(resposta.custo_transporte)
-            if resposta.custo_transporte_diario:
-                gastos['transporte_diario'] += float(resposta.custo_transporte_diario)*1.5
-            if resposta.gasto_alimentacao:
-                gastos['alimentacao'] += float(resposta.gasto_alimentacao)*1.5
-            if resposta.gasto_equipamentos:
-                gastos['equipamentos'] += float(resposta.gasto_equipamentos)*1.5
-            if resposta.gasto_botes:
-                gastos['botes'] += float(resposta.gasto_botes)*1.5
-            if hasattr(resposta, 'gasto_hospedagem') and resposta.gasto_hospedagem:
-                gastos['hospedagem'] += float(resposta.gasto_hospedagem)*1.5
-        
-        # ===== CRIAÇÃO DOS GRÁFICOS =====
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
-        fig.suptitle('Análise de Sustentabilidade e Impacto Econômico - Regata', 
-                    fontsize=16, fontweight='bold', y=0.98, color='#1a3b5d')
-        
-        # Palheta de cores personalizada: azul, verde e amarelo
-        palheta_cores = ["#1CE074", "#0B9A5F", "#026C26", "#27A8DC", "#2775E2", "#054976"]
-        
-        # ===== GRÁFICO 1: Transporte para CHEGAR =====
-        if transporte_chegada:
-            transportes_ord = sorted(transporte_chegada.items(), key=lambda x: x[1], reverse=True)
-            labels = [f"{t[0].capitalize()}" for t in transportes_ord]
-            valores = [t[1] for t in transportes_ord]
-            
-            cores_barras = [palheta_cores[i % len(palheta_cores)] for i in range(len(valores))]
-            
-            bars = ax1.bar(range(len(valores)), valores, color=cores_barras, 
-                          edgecolor='#2c3e50', linewidth=1.5, alpha=0.9)
-            ax1.set_xticks(range(len(valores)))
-            ax1.set_xticklabels(labels, rotation=45, ha='right', fontsize=9, fontweight='500')
-            
-            for bar, valor in zip(bars, valores):
-                height = bar.get_height()
-                ax1.text(bar.get_x() + bar.get_width()/2., height + 0.1,
-                        f'{valor}', ha='center', va='bottom', fontsize=10, 
-                        fontweight='bold', color='#1a3b5d')
-            
-            ax1.set_title('Transporte mais utilizado para CHEGAR ao evento', 
-                         fontsize=12, fontweight='bold', pad=15, color='#1a3b5d')
-            ax1.set_ylabel('Número de participantes', fontsize=10, fontweight='500', color='#2c3e50')
-            ax1.grid(axis='y', alpha=0.2, linestyle='--', color='#95a5a6')
-            from matplotlib.ticker import MaxNLocator
-            ax1.yaxis.set_major_locator(MaxNLocator(integer=True))
-            
-            ax1.spines['top'].set_visible(False)
-            ax1.spines['right'].set_visible(False)
-        
-        # ===== GRÁFICO 2: Transporte no DIA A DIA =====
-        if transporte_diario:
-            transportes_ord = sorted(transporte_diario.items(), key=lambda x: x[1], reverse=True)
-            labels = [f"{t[0].capitalize()}" for t in transportes_ord]
-            valores = [t[1] for t in transportes_ord]
-            
-            cores_barras = [palheta_cores[(i+2) % len(palheta_cores)] for i in range(len(valores))]
-            
-            bars = ax2.bar(range(len(valores)), valores, color=cores_barras,
-                          edgecolor='#2c3e50', linewidth=1.5, alpha=0.9)
-            ax2.set_xticks(range(len(valores)))
-            ax2.set_xticklabels(labels, rotation=45, ha='right', fontsize=9, fontweight='500')
-            
-            for bar, valor in zip(bars, valores):
-                height = bar.get_height()
-                ax2.text(bar.get_x() + bar.get_width()/2., height + 0.1,
-                        f'{valor}', ha='center', va='bottom', fontsize=10,
-                        fontweight='bold', color='#1a3b5d')
-            
-            ax2.set_title('Transporte mais utilizado no DIA A DIA do evento', 
-                         fontsize=12, fontweight='bold', pad=15, color='#1a3b5d')
-            ax2.set_ylabel('Número de participantes', fontsize=10, fontweight='500', color='#2c3e50')
-            ax2.grid(axis='y', alpha=0.2, linestyle='--', color='#95a5a6')
-            ax2.yaxis.set_major_locator(MaxNLocator(integer=True))
-            
-            ax2.spines['top'].set_visible(False)
-            ax2.spines['right'].set_visible(False)
-        
-        # ===== GRÁFICO 3: Distribuição de Emissões por Tipo de Transporte (PIZZA TRADICIONAL) =====
-        if any(emissoes_transporte.values()):
-            transportes_validos = {k: v for k, v in emissoes_transporte.items() if v > 0}
-            
-            if transportes_validos:
-                labels = [k.capitalize() for k in transportes_validos.keys()]
-                valores = list(transportes_validos.values())
-                total_emissoes = sum(valores)
-                
-                dados_ordenados = sorted(zip(labels, valores), key=lambda x: x[1], reverse=True)
-                labels = [d[0] for d in dados_ordenados]
-                valores = [d[1] for d in dados_ordenados]
-                
-                percentuais = [(v/total_emissoes)*100 for v in valores]
-                
-                cores_pizza = [palheta_cores[i % len(palheta_cores)] for i in range(len(valores))]
-                
-                explode = [0.03 if v == max(valores) else 0 for v in valores]
-                
-                wedges, texts, autotexts = ax3.pie(
-                    valores, 
-                    labels=labels, 
-                    autopct=lambda pct: f'{pct:.1f}%\n({(pct/100)*total_emissoes:,.0f} kg)',
-                    colors=cores_pizza,
-                    explode=explode,
-                    shadow=True,
-                    startangle=90,
-                    textprops={'fontsize': 8}
-                )
-                
-                # Formatação dos textos
-                for text in texts:
-                    text.set_fontsize(9)
-                    text.set_fontweight('500')
-                    text.set_color('#2c3e50')
-                
-                for autotext in autotexts:
-                    autotext.set_fontsize(7)
-                    autotext.set_color('white')
-                    autotext.set_fontweight('bold')
-                    autotext.set_bbox(dict(facecolor='#2c3e50', alpha=0.6, 
-                                          edgecolor='none', pad=1.5))
-                
-                ax3.set_title(f'Distribuição de Emissões por Tipo de Transporte\nTotal: {total_emissoes:,.0f} kgCO₂', 
-                             fontsize=12, fontweight='bold', pad=15, color='#1a3b5d')
-        
-        # ===== GRÁFICO 4: Distribuição Econômica por Categoria =====
-        if any(gastos.values()):
-            categorias_validas = {k: v for k, v in gastos.items() if v > 0}
-            
-            if categorias_validas:
-                nomes_categorias = {
-                    'alimentacao': 'Alimentação',
-                    'equipamentos': 'Equipamentos',
-                    'botes': 'Aluguel de Botes',
-                    'hospedagem': 'Hospedagem',
-                    'transporte_chegada': 'Transporte (Chegada)',
-                    'transporte_diario': 'Transporte (Diário)'
-                }
-                
-                labels = [nomes_categorias[k] for k in categorias_validas.keys()]
-                valores = list(categorias_validas.values())
-                total_gastos = sum(valores)
-                
-                dados_ordenados = sorted(zip(labels, valores), key=lambda x: x[1], reverse=True)
-                labels = [d[0] for d in dados_ordenados]
-                valores = [d[1] for d in dados_ordenados]
-                
-                cores_pizza = [palheta_cores[(i+3) % len(palheta_cores)] for i in range(len(valores))]
-                
-                explode = [0.05 if v == max(valores) else 0 for v in valores]
-                
-                wedges, texts, autotexts = ax4.pie(
-                    valores, 
-                    labels=labels, 
-                    autopct=lambda pct: f'R$ {(pct/100)*total_gastos:,.0f}',
-                    colors=cores_pizza,
-                    explode=explode,
-                    shadow=True,
-                    startangle=90,
-                    textprops={'fontsize': 8}
-                )
-                
-                for text in texts:
-                    text.set_fontsize(9)
-                    text.set_fontweight('500')
-                    text.set_color('#2c3e50')
-                
-                for autotext in autotexts:
-                    autotext.set_fontsize(8)
-                    autotext.set_color('white')
-                    autotext.set_fontweight('bold')
-                    autotext.set_bbox(dict(facecolor='#2c3e50', alpha=0.5, 
-                                          edgecolor='none', pad=1))
-                
-                ax4.set_title(f'Distribuição Econômica por Categoria\nTotal: R$ {total_gastos:,.2f}', 
-                             fontsize=12, fontweight='bold', pad=15, color='#1a3b5d')
-        
-        plt.tight_layout()
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', bbox_inches='tight', dpi=100, 
-                   facecolor='white', edgecolor='none')
-        buffer.seek(0)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        plt.close()
-        
-        return image_base64
-        
-    except Exception as e:
-        print(f"Erro ao gerar gráfico: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+@lru_cache(maxsize=16)
+def tabela_distancias(latitude, longitude):
+    """{(tipo, nome): km em linha reta} de todas as origens até o local; calculada uma vez por local de evento"""
+    return dict(zip(ORIGENS_DISTANCIA, distancias_grande_circulo(latitude, longitude).tolist()))
 
+def origem_distancia(pais, estado=None):
+    """Origem mais precisa conhecida: o estado para quem vem do Brasil, senão o país (ou None)"""
+    if pais == 'Brasil' and estado in COORDENADAS_ESTADOS:
+        return ('estado', estado)
+    if pais in COORDENADAS_PAISES:
+        return ('pais', pais)
+    return None
 
+def distancia_estimada(local, pais, estado=None, transporte=None):
+    """(km ida e volta estimados, origem usada) até o local (lat, lon); (None, None) sem referência"""
+    origem = origem_distancia(pais, estado)
+    if local is None or origem is None:
+        return None, None
+    linha_reta = tabela_distancias(*local)[origem]
+    return 2 * linha_reta * FATORES_ROTA.get(transporte, FATOR_ROTA_TERRESTRE), origem
 
-def emoji_para_imagem(emoji, tamanho=12):
-    """Converte emoji em imagem base64"""
+def resolver_local(texto):
+    """Coordenadas (lat, lon) de um texto 'lat,lon' ou do nome de um estado/país da tabela; levanta ValueError"""
+    texto = (texto or '').strip()
+    if texto in COORDENADAS_ESTADOS:
+        return COORDENADAS_ESTADOS[texto]
+    if texto in COORDENADAS_PAISES:
+        return COORDENADAS_PAISES[texto]
     try:
-        fig, ax = plt.subplots(figsize=(tamanho/24, tamanho/24))
-        ax.text(0.5, 0.5, emoji, fontsize=tamanho, ha='center', va='center')
-        ax.axis('off')
-        
-        buffer = BytesIO()
-        plt.savefig(buffer, format='png', bbox_inches='tight', 
-                   pad_inches=0, transparent=True, dpi=100)
-        buffer.seek(0)
-        plt.close()
-        
-        return ImageReader(buffer)
-    except:
-        return None
+        latitude, longitude = (float(parte) for parte in texto.split(','))
+    except ValueError:
+        raise ValueError(f"Local inválido: '{texto}' (use 'lat,lon' ou o nome de um estado ou país)")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f"Coordenadas fora do intervalo: {latitude}, {longitude}")
+    return latitude, longitude
 
-def criar_linha_com_emoji(emoji, texto, estilo, tamanho_emoji=12):
-    """Cria uma linha com emoji como imagem"""
-    try:
-        img_emoji = emoji_para_imagem(emoji, tamanho_emoji)
-        if img_emoji:
-            img_obj = Image(img_emoji, width=4*mm, height=4*mm)
-            
-            dados_linha = [
-                [img_obj, Paragraph(texto, estilo)]
-            ]
-            tabela = Table(dados_linha, colWidths=[6*mm, 150*mm])
-            tabela.setStyle(TableStyle([
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('LEFTPADDING', (0, 0), (-1, -1), 2),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 2),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
-            ]))
-            return tabela
-        else:
-            return Paragraph(f"• {texto}", estilo)
-    except Exception as e:
-        print(f"Erro ao criar linha com emoji: {e}")
-        return Paragraph(f"• {texto}", estilo)
+def avaliar_distancias_declaradas(lista_campos, local):
+    """Motivos de revisão por resposta quando a distância informada destoa muito da geografia"""
+    motivos = [[] for _ in lista_campos]
+    if local is None or not lista_campos:
+        return motivos
+    tabela = tabela_distancias(*local)
+    origens = [origem_distancia(campos['pais_origem_pt'], campos.get('estado_origem')) for campos in lista_campos]
+    # Sem o estado, o Brasil inteiro é uma origem vaga demais para a verificação
+    origens = [None if origem == ('pais', 'Brasil') else origem for origem in origens]
+    linha_reta = np.array([tabela[origem] if origem else np.nan for origem in origens])
+    minimos = np.array([VERIFICACAO_DISTANCIA_MINIMA_KM[origem[0]] if origem else np.inf for origem in origens])
+    fatores = np.array([FATORES_ROTA.get(campos['transporte_cidade'], FATOR_ROTA_TERRESTRE) for campos in lista_campos])
+    estimadas = 2 * linha_reta * fatores
+    declaradas = np.array([float(campos['distancia_cidade']) for campos in lista_campos])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        razao = declaradas / estimadas
+        destoantes = np.flatnonzero((linha_reta >= minimos) & (
+            (razao > VERIFICACAO_DISTANCIA_FATOR) | (razao < 1 / VERIFICACAO_DISTANCIA_FATOR)))
+    for i in destoantes:
+        motivos[i].append(f"distancia_cidade: {declaradas[i]:g} km, estimada {estimadas[i]:.0f} km "
+                          f"a partir de {origens[i][1]}")
+    return motivos
 
-def gerar_pdf(registro):
-    """Gera PDF com os resultados do questionário - TABELAS SEPARADAS PT/EN"""
-    try:
-        buffer = BytesIO()
-        
-        doc = SimpleDocTemplate(
-            buffer, 
-            pagesize=A4,
-            rightMargin=72, 
-            leftMargin=72,
-            topMargin=72, 
-            bottomMargin=18,
-            title=f"Emissão CO2e - {registro['email']} | CO2e Emissions - {registro['email']}"
-        )
-        
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # ===== ESTILOS PERSONALIZADOS =====
-        estilo_titulo = ParagraphStyle(
-            'TituloPrincipal',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=15,
-            textColor=colors.HexColor('#2c3e50'),
-            alignment=1
-        )
-        
-        estilo_titulo_en = ParagraphStyle(
-            'TituloIngles',
-            parent=styles['Normal'],
-            fontSize=12,
-            textColor=colors.HexColor('#666666'),
-            alignment=1,
-            fontName='Helvetica-Oblique'
-        )
-        
-        estilo_subtitulo = ParagraphStyle(
-            'Subtitulo',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=8,
-            textColor=colors.HexColor('#34495e')
-        )
-        
-        estilo_subtitulo_en = ParagraphStyle(
-            'SubtituloIngles',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#666666'),
-            spaceAfter=10,
-            fontName='Helvetica-Oblique'
-        )
-        
-        estilo_normal = ParagraphStyle(
-            'NormalCustom',
-            parent=styles['Normal'],
-            fontSize=10,
-            spaceAfter=6
-        )
-        
-        estilo_normal_en = ParagraphStyle(
-            'NormalIngles',
-            parent=styles['Normal'],
-            fontSize=8,
-            textColor=colors.HexColor('#666666'),
-            spaceAfter=8,
-            fontName='Helvetica-Oblique'
-        )
-        
-        estilo_destaque = ParagraphStyle(
-            'Destaque',
-            parent=styles['Normal'],
-            fontSize=12,
-            textColor=colors.HexColor('#27ae60'),
-            alignment=1,
-            spaceAfter=15
-        )
-        
-        estilo_destaque_en = ParagraphStyle(
-            'DestaqueIngles',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.HexColor('#666666'),
-            alignment=1,
-            spaceAfter=20,
-            fontName='Helvetica-Oblique'
-        )
 
-        # ===== CABEÇALHO BILINGUE =====
-        titulo_pt = "Cada Deslocamento Conta: Seu Impacto em CO2e no Evento"
-        titulo_en = translations.get(titulo_pt, "Every Trip Counts: Your CO2e Impact at the Event")        
-        elements.append(Paragraph(titulo_pt, estilo_titulo))
-        elements.append(Paragraph(titulo_en, estilo_titulo_en))
-        elements.append(Spacer(1, 15))
-        # Linha divisória
-        linha_divisoria = Table([[""]], colWidths=[16*cm], rowHeights=[1])
-        linha_divisoria.setStyle(TableStyle([
-            ('LINEABOVE', (0,0), (-1,-1), 1, colors.HexColor('#3498db')),
-            ('LINEBELOW', (0,0), (-1,-1), 1, colors.HexColor('#3498db')),
-        ]))
-        elements.append(linha_divisoria)
-        elements.append(Spacer(1, 20))
-
-        # ===== DADOS DO PARTICIPANTE - SEPARADO PT/EN =====
-        
-        elements.append(Paragraph("DADOS DO PARTICIPANTE", estilo_subtitulo))
-        
-        tipo_traduzido = translations.get(registro['tipo_participante'])
+# ===== AGREGADOS DO EVENTO =====
+# Fatores aplicados aos gastos informados (o transporte de chegada não é multiplicado)
+FATORES_GASTOS = {
+    'alimentacao': ('gasto_alimentacao', 1.5),
+    'equipamentos': ('gasto_equipamentos', 1.5),
+    'botes': ('gasto_botes', 1.5),
+    'hospedagem': ('gasto_hospedagem', 1.5),
+    'transporte_chegada': ('custo_transporte', 1.0),
+    'transporte_diario': ('custo_transporte_diario', 1.5),
+}
 
-        
-        # TABELA EM PORTUGUÊS
-        dados_pessoais_pt = [
-            ["País de Origem:", registro['pais_origem_pt']],  # Nova linha
-            ["Tipo de Participante:", registro['tipo_participante']],
-            ["Email:", registro['email']],
-        ]
-        
-        tabela_dados_pt = Table(dados_pessoais_pt, colWidths=[4*cm, 10*cm])
-        tabela_dados_pt.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'Helvetica', 10),
-            ('FONT', (0,0), (0,-1), 'Helvetica-Bold', 10),
-            ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#ecf0f1')),
-            ('TEXTCOLOR', (0,0), (-1,-1), colors.black),
-            ('ALIGN', (0,0), (0,-1), 'LEFT'),
-            ('ALIGN', (1,0), (1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#bdc3c7')),
-            ('PADDING', (0,0), (-1,-1), 6),
-        ]))
-        
-        elements.append(tabela_dados_pt)
-        elements.append(Spacer(1, 10))
-        
-        # TÍTULO INGLÊS
-        elements.append(Paragraph("PARTICIPANT DATA", estilo_subtitulo_en))
-        
-        # TABELA EM INGLÊS
-        dados_pessoais_en = [
-            ["Country of Origin:", registro['pais_origem_en']],
-            ["Participant Type:", tipo_traduzido],
-            ["Email:", registro['email']],
-        ]
-        
-        tabela_dados_en = Table(dados_pessoais_en, colWidths=[4*cm, 10*cm])
-        tabela_dados_en.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'Helvetica-Oblique', 9),
-            ('FONT', (0,0), (0,-1), 'Helvetica-BoldOblique', 9),
-            ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#f9f9f9')),
-            ('TEXTCOLOR', (0,0), (-1,-1), colors.HexColor('#666666')),
-            ('ALIGN', (0,0), (0,-1), 'LEFT'),
-            ('ALIGN', (1,0), (1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#d5dbdb')),
-            ('PADDING', (0,0), (-1,-1), 6),
-        ]))
-        
-        elements.append(tabela_dados_en)
-        elements.append(Spacer(1, 25))
+# Respostas em quarentena ('pendente') ou rejeitadas na revisão ficam fora de agregados e cenários
+SITUACOES_NOS_AGREGADOS = ('aceita', 'sinalizada')
 
-        # ===== RESUMO DA EMISSÃO - SEPARADO PT/EN =====
-        
-        emissao_local = EMISSOES_TRANSPORTE.get(registro['transporte_local'], 5.0) * registro['distancia_local'] * registro['dias_evento']
-        emissao_principal = registro['emissao_total'] - emissao_local
-        
-        elements.append(Paragraph("RESUMO DA EMISSÃO", estilo_subtitulo))
-        elements.append(Paragraph(f"TOTAL DE EMISSÕES: {registro['emissao_total']:.2f} kgCO2e", estilo_destaque))
-        
-        transporte_cidade_pt = registro['transporte_cidade'].capitalize()
-        transporte_cidade_en = translations.get(registro['transporte_cidade']) or "City Transport"
-        
-        transporte_local_pt = registro['transporte_local'].capitalize()
-        transporte_local_en = translations.get(registro['transporte_local']) or "Local Commute"
-        
-        # TABELA EM PORTUGUÊS
-        detalhes_emissao_pt = [
-            ["Tipo de Deslocamento", "Transporte", "Distância", "Emissão (kgCO2e)"],
-            [
-                "Até a cidade do evento", 
-                transporte_cidade_pt, 
-                f"{registro['distancia_cidade']} km", 
-                f"{emissao_principal:.2f}"
-            ],
-            [
-                "Deslocamento local", 
-                transporte_local_pt, 
-                f"{registro['distancia_local']} km/dia × {registro['dias_evento']} dias", 
-                f"{emissao_local:.2f}"
-            ],
-            ["TOTAL", "", "", f"{registro['emissao_total']:.2f} kgCO2e"]
-        ]
-        
-        tabela_emissao_pt = Table(detalhes_emissao_pt, colWidths=[5.5*cm, 3*cm, 4*cm, 3.5*cm])
-        tabela_emissao_pt.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'Helvetica', 9),
-            ('FONT', (0,0), (-1,0), 'Helvetica-Bold', 10),
-            ('FONT', (0,-1), (-1,-1), 'Helvetica-Bold', 10),
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#3498db')),
-            ('BACKGROUND', (0,-1), (-1,-1), colors.HexColor('#27ae60')),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-            ('TEXTCOLOR', (0,-1), (-1,-1), colors.white),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#7f8c8d')),
-            ('PADDING', (0,0), (-1,-1), 8),
-        ]))
-        
-        elements.append(tabela_emissao_pt)
-        elements.append(Spacer(1, 15))
-        
-        elements.append(Paragraph("EMISSIONS SUMMARY", estilo_subtitulo_en))
-        elements.append(Paragraph(f"<font color='#666666'><i>TOTAL EMISSIONS: {registro['emissao_total']:.2f} kgCO2</i></font>", estilo_destaque_en))
-        
-        detalhes_emissao_en = [
-            ["Trip Type", "Transport", "Distance", "Emissions (kgCO2e)"],
-            [
-                "To the event city", 
-                transporte_cidade_en, 
-                f"{registro['distancia_cidade']} km", 
-                f"{emissao_principal:.2f}"
-            ],
-            [
-                "Local commute", 
-                transporte_local_en, 
-                f"{registro['distancia_local']} km/day × {registro['dias_evento']} days", 
-                f"{emissao_local:.2f}"
-            ],
-            ["TOTAL", "", "", f"{registro['emissao_total']:.2f} kgCO2e"]
-        ]
-        
-        tabela_emissao_en = Table(detalhes_emissao_en, colWidths=[5.5*cm, 3*cm, 4*cm, 3.5*cm])
-        tabela_emissao_en.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'Helvetica-Oblique', 9),
-            ('FONT', (0,0), (-1,0), 'Helvetica-BoldOblique', 10),
-            ('FONT', (0,-1), (-1,-1), 'Helvetica-BoldOblique', 10),
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#5dade2')),
-            ('BACKGROUND', (0,-1), (-1,-1), colors.HexColor('#58d68d')),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-            ('TEXTCOLOR', (0,-1), (-1,-1), colors.white),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#aab7b8')),
-            ('PADDING', (0,0), (-1,-1), 8),
-        ]))
-        
-        elements.append(tabela_emissao_en)
-        elements.append(Spacer(1, 25))
+def filtrar_agregaveis(consulta, id_inicio=None, id_fim=None):
+    """filtrar_intervalo mais a exclusão das respostas que não entram nos agregados"""
+    return filtrar_intervalo(consulta, id_inicio, id_fim).filter(
+        RespostaEmissao.situacao.in_(SITUACOES_NOS_AGREGADOS))
 
-        # ===== COMPARAÇÕES AMBIENTAIS - SEPARADO PT/EN =====
-        
-        arvores = registro['emissao_total'] / 7000000  # 1 árvore absorve ~7.000.000g CO2/ano ou 7 toneladas de CO2/ano
-        lampadas = registro['emissao_total'] / 450   # 1 lâmpada LED/dia
-        
-        elements.append(Paragraph("IMPACTO AMBIENTAL - EQUIVALÊNCIAS", estilo_subtitulo))
-        
-        comparativos_pt = [
-            ["Equivalência", "Valor Aproximado"],
-            ["Árvores para absorver em 1 ano", f"{arvores:.2f} árvores"],
-            ["Horas de lâmpada LED (60W)", f"{lampadas:.1f} horas"],
-            ["Emissão diária média brasileira*", "≈ 12 kgCO2e"]
-        ]
-        
-        tabela_comparativo_pt = Table(comparativos_pt, colWidths=[9*cm, 7*cm])
-        tabela_comparativo_pt.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'Helvetica', 9),
-            ('FONT', (0,0), (-1,0), 'Helvetica-Bold', 10),
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#e67e22')),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#d35400')),
-            ('PADDING', (0,0), (-1,-1), 8),
-        ]))
-        
-        elements.append(tabela_comparativo_pt)
-        
-        nota_pt = Paragraph(
-            "* Baseado na média brasileira de 4.4 toneladas de CO2e per capita/ano",
-            ParagraphStyle('Nota', parent=estilo_normal, fontSize=8, textColor=colors.gray)
-        )
-        elements.append(nota_pt)
-        elements.append(Spacer(1, 15))
-        
-        elements.append(Paragraph("ENVIRONMENTAL IMPACT - EQUIVALENCES", estilo_subtitulo_en))
-        
-        comparativos_en = [
-            ["Equivalence", "Approximate Value"],
-            ["Trees to absorb in 1 year", f"{arvores:.2f} trees"],
-            ["Hours of LED bulb (60W)", f"{lampadas:.1f} hours"],
-            ["Average daily Brazilian emission*", "≈ 12 kgCO2e"]
-        ]
-        
-        tabela_comparativo_en = Table(comparativos_en, colWidths=[9*cm, 7*cm])
-        tabela_comparativo_en.setStyle(TableStyle([
-            ('FONT', (0,0), (-1,-1), 'Helvetica-Oblique', 9),
-            ('FONT', (0,0), (-1,0), 'Helvetica-BoldOblique', 10),
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f39c12')),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-            ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('GRID', (0,0), (-1,-1), 1, colors.HexColor('#e67e22')),
-            ('PADDING', (0,0), (-1,-1), 8),
-        ]))
-        
-        elements.append(tabela_comparativo_en)
-        
-        nota_en = Paragraph(
-            "<font color='#666666'><i>* Based on the Brazilian average of 4.4 tons of CO2e per capita/year</i></font>",
-            ParagraphStyle('Nota', parent=estilo_normal, fontSize=8, textColor=colors.gray)
-        )
-        elements.append(nota_en)
-        elements.append(Spacer(1, 25))
+def calcular_agregados(id_inicio=None, id_fim=None):
+    """Séries agregadas do evento, do arquivo do evento ou do cache compartilhado pela versão dos dados"""
+    arquivados = agregados_arquivados(id_inicio, id_fim)
+    if arquivados is not None:
+        return arquivados
 
-        # ===== RECOMENDAÇÕES - LISTAS SEPARADAS PT/EN =====
-        
-        elements.append(Paragraph("RECOMENDAÇÕES PARA REDUZIR EMISSÕES", estilo_subtitulo))
-        
-        recomendacoes_pt = [
-            " Escolha acomodações próximas ao local do evento, reduzindo a necessidade de transporte motorizado",
-            " Para distâncias curtas, opte por caminhar ou pedalar, formas ativas e sustentáveis de locomoção que também favorecem a saúde e o bem-estar",
-            " Prefira transportes públicos ou coletivos para deslocamentos sempre que possível",
-            " Organize caronas solidárias com outros participantes, otimizando o uso dos veículos e diminuindo o número de deslocamentos individuais",
-            " Planeje seus deslocamentos com antecedência para evitar horários de tráfego intenso e, consequentemente, o aumento do consumo de combustível",
-            " Dê preferência a veículos elétricos ou híbridos, quando disponíveis, para minimizar o impacto ambiental dos deslocamentos", 
-            " Compense emissões participando de programas de reflorestamento ou outras iniciativas ambientais reconhecidas"
-        ]
-        
-        for rec_pt in recomendacoes_pt:
-            elements.append(Paragraph(f"• {rec_pt}", estilo_normal))
-            elements.append(Spacer(1, 4))
-        
-        elements.append(Spacer(1, 15))
-        
-        elements.append(Paragraph("RECOMMENDATIONS TO REDUCE EMISSIONS", estilo_subtitulo_en))
-        
-        recomendacoes_en = [
-            " Choose accommodations close to the event venue, reducing the need for motorized transport",
-            " For short distances, choose walking or cycling, active and sustainable forms of mobility that also promote health and well-being",
-            " Prefer public or collective transportation whenever possible",
-            " Organize carpooling with other participants, optimizing vehicle use and reducing the number of individual trips",
-            " Plan your trips in advance to avoid peak traffic times and consequently reduce fuel consumption",
-            " Prefer electric or hybrid vehicles when available to minimize the environmental impact of travel", 
-            " Compensate emissions by participating in reforestation programs or other recognized environmental initiatives"
-        ]
-        
-        for rec_en in recomendacoes_en:
-            elements.append(Paragraph(f"<font color='#666666'><i>• {rec_en}</i></font>", estilo_normal_en))
-            elements.append(Spacer(1, 6))
-        
-        elements.append(Spacer(1, 20))
-
-        # ===== RODAPÉ SEPARADO PT/EN =====
-        elements.append(Spacer(1, 10))
-        linha_rodape = Table([[""]], colWidths=[16*cm], rowHeights=[1])
-        linha_rodape.setStyle(TableStyle([
-            ('LINEABOVE', (0,0), (-1,-1), 1, colors.HexColor('#95a5a6')),
-        ]))
-        elements.append(linha_rodape)
-        
-        rodape_pt = Paragraph(
-            "Calculadora de Emissão de CO2e - Eventos Esportivos Sustentáveis<br/>" +
-            "Uma iniciativa da parceria entre CBVela e ETTA/UFF com o apoio do CNPq e Faperj para promover a conscientização ambiental em eventos esportivos",
-            ParagraphStyle(
-                'Rodape', 
-                parent=estilo_normal, 
-                fontSize=9, 
-                alignment=1, 
-                textColor=colors.HexColor('#7f8c8d'),
-                spaceBefore=10
-            )
-        )
-        elements.append(rodape_pt)
-        
-        elements.append(Spacer(1, 10))
-        
-        rodape_en = Paragraph(
-            "<font color='#666666'><i>CO2e Emissions Calculator - Sustainable Sporting Events<br/>" +
-            "An initiative of the partnership between CBVela and ETTA/UFF with support from CNPq and Faperj to promote environmental awareness in sporting events</i></font>",
-            ParagraphStyle(
-                'RodapeEn', 
-                parent=estilo_normal, 
-                fontSize=8, 
-                alignment=1, 
-                textColor=colors.HexColor('#95a5a6'),
-                spaceBefore=5
-            )
+    with etapa('agregados'), app.app_context():
+        caminho = cache_compartilhado.caminho('agregados', f"{id_inicio}:{id_fim}:{versao_dados()}", '.json')
+        return json.loads(cache_compartilhado.obter(
+            caminho, lambda: json.dumps(agregar_snapshot(id_inicio, id_fim)).encode('utf-8')))
+
+def agregar_no_banco(id_inicio=None, id_fim=None, sessao=None):
+    """Calcula as séries agregadas do evento com GROUP BY (referência de agregar_snapshot)"""
+    if sessao is None:
+        with app.app_context(), sessao_leitura() as sessao:
+            return agregar_no_banco(id_inicio, id_fim, sessao)
+
+    def agrupar(sessao, coluna):
+        consulta = sessao.query(
+            coluna,
+            func.count(RespostaEmissao.id),
+            func.sum(RespostaEmissao.emissao_total)
         )
-        elements.append(rodape_en)
+        return filtrar_agregaveis(consulta, id_inicio, id_fim).group_by(coluna).all()
 
-        # ===== GERAR PDF =====
-        doc.build(elements)
-        buffer.seek(0)
-        return buffer
-        
-    except Exception as e:
-        print(f"Erro ao gerar PDF detalhado: {str(e)}")
-        return gerar_pdf_simples(registro)
-    
-def gerar_pdf_simples(registro):
+    total_respostas, emissao_total = filtrar_agregaveis(sessao.query(
+        func.count(RespostaEmissao.id),
+        func.sum(RespostaEmissao.emissao_total)
+    ), id_inicio, id_fim).one()
+
+    chegada = agrupar(sessao, RespostaEmissao.transporte_cidade)
+    diario = agrupar(sessao, RespostaEmissao.transporte_local)
+    por_tipo = agrupar(sessao, RespostaEmissao.tipo_participante)
+    por_pais = agrupar(sessao, RespostaEmissao.pais_origem_pt)
+
+    somas_gastos = filtrar_agregaveis(sessao.query(*[
+        func.sum(getattr(RespostaEmissao, coluna))
+        for coluna, _ in FATORES_GASTOS.values()
+    ]), id_inicio, id_fim).one()
+
+    # Emissões por tipo de transporte (usando o transporte de chegada)
+    emissoes_transporte = {transp: 0 for transp in EMISSOES_TRANSPORTE.keys()}
+    for transporte, _, emissao in chegada:
+        if transporte in emissoes_transporte:
+            emissoes_transporte[transporte] += float(emissao or 0)
+
+    gastos = {}
+    for (categoria, (_, fator)), soma in zip(FATORES_GASTOS.items(), somas_gastos):
+        gastos[categoria] = float(soma or 0) * fator
+
+    return {
+        'total_respostas': total_respostas or 0,
+        'emissao_total': float(emissao_total or 0),
+        'transporte_chegada': {transporte: qtd for transporte, qtd, _ in chegada},
+        'transporte_diario': {transporte: qtd for transporte, qtd, _ in diario},
+        'emissoes_transporte': emissoes_transporte,
+        # {categoria: [participantes, kgCO2]}
+        'emissoes_tipo_participante': {tipo: [qtd, float(emissao or 0)] for tipo, qtd, emissao in por_tipo},
+        'paises': {pais: [qtd, float(emissao or 0)] for pais, qtd, emissao in por_pais},
+        'gastos': gastos,
+    }
+
+# Colunas do snapshot lidas por agregar_colunas
+CAMPOS_AGREGADOS = ['emissao_total', 'transporte_cidade', 'transporte_local', 'tipo_participante',
+                    'pais_origem_pt'] + [coluna for coluna, _ in FATORES_GASTOS.values()]
+
+def agregar_snapshot(id_inicio=None, id_fim=None):
+    """As séries de agregar_no_banco calculadas sobre o snapshot colunar do processo"""
+    return agregar_colunas(snapshot_respostas(id_inicio, id_fim, campos=CAMPOS_AGREGADOS))
+
+def agregar_colunas(colunas):
+    """Séries agregadas a partir de colunas do snapshot, com bincount nos códigos das categóricas"""
+    emissao = colunas['emissao_total']
+
+    def agrupar(campo):
+        codigos, categorias = colunas[f"codigo__{campo}"], colunas['categorias'][campo]
+        quantidades = np.bincount(codigos, minlength=len(categorias))
+        somas = np.bincount(codigos, weights=emissao, minlength=len(categorias))
+        # Ordenado pela categoria, como o GROUP BY
+        return sorted((categorias[i], int(quantidades[i]), round(float(somas[i]), 2))
+                      for i in np.flatnonzero(quantidades))
+
+    chegada = agrupar('transporte_cidade')
+    emissoes_transporte = {transp: 0 for transp in EMISSOES_TRANSPORTE.keys()}
+    for transporte, _, soma in chegada:
+        if transporte in emissoes_transporte:
+            emissoes_transporte[transporte] += soma
+
+    return {
+        'total_respostas': len(emissao),
+        'emissao_total': round(float(emissao.sum()), 2),
+        'transporte_chegada': {transporte: qtd for transporte, qtd, _ in chegada},
+        'transporte_diario': {transporte: qtd for transporte, qtd, _ in agrupar('transporte_local')},
+        'emissoes_transporte': emissoes_transporte,
+        'emissoes_tipo_participante': {tipo: [qtd, soma] for tipo, qtd, soma in agrupar('tipo_participante')},
+        'paises': {pais: [qtd, soma] for pais, qtd, soma in agrupar('pais_origem_pt')},
+        'gastos': {
+            categoria: round(float(np.nansum(colunas[coluna])), 2) * fator
+            for categoria, (coluna, fator) in FATORES_GASTOS.items()
+        },
+    }
+
+
+# ===== SNAPSHOT COLUNAR DAS RESPOSTAS =====
+# Cópia das respostas em memória do processo para as leituras analíticas (agregados,
+# cenários, referência dos atípicos), sem hidratar objetos do ORM nem Decimals. Numeric(10, 2)
+# vira centésimos inteiros (exatos, somados em int64) e texto categórico vira código num
+# dicionário por coluna: cerca de 50 bytes por resposta.
+CAMPOS_SNAPSHOT_NUMERICOS = [
+    'distancia_cidade', 'distancia_local', 'custo_transporte', 'custo_transporte_diario',
+    'gasto_alimentacao', 'gasto_equipamentos', 'gasto_botes', 'gasto_hospedagem', 'emissao_total',
+]
+CAMPOS_SNAPSHOT_CATEGORICOS = [
+    'transporte_cidade', 'transporte_local', 'tipo_participante', 'pais_origem_pt', 'estado_origem', 'situacao',
+]
+CAMPOS_SNAPSHOT = ['id', 'dias_evento'] + CAMPOS_SNAPSHOT_NUMERICOS + CAMPOS_SNAPSHOT_CATEGORICOS
+# Respostas lidas por consulta na carga inicial; ids por IN na aplicação das alterações
+SNAPSHOT_LOTE_CARGA = 20000
+SNAPSHOT_LOTE_IDS = 500
+
+def _tipo_que_cabe(tipo, valores):
+    """O menor tipo inteiro que comporta o tipo atual e os novos valores (as colunas só crescem)"""
+    if not len(valores):
+        return np.dtype(tipo)
+    return np.result_type(tipo, np.min_scalar_type(int(valores.min())), np.min_scalar_type(int(valores.max())))
+
+class SnapshotRespostas:
+    """Colunas numpy das respostas, ordenadas por id e com capacidade sobrando para acréscimos
+
+    Nulos das colunas numéricas anuláveis ficam na máscara 'nulo__<campo>', como nos arquivos
+    .npz dos eventos arquivados. O None das categóricas é uma categoria como as outras.
+    """
+
+    def __init__(self, geracao=None):
+        self.geracao = geracao
+        # Todas as alterações do feed até seq já foram aplicadas
+        self.seq = 0
+        self.tamanho = 0
+        self.categorias = {nome: [] for nome in CAMPOS_SNAPSHOT_CATEGORICOS}
+        self._codigos = {nome: {} for nome in CAMPOS_SNAPSHOT_CATEGORICOS}
+        self.anulaveis = [nome for nome in CAMPOS_SNAPSHOT_NUMERICOS if RespostaEmissao.__table__.c[nome].nullable]
+        self.colunas = {nome: np.zeros(0, dtype=np.uint8) for nome in CAMPOS_SNAPSHOT}
+        self.colunas.update({f"nulo__{nome}": np.zeros(0, dtype=bool) for nome in self.anulaveis})
+
+    def coluna(self, nome):
+        return self.colunas[nome][:self.tamanho]
+
+    def bytes_ocupados(self):
+        return sum(coluna.nbytes for coluna in self.colunas.values())
+
+    def _codificar(self, nome, valores):
+        codigos, categorias = self._codigos[nome], self.categorias[nome]
+        for valor in set(valores) - codigos.keys():
+            codigos[valor] = len(categorias)
+            categorias.append(valor)
+        return np.array([codigos[valor] for valor in valores], dtype=np.int64)
+
+    def _converter(self, linhas):
+        """Tuplas na ordem de CAMPOS_SNAPSHOT → colunas (ainda sem o tipo compacto)"""
+        valores = dict(zip(CAMPOS_SNAPSHOT, zip(*linhas)))
+        colunas = {
+            'id': np.array(valores['id'], dtype=np.int64),
+            'dias_evento': np.array(valores['dias_evento'], dtype=np.int64),
+        }
+        for nome in CAMPOS_SNAPSHOT_NUMERICOS:
+            reais = np.array([np.nan if v is None else float(v) for v in valores[nome]])
+            nulos = np.isnan(reais)
+            colunas[nome] = np.rint(np.where(nulos, 0, reais) * 100).astype(np.int64)
+            if nome in self.anulaveis:
+                colunas[f"nulo__{nome}"] = nulos
+        for nome in CAMPOS_SNAPSHOT_CATEGORICOS:
+            colunas[nome] = self._codificar(nome, valores[nome])
+        return colunas
+
+    def _ajustar(self, novas, capacidade):
+        """Garante tipo e capacidade de cada coluna para receber as novas linhas"""
+        for nome, valores in novas.items():
+            atual = self.colunas[nome]
+            tipo = atual.dtype if valores.dtype == bool else _tipo_que_cabe(atual.dtype, valores)
+            if tipo != atual.dtype or len(atual) < capacidade:
+                maior = np.zeros(max(capacidade, len(atual)), dtype=tipo)
+                maior[:self.tamanho] = atual[:self.tamanho]
+                self.colunas[nome] = maior
+
+    def aplicar(self, linhas):
+        """Insere ou substitui as respostas (tuplas na ordem de CAMPOS_SNAPSHOT)"""
+        if not linhas:
+            return
+        novas = self._converter(linhas)
+        ordem = np.argsort(novas['id'], kind='stable')
+        novas = {nome: valores[ordem] for nome, valores in novas.items()}
+        ids = self.coluna('id')
+        posicoes = np.searchsorted(ids, novas['id'])
+        existentes = posicoes < self.tamanho
+        existentes[existentes] = ids[posicoes[existentes]] == novas['id'][existentes]
+
+        self._ajustar(novas, self.tamanho)
+        if existentes.any():
+            for nome, valores in novas.items():
+                self.colunas[nome][posicoes[existentes]] = valores[existentes]
+        acrescimos = {nome: valores[~existentes] for nome, valores in novas.items()}
+        total = len(acrescimos['id'])
+        if not total:
+            return
+        # Capacidade cresce 50% por vez: acrescentar uma resposta custa O(1) amortizado
+        self._ajustar(acrescimos, self.tamanho + max(total, self.tamanho // 2))
+        ultimo = ids[-1] if self.tamanho else -1
+        for nome, valores in acrescimos.items():
+            self.colunas[nome][self.tamanho:self.tamanho + total] = valores
+        self.tamanho += total
+        if acrescimos['id'][0] < ultimo:
+            # Um commit fora de ordem deixou ids menores para trás: reordena (raro)
+            ordem = np.argsort(self.coluna('id'), kind='stable')
+            for nome, coluna in self.colunas.items():
+                coluna[:self.tamanho] = coluna[:self.tamanho][ordem]
+
+    def remover(self, ids_removidos):
+        manter = ~np.isin(self.coluna('id'), ids_removidos)
+        if manter.all():
+            return
+        restantes = int(manter.sum())
+        for nome, coluna in self.colunas.items():
+            coluna[:restantes] = coluna[:self.tamanho][manter]
+        self.tamanho = restantes
+
+    def selecionar(self, id_inicio=None, id_fim=None, situacoes=SITUACOES_NOS_AGREGADOS, campos=None):
+        """Cópia das colunas pedidas (padrão: todas) no intervalo de ids e nas situações (None: todas)
+
+        Numéricas voltam em reais (float, nan nos nulos); categóricas, como códigos em
+        'codigo__<campo>', com os rótulos em 'categorias' (veja rotulos_snapshot).
+        """
+        ids = self.coluna('id')
+        inicio = np.searchsorted(ids, id_inicio, 'left') if id_inicio is not None else 0
+        fim = np.searchsorted(ids, id_fim, 'right') if id_fim is not None else self.tamanho
+        filtro = slice(inicio, fim)
+        if situacoes is not None:
+            # Tabela código → incluída: mais barata que np.isin sobre a coluna inteira
+            tabela = np.array([situacao in situacoes for situacao in self.categorias['situacao']] + [False])
+            incluidas = np.zeros(self.tamanho, dtype=bool)
+            incluidas[inicio:fim] = tabela[self.colunas['situacao'][inicio:fim]]
+            if not incluidas[inicio:fim].all():
+                filtro = incluidas
+
+        selecao = {'categorias': {nome: list(valores) for nome, valores in self.categorias.items()}}
+        for nome in campos or CAMPOS_SNAPSHOT:
+            valores = self.coluna(nome)[filtro]
+            if nome in CAMPOS_SNAPSHOT_NUMERICOS:
+                valores = valores / 100
+                if nome in self.anulaveis:
+                    valores[self.coluna(f"nulo__{nome}")[filtro]] = np.nan
+                selecao[nome] = valores
+            elif nome in CAMPOS_SNAPSHOT_CATEGORICOS:
+                selecao[f"codigo__{nome}"] = valores.astype(np.intp)
+            else:
+                selecao[nome] = valores.astype(np.int64)
+        return selecao
+
+_snapshot_respostas = SnapshotRespostas()
+_lock_snapshot_respostas = threading.Lock()
+
+def _consulta_snapshot(sessao):
+    return sessao.query(*[getattr(RespostaEmissao, nome) for nome in CAMPOS_SNAPSHOT])
+
+def _carregar_snapshot(sessao, geracao):
+    """Snapshot novo com todas as respostas, lidas em blocos pela chave primária"""
+    snapshot = SnapshotRespostas(geracao)
+    ultimo_id = 0
+    while True:
+        linhas = _consulta_snapshot(sessao).filter(RespostaEmissao.id > ultimo_id).order_by(
+            RespostaEmissao.id).limit(SNAPSHOT_LOTE_CARGA).all()
+        if not linhas:
+            return snapshot
+        snapshot.aplicar(linhas)
+        ultimo_id = linhas[-1][0]
+
+def _atualizar_snapshot(sessao, snapshot, seq):
+    """Aplica as respostas tocadas pelo feed depois de snapshot.seq (o estado atual de cada uma)"""
+    alteradas = sorted({resposta_id for (resposta_id,) in sessao.query(AlteracaoResposta.resposta_id).filter(
+        AlteracaoResposta.seq > snapshot.seq, AlteracaoResposta.seq <= seq)})
+    for inicio in range(0, len(alteradas), SNAPSHOT_LOTE_IDS):
+        bloco = alteradas[inicio:inicio + SNAPSHOT_LOTE_IDS]
+        linhas = _consulta_snapshot(sessao).filter(RespostaEmissao.id.in_(bloco)).all()
+        snapshot.aplicar(linhas)
+        # Tocadas mas ausentes da tabela: foram removidas
+        snapshot.remover(sorted(set(bloco) - {linha[0] for linha in linhas}))
+
+def rotulos_snapshot(colunas, campo):
+    """Rótulos (texto) de uma coluna categórica selecionada do snapshot"""
+    return np.array(colunas['categorias'][campo], dtype=object)[colunas[f"codigo__{campo}"]]
+
+def snapshot_respostas(id_inicio=None, id_fim=None, situacoes=SITUACOES_NOS_AGREGADOS, campos=None):
+    """Colunas do snapshot do processo (veja SnapshotRespostas.selecionar), atualizado antes da leitura
+
+    Só as respostas inseridas, alteradas ou removidas desde a última leitura são buscadas no
+    banco. Arquivar ou restaurar um evento (fora do feed) recarrega tudo.
+    """
+    global _snapshot_respostas
+    with etapa('snapshot'), _lock_snapshot_respostas, app.app_context(), sessao_leitura() as sessao:
+        snapshot = _snapshot_respostas
+        seq = sessao.query(func.max(AlteracaoResposta.seq)).scalar() or 0
+        geracao = sessao.query(GeracaoDados.geracao).filter(GeracaoDados.id == 1).scalar() or 0
+        if geracao != snapshot.geracao or seq < snapshot.seq:
+            snapshot = _carregar_snapshot(sessao, geracao)
+            # Alterações gravadas durante a carga podem já estar nela: reaplicar é inofensivo
+            snapshot.seq = seq
+        elif snapshot.seq < seq:
+            _atualizar_snapshot(sessao, snapshot, seq)
+            snapshot.seq = seq
+        _snapshot_respostas = snapshot
+        return snapshot.selecionar(id_inicio, id_fim, situacoes, campos)
+
+
+# ===== SIMULADOR DE CENÁRIOS =====
+# Colunas da matriz de pesos: um meio por coluna, mais uma para meios fora da tabela
+MEIOS_CENARIO = list(EMISSOES_TRANSPORTE.keys())
+INDICE_MEIO = {meio: i for i, meio in enumerate(MEIOS_CENARIO)}
+FATORES_CENARIO = np.array([EMISSOES_TRANSPORTE[m] for m in MEIOS_CENARIO] + [5.0])
+TRECHOS_CENARIO = ('chegada', 'local')
+CENARIO_MAXIMO_REGRAS = 20
+
+# Cenários mostrados no relatório do evento: (nome, regras)
+CENARIOS_PADRAO = [
+    ("30% dos carros de chegada trocados por ônibus / 30% of car arrivals switch to bus",
+     [{'trecho': 'chegada', 'de': 'carro', 'para': 'ônibus', 'fracao': 0.3}]),
+    ("Metade do carro no dia a dia trocada por ônibus / Half of daily car trips switch to bus",
+     [{'trecho': 'local', 'de': 'carro', 'para': 'ônibus', 'fracao': 0.5}]),
+    ("Todos a pé ou de bicicleta no dia a dia / Everyone walks or cycles locally",
+     [{'trecho': 'local', 'de': '*', 'para': 'bicicleta/a pé', 'fracao': 1}]),
+]
+
+def _codigos_meio(meios):
+    desconhecido = len(MEIOS_CENARIO)
+    return np.array([INDICE_MEIO.get(m, desconhecido) for m in meios], dtype=np.intp)
+
+# Colunas do snapshot lidas por colunas_cenario
+CAMPOS_CENARIO = ['transporte_cidade', 'distancia_cidade', 'transporte_local', 'distancia_local', 'dias_evento']
+
+def colunas_emissoes(id_inicio=None, id_fim=None):
+    """Colunas numpy (meios codificados, distâncias, dias) das respostas do intervalo"""
+    arquivadas = colunas_arquivadas(id_inicio, id_fim)
+    if arquivadas is not None:
+        return arquivadas
+
+    return colunas_cenario(snapshot_respostas(id_inicio, id_fim, campos=CAMPOS_CENARIO))
+
+def colunas_cenario(colunas):
+    """Colunas do simulador a partir das colunas do snapshot"""
+    # Códigos do snapshot → códigos do simulador, traduzindo só o dicionário de cada coluna
+    def meios(campo):
+        return _codigos_meio(colunas['categorias'][campo])[colunas[f"codigo__{campo}"]]
+    return {
+        'meio_chegada': meios('transporte_cidade'),
+        'distancia_chegada': colunas['distancia_cidade'],
+        'meio_local': meios('transporte_local'),
+        'distancia_local': colunas['distancia_local'] * colunas['dias_evento'],
+    }
+
+def colunas_de_registros(linhas):
+    """Converte tuplas (meio chegada, distância, meio local, distância/dia, dias) em colunas"""
+    linhas = list(linhas)
+    return {
+        'meio_chegada': _codigos_meio([l[0] for l in linhas]),
+        'distancia_chegada': np.array([float(l[1] or 0) for l in linhas]),
+        'meio_local': _codigos_meio([l[2] for l in linhas]),
+        # Distância local total no evento (km/dia × dias)
+        'distancia_local': np.array([float(l[3] or 0) * (l[4] or 0) for l in linhas]),
+    }
+
+def validar_regras_cenario(regras):
+    """Confere as regras de troca de meio; levanta ValueError com a mensagem para o cliente"""
+    if not isinstance(regras, list):
+        raise ValueError("'regras' deve ser uma lista")
+    if len(regras) > CENARIO_MAXIMO_REGRAS:
+        raise ValueError(f"No máximo {CENARIO_MAXIMO_REGRAS} regras por cenário")
+    validas = []
+    for i, regra in enumerate(regras):
+        if not isinstance(regra, dict):
+            raise ValueError(f"Regra {i}: deve ser um objeto")
+        trecho = regra.get('trecho', 'chegada')
+        de, para = regra.get('de', '*'), regra.get('para')
+        if trecho not in TRECHOS_CENARIO:
+            raise ValueError(f"Regra {i}: trecho deve ser 'chegada' ou 'local'")
+        if de != '*' and de not in INDICE_MEIO:
+            raise ValueError(f"Regra {i}: meio de origem desconhecido: {de}")
+        if para not in INDICE_MEIO:
+            raise ValueError(f"Regra {i}: meio de destino desconhecido: {para}")
+        try:
+            fracao = float(regra.get('fracao', 1))
+        except (TypeError, ValueError):
+            raise ValueError(f"Regra {i}: fração inválida")
+        if not 0 <= fracao <= 1:
+            raise ValueError(f"Regra {i}: a fração deve estar entre 0 e 1")
+        validas.append({'trecho': trecho, 'de': de, 'para': para, 'fracao': fracao})
+    return validas
+
+def _emissoes_trecho(codigos, distancias, regras):
+    """Aplica as regras de um trecho e devolve as emissões por meio (kgCO2)"""
+    # Cada linha é uma distribuição sobre os meios; as regras movem parte do peso entre colunas
+    pesos = np.zeros((len(codigos), len(FATORES_CENARIO)))
+    pesos[np.arange(len(codigos)), codigos] = 1.0
+    for regra in regras:
+        destino = INDICE_MEIO[regra['para']]
+        if regra['de'] == '*':
+            movido = pesos * regra['fracao']
+            pesos -= movido
+            pesos[:, destino] += movido.sum(axis=1)
+        else:
+            origem = INDICE_MEIO[regra['de']]
+            movido = pesos[:, origem] * regra['fracao']
+            pesos[:, origem] -= movido
+            pesos[:, destino] += movido
+    return (distancias @ pesos) * FATORES_CENARIO / 1000
+
+def avaliar_cenario(colunas, regras=()):
+    """Avalia um cenário numa única passada vetorizada; regras valem em ordem sobre o resultado anterior"""
+    por_trecho = {}
+    for trecho in TRECHOS_CENARIO:
+        regras_trecho = [r for r in regras if r['trecho'] == trecho]
+        por_trecho[trecho] = _emissoes_trecho(colunas[f'meio_{trecho}'], colunas[f'distancia_{trecho}'], regras_trecho)
+
+    def por_meio(valores):
+        return {meio: round(float(v), 2) for meio, v in zip(MEIOS_CENARIO + ['outros meios'], valores) if v}
+
+    return {
+        'participantes': int(len(colunas['meio_chegada'])),
+        'total': round(float(por_trecho['chegada'].sum() + por_trecho['local'].sum()), 2),
+        'chegada': round(float(por_trecho['chegada'].sum()), 2),
+        'local': round(float(por_trecho['local'].sum()), 2),
+        'chegada_por_meio': por_meio(por_trecho['chegada']),
+        'local_por_meio': por_meio(por_trecho['local']),
+    }
+
+def comparar_cenario(colunas, regras):
+    """Cenário base × cenário com as regras, com a diferença absoluta e percentual"""
+    base, cenario = avaliar_cenario(colunas), avaliar_cenario(colunas, regras)
+    diferenca = round(cenario['total'] - base['total'], 2)
+    return {
+        'base': base,
+        'cenario': cenario,
+        'diferenca_kg': diferenca,
+        'diferenca_pct': round(diferenca / base['total'] * 100, 1) if base['total'] else 0.0,
+    }
+
+def cenarios_padrao_evento(id_inicio=None, id_fim=None):
+    """[[nome, kgCO2 no cenário, diferença em kg, diferença em %]] dos cenários padrão"""
+    colunas = colunas_emissoes(id_inicio, id_fim)
+    linhas = []
+    for nome, regras in CENARIOS_PADRAO:
+        comparacao = comparar_cenario(colunas, regras)
+        linhas.append([nome, comparacao['cenario']['total'], comparacao['diferenca_kg'], comparacao['diferenca_pct']])
+    return linhas
+
+def alternativas_individuais(registro):
+    """Emissão do participante se trocasse o meio de chegada ou o do dia a dia por cada alternativa"""
+    colunas = colunas_de_registros([(
+        registro['transporte_cidade'], registro['distancia_cidade'],
+        registro['transporte_local'], registro['distancia_local'], registro['dias_evento'],
+    )])
+    base = avaliar_cenario(colunas)['total']
+    alternativas = []
+    for trecho, atual in (('chegada', registro['transporte_cidade']), ('local', registro['transporte_local'])):
+        for meio in MEIOS_CENARIO:
+            if meio == atual or meio == 'outros':
+                continue
+            total = avaliar_cenario(colunas, [{'trecho': trecho, 'de': '*', 'para': meio, 'fracao': 1.0}])['total']
+            alternativas.append({
+                'trecho': trecho,
+                'meio': meio,
+                'total': total,
+                'diferenca_kg': round(total - base, 2),
+            })
+    return {'base': base, 'alternativas': alternativas}
+
+
+# ===== PAINÉIS DE GRÁFICOS =====
+# Palheta de cores personalizada: azul, verde e amarelo
+PALHETA_CORES = ["#1CE074", "#0B9A5F", "#026C26", "#27A8DC", "#2775E2", "#054976"]
+
+NOMES_CATEGORIAS_GASTOS = {
+    'alimentacao': 'Alimentação',
+    'equipamentos': 'Equipamentos',
+    'botes': 'Aluguel de Botes',
+    'hospedagem': 'Hospedagem',
+    'transporte_chegada': 'Transporte (Chegada)',
+    'transporte_diario': 'Transporte (Diário)'
+}
+
+# Larguras (px) aceitas para o PNG: poucas variantes por painel no cache
+LARGURAS_GRAFICO = (320, 480, 640, 800, 1200)
+LARGURA_GRAFICO_PADRAO = 800
+# O PNG vai para uma paleta indexada: os painéis têm poucas cores além do antisserrilhado
+CORES_PNG_GRAFICO = 128
+COR_TITULO_GRAFICO = '#1a3b5d'
+COR_TEXTO_GRAFICO = '#2c3e50'
+
+def comprimir_png(png):
+    """Reduz o PNG do matplotlib (RGBA, 32 bits por pixel) a uma paleta otimizada"""
+    imagem = ImagemPIL.open(BytesIO(png)).convert('RGB')
+    buffer = BytesIO()
+    imagem.quantize(CORES_PNG_GRAFICO, method=ImagemPIL.Quantize.MEDIANCUT).save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+def largura_grafico(pedida):
+    """Menor largura padronizada que cobre a pedida (a maior, se nenhuma cobrir)"""
+    for largura in LARGURAS_GRAFICO:
+        if largura >= pedida:
+            return largura
+    return LARGURAS_GRAFICO[-1]
+
+class RenderizadorPainel:
+    """Figura de um painel mantida viva entre renderizações
+
+    Título, eixos, grade e estilo são montados uma única vez; a cada renderização só
+    mudam as alturas das barras, as fatias da pizza e os textos. O tight_layout só é
+    refeito quando muda o que ocupa as margens (rótulos e quantidade de itens).
+    """
+
+    def __init__(self):
+        # Figure direto (sem pyplot): não entra no registro global de figuras
+        self.fig = Figure(figsize=(8, 6))
+        self.ax = self.fig.add_subplot()
+        self.artistas = None
+        self.assinatura_layout = None
+        self.preparar()
+
+    def preparar(self):
+        """Estilo fixo do painel"""
+
+    def atualizar(self, serie):
+        """Aplica a série aos artistas; retorna a assinatura do layout"""
+        raise NotImplementedError
+
+    def desenho_vetorial(self, serie, largura):
+        """O mesmo painel como Drawing do ReportLab, em vetor, para os PDFs"""
+        raise NotImplementedError
+
+    def renderizar(self, serie, formato='png', largura=LARGURA_GRAFICO_PADRAO):
+        """Bytes do painel em SVG ou em PNG com a largura pedida (em pixels)"""
+        assinatura = self.atualizar(serie)
+        if assinatura != self.assinatura_layout:
+            self.fig.tight_layout()
+            self.assinatura_layout = assinatura
+        buffer = BytesIO()
+        if formato == 'svg':
+            # Texto como <text> (sem contornos das letras) e ids estáveis: o mesmo gráfico gera os mesmos bytes
+            with matplotlib.rc_context({'svg.fonttype': 'none', 'svg.hashsalt': 'painel'}):
+                self.fig.savefig(buffer, format='svg', bbox_inches='tight', facecolor='white',
+                                 edgecolor='none', metadata={'Date': None})
+            return buffer.getvalue()
+
+        self.fig.savefig(buffer, format='png', bbox_inches='tight', dpi=largura / self.fig.get_figwidth(),
+                         facecolor='white', edgecolor='none')
+        return comprimir_png(buffer.getvalue())
+
+class RenderizadorBarras(RenderizadorPainel):
+    """Barras com a contagem de participantes por transporte"""
+
+    def __init__(self, titulo, deslocamento_cor):
+        self.titulo = titulo
+        self.deslocamento_cor = deslocamento_cor
+        super().__init__()
+
+    def preparar(self):
+        from matplotlib.ticker import MaxNLocator
+
+        ax = self.ax
+        ax.set_title(self.titulo, fontsize=12, fontweight='bold', pad=15, color='#1a3b5d')
+        ax.set_ylabel('Número de participantes', fontsize=10, fontweight='500', color='#2c3e50')
+        ax.grid(axis='y', alpha=0.2, linestyle='--', color='#95a5a6')
+        ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+
+    def atualizar(self, contagem):
+        ax = self.ax
+        transportes_ord = sorted(contagem.items(), key=lambda x: (-x[1], x[0]))
+        labels = [f"{t[0].capitalize()}" for t in transportes_ord]
+        valores = [t[1] for t in transportes_ord]
+
+        if self.artistas is None or len(self.artistas[0]) != len(valores):
+            # Mudou a quantidade de barras: só então elas são recriadas
+            if self.artistas is not None:
+                barras, rotulos = self.artistas
+                barras.remove()
+                for rotulo in rotulos:
+                    rotulo.remove()
+            cores_barras = [PALHETA_CORES[(i + self.deslocamento_cor) % len(PALHETA_CORES)]
+                            for i in range(len(valores))]
+            barras = ax.bar(range(len(valores)), valores, color=cores_barras,
+                            edgecolor='#2c3e50', linewidth=1.5, alpha=0.9)
+            rotulos = [ax.text(0, 0, '', ha='center', va='bottom', fontsize=10,
+                               fontweight='bold', color='#1a3b5d') for _ in barras]
+            ax.set_xticks(range(len(valores)))
+            self.artistas = (barras, rotulos)
+        else:
+            barras, rotulos = self.artistas
+            for bar, valor in zip(barras, valores):
+                bar.set_height(valor)
+        ax.relim()
+        ax.autoscale_view()
+        ax.set_xticklabels(labels, rotation=45, ha='right', fontsize=9, fontweight='500')
+
+        for bar, rotulo, valor in zip(barras, rotulos, valores):
+            rotulo.set_position((bar.get_x() + bar.get_width()/2., bar.get_height() + 0.1))
+            rotulo.set_text(f'{valor}')
+        return tuple(sorted(labels)), len(str(max(valores)))
+
+    def desenho_vetorial(self, contagem, largura):
+        transportes_ord = sorted(contagem.items(), key=lambda x: (-x[1], x[0]))
+        valores = [t[1] for t in transportes_ord]
+        altura = largura * 0.62
+        desenho = Drawing(largura, altura)
+        desenho.add(String(largura / 2, altura - 14, self.titulo, fontName='Helvetica-Bold', fontSize=11,
+                           fillColor=colors.HexColor(COR_TITULO_GRAFICO), textAnchor='middle'))
+        eixo_y = Group(String(0, 0, 'Número de participantes', fontName='Helvetica', fontSize=8,
+                              fillColor=colors.HexColor(COR_TEXTO_GRAFICO), textAnchor='middle'))
+        eixo_y.translate(10, 55 + (altura - 90) / 2)
+        eixo_y.rotate(90)
+        desenho.add(eixo_y)
+
+        barras = VerticalBarChart()
+        barras.x, barras.y = 45, 55
+        barras.width, barras.height = largura - 60, altura - 90
+        barras.data = [valores]
+        barras.barSpacing = 0
+        barras.groupSpacing = barras.width / len(valores) * 0.2
+        barras.categoryAxis.categoryNames = [t[0].capitalize() for t in transportes_ord]
+        barras.categoryAxis.labels.angle = 45
+        barras.categoryAxis.labels.boxAnchor = 'ne'
+        barras.categoryAxis.labels.fontSize = 8
+        barras.categoryAxis.labels.fillColor = colors.HexColor(COR_TEXTO_GRAFICO)
+        # Contagens: marcas inteiras do eixo, como o MaxNLocator(integer=True) do matplotlib
+        passo = max(1, math.ceil(max(valores) / 5))
+        barras.valueAxis.valueMin = 0
+        barras.valueAxis.valueMax = passo * (math.ceil(max(valores) / passo) + 1)
+        barras.valueAxis.valueStep = passo
+        barras.valueAxis.labels.fontSize = 8
+        barras.valueAxis.visibleGrid = True
+        barras.valueAxis.gridStrokeColor = colors.HexColor('#95a5a6')
+        barras.valueAxis.gridStrokeDashArray = (2, 2)
+        barras.valueAxis.gridStrokeWidth = 0.3
+        barras.bars.strokeColor = colors.HexColor(COR_TEXTO_GRAFICO)
+        barras.bars.strokeWidth = 1
+        for i in range(len(valores)):
+            barras.bars[(0, i)].fillColor = colors.HexColor(
+                PALHETA_CORES[(i + self.deslocamento_cor) % len(PALHETA_CORES)])
+        barras.barLabelFormat = '%d'
+        barras.barLabels.nudge = 6
+        barras.barLabels.fontName = 'Helvetica-Bold'
+        barras.barLabels.fontSize = 8
+        barras.barLabels.fillColor = colors.HexColor(COR_TITULO_GRAFICO)
+        desenho.add(barras)
+        return desenho
+
+class RenderizadorPizza(RenderizadorPainel):
+    """Pizza em ordem decrescente, com a maior fatia destacada"""
+    deslocamento_cor = 0
+    destaque = 0.03
+    tamanho_autotexto = 7
+    caixa_autotexto = dict(facecolor='#2c3e50', alpha=0.6, edgecolor='none', pad=1.5)
+
+    def rotulo(self, chave):
+        return chave.capitalize()
+
+    def autotexto(self, pct, total):
+        raise NotImplementedError
+
+    def titulo(self, total):
+        raise NotImplementedError
+
+    def preparar(self):
+        self.ax.set_title('', fontsize=12, fontweight='bold', pad=15, color='#1a3b5d')
+
+    def atualizar(self, serie):
+        ax = self.ax
+        dados_ordenados = sorted(((self.rotulo(k), v) for k, v in serie.items()),
+                                 key=lambda x: x[1], reverse=True)
+        labels = [d[0] for d in dados_ordenados]
+        valores = [d[1] for d in dados_ordenados]
+        total = sum(valores)
+        explode = [self.destaque if v == max(valores) else 0 for v in valores]
+
+        if self.artistas is None or len(self.artistas[0]) != len(valores):
+            # Mudou a quantidade de fatias: a pizza (fatias, sombras e textos) é recriada
+            for artista in list(ax.patches) + list(ax.texts):
+                artista.remove()
+            wedges, texts, autotexts = ax.pie(
+                valores,
+                labels=labels,
+                autopct=lambda pct: self.autotexto(pct, total),
+                colors=[PALHETA_CORES[(i + self.deslocamento_cor) % len(PALHETA_CORES)]
+                        for i in range(len(valores))],
+                explode=explode,
+                shadow=True,
+                startangle=90,
+                textprops={'fontsize': 8}
+            )
+            for text_label in texts:
+                text_label.set_fontsize(9)
+                text_label.set_fontweight('500')
+                text_label.set_color('#2c3e50')
+            for autotext in autotexts:
+                autotext.set_fontsize(self.tamanho_autotexto)
+                autotext.set_color('white')
+                autotext.set_fontweight('bold')
+                autotext.set_bbox(self.caixa_autotexto)
+            self.artistas = (wedges, texts, autotexts)
+        else:
+            # Mesma geometria do ax.pie (startangle=90, rótulos a 1.1 e percentuais a 0.6 do raio)
+            inicio = 0.25
+            for wedge, texto, autotexto, label, valor, deslocamento in zip(*self.artistas, labels, valores, explode):
+                fim = inicio + valor / total
+                angulo = math.pi * (inicio + fim)
+                centro = (deslocamento * math.cos(angulo), deslocamento * math.sin(angulo))
+                wedge.set_center(centro)
+                wedge.set_theta1(360 * inicio)
+                wedge.set_theta2(360 * fim)
+                x_rotulo = centro[0] + 1.1 * math.cos(angulo)
+                texto.set_position((x_rotulo, centro[1] + 1.1 * math.sin(angulo)))
+                texto.set_horizontalalignment('left' if x_rotulo > 0 else 'right')
+                texto.set_text(label)
+                autotexto.set_position((centro[0] + 0.6 * math.cos(angulo), centro[1] + 0.6 * math.sin(angulo)))
+                autotexto.set_text(self.autotexto(valor / total * 100, total))
+                inicio = fim
+
+        ax.title.set_text(self.titulo(total))
+        return tuple(sorted(labels))
+
+    def desenho_vetorial(self, serie, largura):
+        dados_ordenados = sorted(((self.rotulo(k), v) for k, v in serie.items()),
+                                 key=lambda x: x[1], reverse=True)
+        valores = [d[1] for d in dados_ordenados]
+        total = sum(valores)
+        altura = largura * 0.62
+        desenho = Drawing(largura, altura)
+        # As fontes padrão do PDF não têm o ₂ subscrito
+        for i, linha in enumerate(self.titulo(total).replace('₂', '2').split('\n')):
+            desenho.add(String(largura / 2, altura - 14 - 13 * i, linha, fontName='Helvetica-Bold',
+                               fontSize=11, fillColor=colors.HexColor(COR_TITULO_GRAFICO), textAnchor='middle'))
+
+        pizza = Pie()
+        # Os rótulos ficam nas laterais, fora da pizza: o diâmetro deixa espaço para eles
+        diametro = altura - 110
+        pizza.x, pizza.y = (largura - diametro) / 2, 30
+        pizza.width = pizza.height = diametro
+        pizza.data = valores
+        # Percentual e valor ficam junto do rótulo: não há um segundo texto dentro da fatia
+        pizza.labels = [f"{rotulo}: {self.autotexto(valor / total * 100, total).replace(chr(10), ' ')}"
+                        for rotulo, valor in dados_ordenados]
+        pizza.startAngle = 90
+        pizza.direction = 'anticlockwise'
+        pizza.sideLabels = True
+        pizza.sideLabelsOffset = 0.05
+        pizza.slices.fontName = 'Helvetica'
+        pizza.slices.fontSize = 8
+        pizza.slices.fontColor = colors.HexColor(COR_TEXTO_GRAFICO)
+        pizza.slices.strokeColor = colors.white
+        pizza.slices.strokeWidth = 0.5
+        for i, valor in enumerate(valores):
+            pizza.slices[i].fillColor = colors.HexColor(
+                PALHETA_CORES[(i + self.deslocamento_cor) % len(PALHETA_CORES)])
+            if valor == max(valores):
+                pizza.slices[i].popout = self.destaque * diametro
+        desenho.add(pizza)
+        return desenho
+
+class RenderizadorEmissoesTransporte(RenderizadorPizza):
+    """Distribuição de Emissões por Tipo de Transporte (pizza tradicional)"""
+
+    def autotexto(self, pct, total):
+        return f'{pct:.1f}%\n({(pct/100)*total:,.0f} kg)'
+
+    def titulo(self, total):
+        return f'Distribuição de Emissões por Tipo de Transporte\nTotal: {total:,.0f} kgCO₂'
+
+class RenderizadorEconomico(RenderizadorPizza):
+    """Distribuição Econômica por Categoria"""
+    deslocamento_cor = 3
+    destaque = 0.05
+    tamanho_autotexto = 8
+    caixa_autotexto = dict(facecolor='#2c3e50', alpha=0.5, edgecolor='none', pad=1)
+
+    def rotulo(self, chave):
+        return NOMES_CATEGORIAS_GASTOS[chave]
+
+    def autotexto(self, pct, total):
+        return f'R$ {(pct/100)*total:,.0f}'
+
+    def titulo(self, total):
+        return f'Distribuição Econômica por Categoria\nTotal: R$ {total:,.2f}'
+
+# Cada painel: (função que extrai a série dos agregados, fábrica do renderizador)
+PAINEIS = {
+    'transporte_chegada': (lambda ag: ag['transporte_chegada'],
+                           lambda: RenderizadorBarras('Transporte mais utilizado para CHEGAR ao evento', 0)),
+    'transporte_diario': (lambda ag: ag['transporte_diario'],
+                          lambda: RenderizadorBarras('Transporte mais utilizado no DIA A DIA do evento', 2)),
+    'emissoes_transporte': (lambda ag: {k: v for k, v in ag['emissoes_transporte'].items() if v > 0},
+                            RenderizadorEmissoesTransporte),
+    'economico': (lambda ag: {k: v for k, v in ag['gastos'].items() if v > 0}, RenderizadorEconomico),
+}
+
+# Renderizadores por thread: uma figura do matplotlib não pode ser desenhada por duas threads
+_renderizadores_local = threading.local()
+
+def hash_serie(serie):
+    """Hash estável dos dados de entrada de um painel"""
+    conteudo = json.dumps(serie, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(conteudo.encode('utf-8')).hexdigest()
+
+def _renderizador(nome):
+    renderizadores = getattr(_renderizadores_local, 'paineis', None)
+    if renderizadores is None:
+        renderizadores = _renderizadores_local.paineis = {}
+    renderizador = renderizadores.get(nome)
+    if renderizador is None:
+        _, criar = PAINEIS[nome]
+        renderizador = renderizadores[nome] = criar()
+    return renderizador
+
+def renderizar_painel(nome, serie, formato='png', largura=LARGURA_GRAFICO_PADRAO):
+    """Renderiza um único painel (bytes de SVG ou PNG), reaproveitando a figura deste worker"""
+    try:
+        return _renderizador(nome).renderizar(serie, formato, largura)
+    except Exception:
+        # Figura possivelmente pela metade: a próxima renderização começa do zero
+        _renderizadores_local.paineis.pop(nome, None)
+        raise
+
+def desenho_painel(nome, serie, largura=14*cm):
+    """Painel vetorial para o PDF; não passa pelo matplotlib"""
+    return _renderizador(nome).desenho_vetorial(serie, largura)
+
+def painel_da_serie(nome, serie, formato='png', largura=LARGURA_GRAFICO_PADRAO):
+    """Retorna (hash, bytes) do painel no formato pedido, re-renderizando apenas se a série mudou
+
+    Cada formato (e cada largura do PNG) é uma entrada própria no cache compartilhado:
+    um painel renderizado por um worker serve a todos.
+    """
+    if not serie:
+        return None, None
+    assinatura = hash_serie(serie)
+    variante = 'svg' if formato == 'svg' else f"png{largura}"
+    caminho = cache_compartilhado.caminho('paineis', f"{nome}:{assinatura}:{variante}", f".{formato}")
+    with etapa('graficos'):
+        return assinatura, cache_compartilhado.obter(
+            caminho, lambda: renderizar_painel(nome, serie, formato, largura))
+
+def obter_painel(nome, agregados, formato='png', largura=LARGURA_GRAFICO_PADRAO):
+    """Retorna (hash, bytes) do painel calculado sobre os agregados"""
+    extrair, _ = PAINEIS[nome]
+    return painel_da_serie(nome, extrair(agregados), formato, largura)
+
+def preparar_paineis(nomes=None):
+    """Séries dos painéis pedidos (todos por padrão) como {nome: série}; None sem respostas
+
+    O SVG, formato usado pela página de resultados, já sai renderizado para o cache.
+    """
+    try:
+        agregados = calcular_agregados()
+        if not agregados['total_respostas']:
+            return None
+
+        series = {}
+        for nome in (nomes or PAINEIS.keys()):
+            extrair, _ = PAINEIS[nome]
+            serie = extrair(agregados)
+            if serie:
+                painel_da_serie(nome, serie, 'svg')
+                series[nome] = serie
+        return series
+
+    except Exception as e:
+        print(f"Erro ao gerar gráfico: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+# ===== ESTATÍSTICAS COLETIVAS: SERVIR A ÚLTIMA VERSÃO E REVALIDAR =====
+# Acima destes limites o worker está sobrecarregado e os gráficos deixam de ser atualizados
+ESTATISTICAS_MAX_EM_ANDAMENTO = int(os.environ.get('ESTATISTICAS_MAX_EM_ANDAMENTO', '8'))
+ESTATISTICAS_MAX_LATENCIA_MS = float(os.environ.get('ESTATISTICAS_MAX_LATENCIA_MS', '500'))
+# Medições de latência mais antigas que isso não contam (a carga já passou)
+ESTATISTICAS_JANELA_CARGA = 10
+
+class MonitorCarga:
+    """Inserções em andamento e latência recente (média móvel exponencial) deste worker"""
+
+    def __init__(self, peso=0.2):
+        self.peso = peso
+        self.em_andamento = 0
+        self.latencia_ms = 0.0
+        self.ultima_medicao = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def medir(self):
+        with self._lock:
+            self.em_andamento += 1
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = (time.perf_counter() - inicio) * 1000
+            with self._lock:
+                self.em_andamento -= 1
+                self.latencia_ms += self.peso * (duracao - self.latencia_ms)
+                self.ultima_medicao = time.monotonic()
+
+    def sobrecarregado(self):
+        # A fila do escritor único fica vazia quando ele não está em uso
+        if self.em_andamento + escritor_sqlite.pendentes() > ESTATISTICAS_MAX_EM_ANDAMENTO:
+            return True
+        recente = time.monotonic() - self.ultima_medicao < ESTATISTICAS_JANELA_CARGA
+        return recente and self.latencia_ms > ESTATISTICAS_MAX_LATENCIA_MS
+
+monitor_carga = MonitorCarga()
+
+_snapshot_estatisticas = {'mtime': None, 'dados': None}
+_lock_revalidacao = threading.Lock()
+_processo_encerrando = threading.Event()
+
+def _caminho_snapshot_estatisticas():
+    return os.path.join(CACHE_DIR, 'estatisticas', 'paineis.json')
+
+def ler_snapshot_estatisticas():
+    """Última versão boa dos painéis, gravada em disco e compartilhada entre os workers"""
+    caminho = _caminho_snapshot_estatisticas()
+    try:
+        mtime = os.stat(caminho).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _snapshot_estatisticas['mtime'] != mtime:
+        with open(caminho, encoding='utf-8') as arquivo:
+            _snapshot_estatisticas.update(mtime=mtime, dados=json.load(arquivo))
+    if 'series' not in _snapshot_estatisticas['dados']:
+        return None  # snapshot antigo, com os PNGs embutidos: é refeito no formato atual
+    return _snapshot_estatisticas['dados']
+
+def revalidar_estatisticas():
+    """Recalcula os painéis e grava o snapshot; se outra revalidação já está em curso, desiste"""
+    if not _lock_revalidacao.acquire(blocking=False):
+        return False
+    try:
+        if _processo_encerrando.is_set():
+            return False
+        caminho = _caminho_snapshot_estatisticas()
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(f"{caminho}.trava", 'a') as trava:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False  # outro worker está revalidando
+            # Versão lida antes do cálculo: se chegar resposta durante ele, o snapshot já nasce velho
+            versao = versao_dados()
+            series = preparar_paineis() or {}
+            gravar_arquivo_atomico(caminho, json.dumps({
+                'versao': versao,
+                'gerado_em': time.time(),
+                # Só as séries e seus hashes: cada formato é renderizado (e guardado) sob demanda
+                'paineis': {nome: hash_serie(serie) for nome, serie in series.items()},
+                'series': series,
+            }).encode('utf-8'))
+            return True
+    finally:
+        _lock_revalidacao.release()
+
+def _revalidar_em_segundo_plano():
+    with app.app_context():
+        try:
+            revalidar_estatisticas()
+        except Exception as e:
+            print(f"⚠️  Falha ao revalidar as estatísticas: {e}")
+
+@atexit.register
+def _aguardar_revalidacao():
+    """Na saída do processo, espera a revalidação em curso e impede que outra comece
+
+    Uma thread daemon interrompida no meio da renderização (código C++ do matplotlib)
+    aborta o processo com "terminate called without an active exception".
+    """
+    _processo_encerrando.set()
+    if _lock_revalidacao.acquire(timeout=30):
+        _lock_revalidacao.release()
+
+def estatisticas_coletivas():
+    """Painéis para a página de resultados: ({nome: hash}, idade em segundos, desatualizado)
+
+    Nunca espera uma revalidação, a não ser quando ainda não existe snapshot algum. Com
+    o worker sobrecarregado a revalidação nem é disparada e a versão antiga é servida.
+    """
+    versao = versao_dados()
+    snapshot = ler_snapshot_estatisticas()
+    if (snapshot is None or snapshot['versao'] != versao) and not monitor_carga.sobrecarregado():
+        if snapshot is None:
+            revalidar_estatisticas()
+            snapshot = ler_snapshot_estatisticas()
+        elif not _lock_revalidacao.locked():
+            threading.Thread(target=_revalidar_em_segundo_plano, name='revalidar-estatisticas',
+                             daemon=True).start()
+
+    if snapshot is None:
+        return None, None, True
+    return snapshot['paineis'] or None, time.time() - snapshot['gerado_em'], snapshot['versao'] != versao
+
+
+def emoji_para_imagem(emoji, tamanho=12):
+    """Converte emoji em imagem base64"""
+    try:
+        fig, ax = plt.subplots(figsize=(tamanho/24, tamanho/24))
+        ax.text(0.5, 0.5, emoji, fontsize=tamanho, ha='center', va='center')
+        ax.axis('off')
+        
+        buffer = BytesIO()
+        plt.savefig(buffer, format='png', bbox_inches='tight', 
+                   pad_inches=0, transparent=True, dpi=100)
+        buffer.seek(0)
+        plt.close()
+        
+        return ImageReader(buffer)
+    except:
+        return None
+
+def criar_linha_com_emoji(emoji, texto, estilo, tamanho_emoji=12):
+    """Cria uma linha com emoji como imagem"""
+    try:
+        img_emoji = emoji_para_imagem(emoji, tamanho_emoji)
+        if img_emoji:
+            img_obj = Image(img_emoji, width=4*mm, height=4*mm)
+            
+            dados_linha = [
+                [img_obj, Paragraph(texto, estilo)]
+            ]
+            tabela = Table(dados_linha, colWidths=[6*mm, 150*mm])
+            tabela.setStyle(TableStyle([
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('LEFTPADDING', (0, 0), (-1, -1), 2),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 2),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+            ]))
+            return tabela
+        else:
+            return Paragraph(f"• {texto}", estilo)
+    except Exception as e:
+        print(f"Erro ao criar linha com emoji: {e}")
+        return Paragraph(f"• {texto}", estilo)
+
+# ===== MODELO DOS RELATÓRIOS PDF =====
+# Streams das páginas em binário: codificá-los em ASCII85 custa CPU e deixa o PDF ~15% maior
+rl_config.useA85 = 0
+
+@lru_cache(maxsize=None)
+def estilos_relatorio():
+    """Estilos de parágrafo dos relatórios, criados uma única vez por processo"""
+    styles = getSampleStyleSheet()
+    estilos = {
+        'base': styles,
+        'titulo': ParagraphStyle('TituloPrincipal', parent=styles['Heading1'], fontSize=18,
+                                 spaceAfter=15, textColor=colors.HexColor('#2c3e50'), alignment=1),
+        'titulo_en': ParagraphStyle('TituloIngles', parent=styles['Normal'], fontSize=12,
+                                    textColor=colors.HexColor('#666666'), alignment=1,
+                                    fontName='Helvetica-Oblique'),
+        'subtitulo': ParagraphStyle('Subtitulo', parent=styles['Heading2'], fontSize=14,
+                                    spaceAfter=8, textColor=colors.HexColor('#34495e')),
+        'subtitulo_en': ParagraphStyle('SubtituloIngles', parent=styles['Normal'], fontSize=10,
+                                       textColor=colors.HexColor('#666666'), spaceAfter=10,
+                                       fontName='Helvetica-Oblique'),
+        'normal': ParagraphStyle('NormalCustom', parent=styles['Normal'], fontSize=10, spaceAfter=6),
+        'normal_en': ParagraphStyle('NormalIngles', parent=styles['Normal'], fontSize=8,
+                                    textColor=colors.HexColor('#666666'), spaceAfter=8,
+                                    fontName='Helvetica-Oblique'),
+        'destaque': ParagraphStyle('Destaque', parent=styles['Normal'], fontSize=12,
+                                   textColor=colors.HexColor('#27ae60'), alignment=1, spaceAfter=15),
+        'destaque_en': ParagraphStyle('DestaqueIngles', parent=styles['Normal'], fontSize=10,
+                                      textColor=colors.HexColor('#666666'), alignment=1, spaceAfter=20,
+                                      fontName='Helvetica-Oblique'),
+    }
+    estilos['nota'] = ParagraphStyle('Nota', parent=estilos['normal'], fontSize=8, textColor=colors.gray)
+    estilos['rodape'] = ParagraphStyle('Rodape', parent=estilos['normal'], fontSize=9, alignment=1,
+                                       textColor=colors.HexColor('#7f8c8d'), spaceBefore=10)
+    estilos['rodape_en'] = ParagraphStyle('RodapeEn', parent=estilos['normal'], fontSize=8, alignment=1,
+                                          textColor=colors.HexColor('#95a5a6'), spaceBefore=5)
+    return estilos
+
+def _estilo_tabela_dados(fonte, fonte_negrito, tamanho, fundo, texto, grade):
+    return TableStyle([
+        ('FONT', (0,0), (-1,-1), fonte, tamanho),
+        ('FONT', (0,0), (0,-1), fonte_negrito, tamanho),
+        ('BACKGROUND', (0,0), (0,-1), colors.HexColor(fundo)),
+        ('TEXTCOLOR', (0,0), (-1,-1), texto),
+        ('ALIGN', (0,0), (0,-1), 'LEFT'),
+        ('ALIGN', (1,0), (1,-1), 'LEFT'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('GRID', (0,0), (-1,-1), 1, colors.HexColor(grade)),
+        ('PADDING', (0,0), (-1,-1), 6),
+    ])
+
+def _estilo_tabela_emissao(fonte, fonte_negrito, cabecalho, total, grade):
+    return TableStyle([
+        ('FONT', (0,0), (-1,-1), fonte, 9),
+        ('FONT', (0,0), (-1,0), fonte_negrito, 10),
+        ('FONT', (0,-1), (-1,-1), fonte_negrito, 10),
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor(cabecalho)),
+        ('BACKGROUND', (0,-1), (-1,-1), colors.HexColor(total)),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+        ('TEXTCOLOR', (0,-1), (-1,-1), colors.white),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('GRID', (0,0), (-1,-1), 1, colors.HexColor(grade)),
+        ('PADDING', (0,0), (-1,-1), 8),
+    ])
+
+def _estilo_tabela_comparativo(fonte, fonte_negrito, cabecalho, grade):
+    return TableStyle([
+        ('FONT', (0,0), (-1,-1), fonte, 9),
+        ('FONT', (0,0), (-1,0), fonte_negrito, 10),
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor(cabecalho)),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('GRID', (0,0), (-1,-1), 1, colors.HexColor(grade)),
+        ('PADDING', (0,0), (-1,-1), 8),
+    ])
+
+@lru_cache(maxsize=None)
+def estilos_tabelas_participante():
+    """TableStyles do PDF individual (compartilháveis entre tabelas, criados uma vez)"""
+    return {
+        'dados_pt': _estilo_tabela_dados('Helvetica', 'Helvetica-Bold', 10, '#ecf0f1', colors.black, '#bdc3c7'),
+        'dados_en': _estilo_tabela_dados('Helvetica-Oblique', 'Helvetica-BoldOblique', 9, '#f9f9f9',
+                                         colors.HexColor('#666666'), '#d5dbdb'),
+        'emissao_pt': _estilo_tabela_emissao('Helvetica', 'Helvetica-Bold', '#3498db', '#27ae60', '#7f8c8d'),
+        'emissao_en': _estilo_tabela_emissao('Helvetica-Oblique', 'Helvetica-BoldOblique', '#5dade2', '#58d68d', '#aab7b8'),
+        'comparativo_pt': _estilo_tabela_comparativo('Helvetica', 'Helvetica-Bold', '#e67e22', '#d35400'),
+        'comparativo_en': _estilo_tabela_comparativo('Helvetica-Oblique', 'Helvetica-BoldOblique', '#f39c12', '#e67e22'),
+    }
+
+class ParagrafoFixo(Paragraph):
+    """Paragraph de texto fixo: a quebra de linhas é calculada uma vez e reaproveitada pelas cópias"""
+
+    def __init__(self, texto, estilo, *args, **kwargs):
+        # Paragraph.split cria as duas metades por self.__class__(None, estilo, bulletText=..., frags=...)
+        super().__init__(texto, estilo, *args, **kwargs)
+        self._quebras = {}
+
+    def wrap(self, availWidth, availHeight):
+        guardado = self._quebras.get(availWidth)
+        if guardado is None:
+            largura, altura = super().wrap(availWidth, availHeight)
+            if not largura:
+                return largura, altura
+            guardado = self._quebras[availWidth] = (self.width, self.height, self.blPara, self._wrapWidths)
+        self.width, self.height, self.blPara, self._wrapWidths = guardado
+        return self.width, self.height
+
+def _linha_divisoria(cor='#3498db', abaixo=True):
+    linha = Table([[""]], colWidths=[16*cm], rowHeights=[1])
+    comandos = [('LINEABOVE', (0,0), (-1,-1), 1, colors.HexColor(cor))]
+    if abaixo:
+        comandos.append(('LINEBELOW', (0,0), (-1,-1), 1, colors.HexColor(cor)))
+    linha.setStyle(TableStyle(comandos))
+    return linha
+
+def documento_pdf(buffer, titulo):
+    """SimpleDocTemplate com as margens comuns a todos os relatórios"""
+    return SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=18,
+        title=titulo
+    )
+
+RECOMENDACOES_PT = [
+    " Escolha acomodações próximas ao local do evento, reduzindo a necessidade de transporte motorizado",
+    " Para distâncias curtas, opte por caminhar ou pedalar, formas ativas e sustentáveis de locomoção que também favorecem a saúde e o bem-estar",
+    " Prefira transportes públicos ou coletivos para deslocamentos sempre que possível",
+    " Organize caronas solidárias com outros participantes, otimizando o uso dos veículos e diminuindo o número de deslocamentos individuais",
+    " Planeje seus deslocamentos com antecedência para evitar horários de tráfego intenso e, consequentemente, o aumento do consumo de combustível",
+    " Dê preferência a veículos elétricos ou híbridos, quando disponíveis, para minimizar o impacto ambiental dos deslocamentos",
+    " Compense emissões participando de programas de reflorestamento ou outras iniciativas ambientais reconhecidas"
+]
+
+RECOMENDACOES_EN = [
+    " Choose accommodations close to the event venue, reducing the need for motorized transport",
+    " For short distances, choose walking or cycling, active and sustainable forms of mobility that also promote health and well-being",
+    " Prefer public or collective transportation whenever possible",
+    " Organize carpooling with other participants, optimizing vehicle use and reducing the number of individual trips",
+    " Plan your trips in advance to avoid peak traffic times and consequently reduce fuel consumption",
+    " Prefer electric or hybrid vehicles when available to minimize the environmental impact of travel",
+    " Compensate emissions by participating in reforestation programs or other recognized environmental initiatives"
+]
+
+def _partes_fixas_participante():
+    """Flowables do PDF individual que não dependem do participante"""
+    estilos = estilos_relatorio()
+    titulo_pt = "Cada Deslocamento Conta: Seu Impacto em CO2e no Evento"
+    titulo_en = translations.get(titulo_pt, "Every Trip Counts: Your CO2e Impact at the Event")
+
+    recomendacoes = [ParagrafoFixo("RECOMENDAÇÕES PARA REDUZIR EMISSÕES", estilos['subtitulo'])]
+    for rec_pt in RECOMENDACOES_PT:
+        recomendacoes += [ParagrafoFixo(f"• {rec_pt}", estilos['normal']), Spacer(1, 4)]
+    recomendacoes += [Spacer(1, 15), ParagrafoFixo("RECOMMENDATIONS TO REDUCE EMISSIONS", estilos['subtitulo_en'])]
+    for rec_en in RECOMENDACOES_EN:
+        recomendacoes += [ParagrafoFixo(f"<font color='#666666'><i>• {rec_en}</i></font>", estilos['normal_en']),
+                          Spacer(1, 6)]
+    recomendacoes.append(Spacer(1, 20))
+
+    return {
+        'cabecalho': [
+            ParagrafoFixo(titulo_pt, estilos['titulo']),
+            ParagrafoFixo(titulo_en, estilos['titulo_en']),
+            Spacer(1, 15),
+            _linha_divisoria(),
+            Spacer(1, 20),
+        ],
+        'titulo_dados': [ParagrafoFixo("DADOS DO PARTICIPANTE", estilos['subtitulo'])],
+        'titulo_dados_en': [ParagrafoFixo("PARTICIPANT DATA", estilos['subtitulo_en'])],
+        'titulo_emissao': [ParagrafoFixo("RESUMO DA EMISSÃO", estilos['subtitulo'])],
+        'titulo_emissao_en': [ParagrafoFixo("EMISSIONS SUMMARY", estilos['subtitulo_en'])],
+        'titulo_equivalencias': [ParagrafoFixo("IMPACTO AMBIENTAL - EQUIVALÊNCIAS", estilos['subtitulo'])],
+        'nota_equivalencias': [
+            ParagrafoFixo("* Baseado na média brasileira de 4.4 toneladas de CO2e per capita/ano", estilos['nota']),
+            Spacer(1, 15),
+            ParagrafoFixo("ENVIRONMENTAL IMPACT - EQUIVALENCES", estilos['subtitulo_en']),
+        ],
+        'nota_equivalencias_en': [
+            ParagrafoFixo("<font color='#666666'><i>* Based on the Brazilian average of 4.4 tons of CO2e per capita/year</i></font>",
+                      estilos['nota']),
+            Spacer(1, 25),
+        ],
+        'recomendacoes': recomendacoes,
+        'rodape': [
+            Spacer(1, 10),
+            _linha_divisoria('#95a5a6', abaixo=False),
+            ParagrafoFixo("Calculadora de Emissão de CO2e - Eventos Esportivos Sustentáveis<br/>"
+                      "Uma iniciativa da parceria entre CBVela e ETTA/UFF com o apoio do CNPq e Faperj "
+                      "para promover a conscientização ambiental em eventos esportivos", estilos['rodape']),
+            Spacer(1, 10),
+            ParagrafoFixo("<font color='#666666'><i>CO2e Emissions Calculator - Sustainable Sporting Events<br/>"
+                      "An initiative of the partnership between CBVela and ETTA/UFF with support from CNPq and Faperj "
+                      "to promote environmental awareness in sporting events</i></font>", estilos['rodape_en']),
+        ],
+    }
+
+# Partes fixas por thread; cada PDF recebe cópias rasas, pois o ReportLab guarda estado de layout nelas
+_modelo_participante_local = threading.local()
+
+def _fixo(nome):
+    partes = getattr(_modelo_participante_local, 'partes', None)
+    if partes is None:
+        partes = _modelo_participante_local.partes = _partes_fixas_participante()
+    return [copy.copy(flowable) for flowable in partes[nome]]
+
+def _tabela(linhas, larguras, estilo):
+    tabela = Table(linhas, colWidths=larguras)
+    tabela.setStyle(estilos_tabelas_participante()[estilo])
+    return tabela
+
+def _secao_dados_participante(registro):
+    tipo_traduzido = translations.get(registro['tipo_participante'])
+    dados_pessoais_pt = [
+        ["País de Origem:", registro['pais_origem_pt']],
+        ["Tipo de Participante:", registro['tipo_participante']],
+        ["Email:", registro['email']],
+    ]
+    dados_pessoais_en = [
+        ["Country of Origin:", registro['pais_origem_en']],
+        ["Participant Type:", tipo_traduzido],
+        ["Email:", registro['email']],
+    ]
+    return [
+        *_fixo('titulo_dados'),
+        _tabela(dados_pessoais_pt, [4*cm, 10*cm], 'dados_pt'),
+        Spacer(1, 10),
+        *_fixo('titulo_dados_en'),
+        _tabela(dados_pessoais_en, [4*cm, 10*cm], 'dados_en'),
+        Spacer(1, 25),
+    ]
+
+def _secao_emissao_participante(registro):
+    estilos = estilos_relatorio()
+    emissao_local = EMISSOES_TRANSPORTE.get(registro['transporte_local'], 5.0) * registro['distancia_local'] * registro['dias_evento']
+    emissao_principal = registro['emissao_total'] - emissao_local
+
+    transporte_cidade_pt = registro['transporte_cidade'].capitalize()
+    transporte_cidade_en = translations.get(registro['transporte_cidade']) or "City Transport"
+    transporte_local_pt = registro['transporte_local'].capitalize()
+    transporte_local_en = translations.get(registro['transporte_local']) or "Local Commute"
+
+    detalhes_emissao_pt = [
+        ["Tipo de Deslocamento", "Transporte", "Distância", "Emissão (kgCO2e)"],
+        ["Até a cidade do evento", transporte_cidade_pt, f"{registro['distancia_cidade']} km", f"{emissao_principal:.2f}"],
+        ["Deslocamento local", transporte_local_pt,
+         f"{registro['distancia_local']} km/dia × {registro['dias_evento']} dias", f"{emissao_local:.2f}"],
+        ["TOTAL", "", "", f"{registro['emissao_total']:.2f} kgCO2e"]
+    ]
+    detalhes_emissao_en = [
+        ["Trip Type", "Transport", "Distance", "Emissions (kgCO2e)"],
+        ["To the event city", transporte_cidade_en, f"{registro['distancia_cidade']} km", f"{emissao_principal:.2f}"],
+        ["Local commute", transporte_local_en,
+         f"{registro['distancia_local']} km/day × {registro['dias_evento']} days", f"{emissao_local:.2f}"],
+        ["TOTAL", "", "", f"{registro['emissao_total']:.2f} kgCO2e"]
+    ]
+    larguras = [5.5*cm, 3*cm, 4*cm, 3.5*cm]
+    return [
+        *_fixo('titulo_emissao'),
+        Paragraph(f"TOTAL DE EMISSÕES: {registro['emissao_total']:.2f} kgCO2e", estilos['destaque']),
+        _tabela(detalhes_emissao_pt, larguras, 'emissao_pt'),
+        Spacer(1, 15),
+        *_fixo('titulo_emissao_en'),
+        Paragraph(f"<font color='#666666'><i>TOTAL EMISSIONS: {registro['emissao_total']:.2f} kgCO2</i></font>",
+                  estilos['destaque_en']),
+        _tabela(detalhes_emissao_en, larguras, 'emissao_en'),
+        Spacer(1, 25),
+    ]
+
+def _secao_equivalencias_participante(registro):
+    arvores = registro['emissao_total'] / 7000000  # 1 árvore absorve ~7.000.000g CO2/ano ou 7 toneladas de CO2/ano
+    lampadas = registro['emissao_total'] / 450   # 1 lâmpada LED/dia
+    comparativos_pt = [
+        ["Equivalência", "Valor Aproximado"],
+        ["Árvores para absorver em 1 ano", f"{arvores:.2f} árvores"],
+        ["Horas de lâmpada LED (60W)", f"{lampadas:.1f} horas"],
+        ["Emissão diária média brasileira*", "≈ 12 kgCO2e"]
+    ]
+    comparativos_en = [
+        ["Equivalence", "Approximate Value"],
+        ["Trees to absorb in 1 year", f"{arvores:.2f} trees"],
+        ["Hours of LED bulb (60W)", f"{lampadas:.1f} hours"],
+        ["Average daily Brazilian emission*", "≈ 12 kgCO2e"]
+    ]
+    return [
+        *_fixo('titulo_equivalencias'),
+        _tabela(comparativos_pt, [9*cm, 7*cm], 'comparativo_pt'),
+        *_fixo('nota_equivalencias'),
+        _tabela(comparativos_en, [9*cm, 7*cm], 'comparativo_en'),
+        *_fixo('nota_equivalencias_en'),
+    ]
+
+def gerar_pdf(registro):
+    """Gera PDF com os resultados do questionário - TABELAS SEPARADAS PT/EN"""
+    try:
+        buffer = BytesIO()
+        doc = documento_pdf(buffer, f"Emissão CO2e - {registro['email']} | CO2e Emissions - {registro['email']}")
+
+        # Só as tabelas com os dados do participante são montadas a cada chamada
+        elements = [
+            *_fixo('cabecalho'),
+            *_secao_dados_participante(registro),
+            *_secao_emissao_participante(registro),
+            *_secao_equivalencias_participante(registro),
+            *_fixo('recomendacoes'),
+            *_fixo('rodape'),
+        ]
+        doc.build(elements)
+        buffer.seek(0)
+        return buffer
+
+    except Exception as e:
+        print(f"Erro ao gerar PDF detalhado: {str(e)}")
+        return gerar_pdf_simples(registro)
+
+def gerar_pdf_simples(registro):
     """Fallback: PDF simples caso a versão detalhada falhe"""
     buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(100, 800, "Cada Deslocamento Conta: Seu Impacto em CO2 no Evento")
-    
-    p.setFont("Helvetica", 12)
-    p.drawString(100, 770, f"Email: {registro['email']}")
-    p.drawString(100, 750, f"Tipo: {registro['tipo_participante']}")
-    
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(100, 700, f"Emissão Total: {registro['emissao_total']:.2f} kgCO2")
-    
-    p.setFont("Helvetica", 10)
-    p.drawString(100, 670, f"Transporte principal: {registro['transporte_cidade']}")
-    p.drawString(100, 650, f"Distância: {registro['distancia_cidade']} km")
-    p.drawString(100, 630, f"Transporte local: {registro['transporte_local']}")
-    p.drawString(100, 610, f"Dias de evento: {registro['dias_evento']}")
-    
-    p.drawString(100, 550, "Uma iniciativa da parceria entre CBVela e ETTA/UFF com o apoio do CNPq e Faperj para promover aconscientização ambiental em eventos esportivos")
-    p.drawString(100, 530, "Calculadora de Emissões - Eventos Sustentáveis")
-    
-    p.showPage()
-    p.save()
+    try:
+        estilos = estilos_relatorio()
+        doc = documento_pdf(buffer, f"Emissão CO2e - {registro['email']}")
+        linhas = [
+            f"Email: {escape(str(registro['email']))}",
+            f"Tipo: {escape(str(registro['tipo_participante']))}",
+            f"Transporte principal: {escape(str(registro['transporte_cidade']))}",
+            f"Distância: {registro['distancia_cidade']} km",
+            f"Transporte local: {escape(str(registro['transporte_local']))}",
+            f"Dias de evento: {registro['dias_evento']}",
+        ]
+        doc.build([
+            *_fixo('cabecalho'),
+            Paragraph(f"Emissão Total: {registro['emissao_total']:.2f} kgCO2", estilos['destaque']),
+            *[Paragraph(linha, estilos['normal']) for linha in linhas],
+            *_fixo('rodape'),
+        ])
+    except Exception as e:
+        # Último recurso: texto direto no canvas, sem depender do modelo
+        print(f"Erro ao gerar PDF simples: {str(e)}")
+        buffer = BytesIO()
+        p = canvas.Canvas(buffer, pagesize=A4)
+        p.setFont("Helvetica-Bold", 16)
+        p.drawString(100, 800, "Cada Deslocamento Conta: Seu Impacto em CO2 no Evento")
+        p.setFont("Helvetica", 12)
+        p.drawString(100, 770, f"Email: {registro['email']}")
+        p.drawString(100, 750, f"Emissão Total: {registro['emissao_total']:.2f} kgCO2")
+        p.showPage()
+        p.save()
     buffer.seek(0)
     return buffer
 
-def criar_tabela_simples(dados, col_widths, styles, header_color='#3498db'):
+def criar_tabela_simples(dados, col_widths, styles, header_color='#3498db'):
+    """
+    Cria uma tabela simples monolíngue com cabeçalho colorido.
+    dados: lista de listas (primeira linha é cabeçalho)
+    col_widths: larguras das colunas em cm
+    styles: objeto StyleSheet do reportlab
+    header_color: cor de fundo do cabeçalho (hex)
+    """
+    from reportlab.platypus import Table, TableStyle, Paragraph
+    from reportlab.lib import colors
+    
+    tabela_dados = []
+    for i, linha in enumerate(dados):
+        nova_linha = []
+        for item in linha:
+            if isinstance(item, str):
+                if i == 0:  # cabeçalho
+                    estilo = ParagraphStyle('Header', parent=styles['Normal'], 
+                                            fontSize=10, textColor=colors.white, alignment=1)
+                else:
+                    estilo = styles['Normal']
+                nova_linha.append(Paragraph(item, estilo))
+            else:
+                nova_linha.append(item)
+        tabela_dados.append(nova_linha)
+    
+    tabela = Table(tabela_dados, colWidths=col_widths)
+    tabela.setStyle(TableStyle([
+        ('FONT', (0,0), (-1,0), 'Helvetica-Bold', 10),
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor(header_color)),
+        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#bdc3c7')),
+        ('PADDING', (0,0), (-1,-1), 6),
+    ]))
+    return tabela
+
+
+# ===== RECEBIMENTO DE RESPOSTAS =====
+LOTE_MAXIMO = int(os.environ.get('LOTE_MAXIMO', '200'))
+# Mesmo email reenviado no mesmo evento: substituir a resposta anterior, manter a primeira ou gravar as duas.
+# O padrão vale para os eventos sem modo próprio; fora de um evento a deduplicação fica desligada
+DEDUPLICACAO_MODOS = ('substituir', 'manter', 'desligada')
+DEDUPLICACAO_PADRAO = os.environ.get('DEDUPLICACAO_PADRAO', 'substituir')
+
+def _texto_campo(dados, nome):
+    valor = dados.get(nome)
+    return '' if valor is None else str(valor).strip()
+
+# Faixas aceitas no envio (mínimo, máximo); fora delas a resposta é recusada. Valores
+# possíveis mas improváveis ficam para a verificação estatística (VALORES ATÍPICOS)
+LIMITES_CAMPOS = {
+    'distancia_cidade': (0, 45000),  # ida e volta: pouco mais que uma volta ao mundo
+    'distancia_local': (0, 2000),
+    'dias_evento': (1, 366),
+}
+GASTO_MAXIMO = float(os.environ.get('GASTO_MAXIMO', '1000000'))
+
+def _conferir_limites(nome, valor):
+    minimo, maximo = LIMITES_CAMPOS.get(nome, (0, GASTO_MAXIMO))
+    if not math.isfinite(valor) or not minimo <= valor <= maximo:
+        raise ValueError(f"Valor fora do intervalo aceito para {nome}: {valor:g} (de {minimo:g} a {maximo:g})")
+    return valor
+
+def _numero_obrigatorio(dados, nome, conversor=float):
+    valor = _texto_campo(dados, nome)
+    try:
+        valor = conversor(valor)
+    except ValueError:
+        raise ValueError(f"Valor inválido para {nome}: '{valor}'")
+    return _conferir_limites(nome, valor)
+
+def _numero_opcional(dados, nome):
+    """Campo em branco vira nulo; preenchido, segue as mesmas regras dos obrigatórios"""
+    if not _texto_campo(dados, nome):
+        return None
+    return _numero_obrigatorio(dados, nome)
+
+def calcular_emissao_total(transporte_principal, distancia_principal, transporte_local, distancia_local, dias_evento):
+    """Emissão da resposta em kgCO2 com os fatores atuais de EMISSOES_TRANSPORTE"""
+    emissao_principal = EMISSOES_TRANSPORTE.get(transporte_principal, 5.0) * distancia_principal
+    emissao_local = EMISSOES_TRANSPORTE.get(transporte_local, 5.0) * distancia_local * dias_evento
+    return (emissao_principal + emissao_local)/1000  # Converte para kgCO2
+
+def processar_formulario(dados_form):
+    """Valida os campos de uma resposta (formulário ou JSON) e calcula a emissão
+
+    Devolve os argumentos para RespostaEmissao; levanta ValueError se algo obrigatório faltar.
+    """
+    pais_pt = _texto_campo(dados_form, 'pais_origem')
+    if not pais_pt:
+        raise ValueError("Selecione um país de origem.")
+    pais_pt = indice_paises().resolver(pais_pt)
+    if pais_pt not in PAISES_DICT:
+        raise ValueError(f"País de origem desconhecido: '{pais_pt}'. Escolha um país da lista.")
+    pais_en = PAISES_DICT[pais_pt]
+    # Estado só vale para quem vem do Brasil ("Não se aplica" e estados desconhecidos viram nulo)
+    estado = _texto_campo(dados_form, 'estado_origem')
+    estado = estado if pais_pt == 'Brasil' and estado in COORDENADAS_ESTADOS else None
+
+    email = _texto_campo(dados_form, 'email')
+    if not email:
+        raise ValueError("Informe o email.")
+
+    tipo_participante = _texto_campo(dados_form, 'tipo_participante')
+    if not tipo_participante:
+        raise ValueError("Selecione o tipo de participante.")
+    if tipo_participante not in TIPOS_PARTICIPANTE:
+        raise ValueError(f"Tipo de participante desconhecido: '{tipo_participante}'")
+
+    transporte_principal = _texto_campo(dados_form, 'transporte_cidade')
+    transporte_local = _texto_campo(dados_form, 'transporte_local')
+    if not transporte_principal or not transporte_local:
+        raise ValueError("Selecione os meios de transporte.")
+    for transporte in (transporte_principal, transporte_local):
+        if transporte not in EMISSOES_TRANSPORTE:
+            raise ValueError(f"Meio de transporte desconhecido: '{transporte}'")
+
+    distancia_principal = _numero_obrigatorio(dados_form, 'distancia_cidade')
+    distancia_local = _numero_obrigatorio(dados_form, 'distancia_local')
+    dias_evento = _numero_obrigatorio(dados_form, 'dias_evento', int)
+
+    emissao_total = calcular_emissao_total(transporte_principal, distancia_principal,
+                                           transporte_local, distancia_local, dias_evento)
+
+    pontos_turisticos = _texto_campo(dados_form, 'pontos_turisticos')
+
+    return dict(
+        email=email,
+        pais_origem_pt=pais_pt,
+        pais_origem_en=pais_en,
+        estado_origem=estado,
+        tipo_participante=tipo_participante,
+        transporte_cidade=transporte_principal,
+        distancia_cidade=distancia_principal,
+        custo_transporte=_numero_opcional(dados_form, 'custo_transporte'),
+        transporte_local=transporte_local,
+        distancia_local=distancia_local,
+        dias_evento=dias_evento,
+        custo_transporte_diario=_numero_opcional(dados_form, 'custo_transporte_diario'),
+
+        gasto_alimentacao=_numero_opcional(dados_form, 'gasto_alimentacao'),
+        gasto_equipamentos=_numero_opcional(dados_form, 'gasto_equipamentos'),
+        gasto_botes=_numero_opcional(dados_form, 'gasto_botes'),
+        gasto_hospedagem=_numero_opcional(dados_form, 'gasto_hospedagem'),
+        pontos_turisticos=pontos_turisticos or None,
+
+        emissao_total=emissao_total
+    )
+
+def chave_unica_resposta(evento_id, email):
+    return f"{evento_id}:{email.strip().lower()}"
+
+def politica_deduplicacao(sessao):
+    """(modo, id do evento aberto) que vale para as respostas gravadas agora
+
+    Sem evento aberto não há deduplicação: o mesmo email em regatas diferentes
+    são viagens diferentes, e nada separa uma da outra fora de um evento.
+    """
+    aberto = sessao.query(Evento).filter(Evento.id_final.is_(None)).first()
+    if aberto is None:
+        return 'desligada', None
+    return aberto.modo_deduplicacao, aberto.id
+
+def _inserir_respostas_transacao(sessao, itens):
+    chaves = {chave for chave, _ in itens if chave}
+    existentes = {}
+    if chaves:
+        existentes = dict(sessao.query(ChaveIdempotencia.chave, ChaveIdempotencia.resposta_id)
+                          .filter(ChaveIdempotencia.chave.in_(chaves)).all())
+
+    # Respostas anteriores do mesmo email no evento, pelo índice único de chave_unica
+    modo, evento_id = politica_deduplicacao(sessao)
+    anteriores = {}
+    if modo != 'desligada':
+        unicas = {chave_unica_resposta(evento_id, campos['email']) for _, campos in itens}
+        anteriores = {resposta.chave_unica: resposta for resposta in
+                      sessao.query(RespostaEmissao).filter(RespostaEmissao.chave_unica.in_(unicas))}
+
+    resultados, novas = [], {}
+    for chave, campos in itens:
+        if chave in existentes:
+            resultados.append((chave, existentes[chave], 'duplicado'))
+            continue
+        if chave in novas:
+            resultados.append((chave, novas[chave], 'duplicado'))
+            continue
+
+        unica = chave_unica_resposta(evento_id, campos['email']) if modo != 'desligada' else None
+        anterior = anteriores.get(unica)
+        if anterior is None:
+            resposta, status = RespostaEmissao(**campos, chave_unica=unica), 'criado'
+            sessao.add(resposta)
+            if unica:
+                anteriores[unica] = resposta
+        elif modo == 'substituir':
+            # Atualiza no lugar: o id (e portanto o evento) continua o mesmo, e o
+            # flush registra um 'update' no feed, que invalida agregados e caches
+            for campo, valor in campos.items():
+                setattr(anterior, campo, valor)
+            resposta, status = anterior, 'atualizado'
+        else:
+            resposta, status = anterior, 'duplicado'
+        resultados.append((chave, resposta, status))
+        if chave:
+            novas[chave] = resposta
+
+    sessao.flush()
+    for chave, resposta in novas.items():
+        sessao.add(ChaveIdempotencia(chave=chave, resposta_id=resposta.id))
+    # Ids lidos antes do commit, que expira os objetos da sessão
+    resultados = [(chave, resposta if isinstance(resposta, int) else resposta.id, status)
+                  for chave, resposta, status in resultados]
+    sessao.commit()
+    return resultados
+
+def inserir_respostas_direto(itens, sessao=None):
+    """Grava as respostas na sessão informada (ou db.session), numa única transação"""
+    sessao = sessao or db.session
+    try:
+        return _inserir_respostas_transacao(sessao, itens)
+    except IntegrityError:
+        # Outro envio com a mesma chave (ou o mesmo email) venceu a corrida: na segunda tentativa ela já existe
+        sessao.rollback()
+        return _inserir_respostas_transacao(sessao, itens)
+
+def inserir_respostas(itens, referencia=None):
+    """Grava [(chave_idempotencia, campos), ...] numa única transação
+
+    Antes de gravar, classificar_respostas separa os valores atípicos para revisão.
+    Chaves já vistas não geram nova linha, e o mesmo email no mesmo evento segue a
+    deduplicação do evento. Devolve [(chave, id, 'criado'|'atualizado'|'duplicado'), ...].
+    No SQLite as gravações passam pelo escritor único do processo (commits em grupo).
+    """
+    itens = classificar_respostas(itens, referencia)
+    if usar_escritor_sqlite():
+        return escritor_sqlite.executar(itens)
+    return inserir_respostas_direto(itens)
+
+
+# ===== VALIDAÇÃO: VALORES ATÍPICOS =====
+# Cada valor é comparado com as respostas aceitas do evento aberto pelo escore robusto
+# (x - mediana) / (MAD / 0,6745), em escala log: distâncias e gastos têm cauda longa à
+# direita. Distâncias são comparadas dentro do mesmo meio de transporte; gastos, no evento todo.
+CAMPOS_ATIPICOS = {
+    'distancia_cidade': 'transporte_cidade',
+    'distancia_local': 'transporte_local',
+    'custo_transporte': None,
+    'custo_transporte_diario': None,
+    'gasto_alimentacao': None,
+    'gasto_equipamentos': None,
+    'gasto_botes': None,
+    'gasto_hospedagem': None,
+}
+ATIPICOS_LIMIAR = float(os.environ.get('ATIPICOS_LIMIAR', '3.5'))
+ATIPICOS_MINIMO_AMOSTRAS = int(os.environ.get('ATIPICOS_MINIMO_AMOSTRAS', '30'))
+# Escala mínima (em log): se quase todos respondem o mesmo valor, só passa de ~3,6x a mediana
+ATIPICOS_ESCALA_MINIMA = 0.37
+ATIPICOS_CACHE_SEGUNDOS = int(os.environ.get('ATIPICOS_CACHE_SEGUNDOS', '60'))
+# 'quarentena': a resposta fica 'pendente', fora dos agregados; 'sinalizar': entra, mas aguarda revisão
+ATIPICOS_ACAO = os.environ.get('ATIPICOS_ACAO', 'quarentena')
+
+_referencia_atipicos = {}
+_lock_referencia_atipicos = threading.Lock()
+
+def calcular_referencia_atipicos(colunas):
+    """{campo: {grupo: (mediana, escala)}} em log, a partir das colunas numpy das respostas aceitas
+
+    Grupos com menos de ATIPICOS_MINIMO_AMOSTRAS valores ficam de fora (não são verificados).
+    """
+    referencia = {}
+    for campo, campo_grupo in CAMPOS_ATIPICOS.items():
+        valores = np.log1p(colunas[campo])
+        grupos = colunas[campo_grupo] if campo_grupo else np.full(len(valores), '')
+        preenchidos = ~np.isnan(valores)
+        por_grupo = {}
+        for grupo in np.unique(grupos[preenchidos]):
+            amostra = valores[preenchidos & (grupos == grupo)]
+            if len(amostra) < ATIPICOS_MINIMO_AMOSTRAS:
+                continue
+            mediana = np.median(amostra)
+            desvios = np.abs(amostra - mediana)
+            mad = np.median(desvios)
+            # MAD nulo (mais da metade igual à mediana): desvio absoluto médio, como em Iglewicz e Hoaglin
+            escala = mad / 0.6745 if mad > 0 else 1.253314 * desvios.mean()
+            por_grupo[str(grupo)] = (float(mediana), max(float(escala), ATIPICOS_ESCALA_MINIMA))
+        referencia[campo] = por_grupo
+    return referencia
+
+# Colunas de um arquivo importado usadas como referência: os campos verificados e os que definem os grupos
+COLUNAS_ATIPICOS = list(CAMPOS_ATIPICOS) + sorted({grupo for grupo in CAMPOS_ATIPICOS.values() if grupo})
+
+def colunas_atipicos(linhas):
+    """Tuplas na ordem de COLUNAS_ATIPICOS → colunas numpy (None vira nan nas numéricas)"""
+    colunas = {}
+    for nome, valores in zip(COLUNAS_ATIPICOS, zip(*linhas) if linhas else [()] * len(COLUNAS_ATIPICOS)):
+        colunas[nome] = np.array(valores, dtype=np.float64 if nome in CAMPOS_ATIPICOS else str)
+    return colunas
+
+def local_evento_aberto():
+    """(lat, lon) do evento aberto, ou None se não há evento aberto ou ele não tem local"""
+    with sessao_leitura() as sessao:
+        aberto = sessao.query(Evento).filter(Evento.id_final.is_(None)).first()
+        return aberto.local if aberto else None
+
+def referencia_atipicos():
+    """Referência do evento aberto (ou de todas as respostas), recalculada a cada ATIPICOS_CACHE_SEGUNDOS"""
+    with sessao_leitura() as sessao:
+        aberto = sessao.query(Evento.id, Evento.id_inicial).filter(Evento.id_final.is_(None)).first()
+        chave = aberto.id if aberto else 0
+        with _lock_referencia_atipicos:
+            guardado = _referencia_atipicos.get(chave)
+        if guardado is not None and time.monotonic() - guardado[0] < ATIPICOS_CACHE_SEGUNDOS:
+            return guardado[1]
+    colunas = snapshot_respostas(aberto.id_inicial if aberto else None, situacoes=('aceita',),
+                                 campos=COLUNAS_ATIPICOS)
+    for grupo in {grupo for grupo in CAMPOS_ATIPICOS.values() if grupo}:
+        colunas[grupo] = rotulos_snapshot(colunas, grupo)
+    referencia = calcular_referencia_atipicos(colunas)
+    with _lock_referencia_atipicos:
+        _referencia_atipicos[chave] = (time.monotonic(), referencia)
+    return referencia
+
+def avaliar_atipicos(lista_campos, referencia):
+    """Motivos de revisão de cada resposta (lista vazia se nada for atípico), com o lote inteiro de uma vez"""
+    motivos = [[] for _ in lista_campos]
+    for campo, campo_grupo in CAMPOS_ATIPICOS.items():
+        por_grupo = referencia.get(campo)
+        if not por_grupo:
+            continue
+        valores = np.array([campos.get(campo) for campos in lista_campos], dtype=np.float64)
+        grupos = [campos[campo_grupo] if campo_grupo else '' for campos in lista_campos]
+        estatisticas = np.array([por_grupo.get(grupo, (np.nan, np.nan)) for grupo in grupos], dtype=np.float64)
+        escores = (np.log1p(valores) - estatisticas[:, 0]) / estatisticas[:, 1]
+        # Só o lado de cima: valores baixos demais não distorcem totais nem gráficos
+        with np.errstate(invalid='ignore'):
+            atipicos = np.flatnonzero(escores > ATIPICOS_LIMIAR)
+        for i in atipicos:
+            grupo = f" ({grupos[i]})" if campo_grupo else ''
+            motivos[i].append(f"{campo}{grupo}: {valores[i]:g}, mediana {math.expm1(estatisticas[i, 0]):.0f}")
+    return motivos
+
+def classificar_respostas(itens, referencia=None):
+    """Etapa comum aos envios (formulário, lote e importação): marca situacao e motivos_revisao
+
+    A validação de formato e faixas já aconteceu em processar_formulario; aqui entram os
+    valores possíveis mas atípicos para o evento (referência padrão: referencia_atipicos()) e
+    as distâncias muito diferentes da estimada a partir da origem até o local do evento.
+    """
+    lista_campos = [campos for _, campos in itens]
+    motivos = [
+        atipicos + geograficos for atipicos, geograficos in zip(
+            avaliar_atipicos(lista_campos, referencia or referencia_atipicos()),
+            avaliar_distancias_declaradas(lista_campos, local_evento_aberto()),
+        )
+    ]
+    situacao_atipica = 'pendente' if ATIPICOS_ACAO == 'quarentena' else 'sinalizada'
+    return [
+        (chave, {**campos, 'situacao': situacao_atipica if motivo else 'aceita',
+                 'motivos_revisao': '; '.join(motivo) or None})
+        for (chave, campos), motivo in zip(itens, motivos)
+    ]
+
+
+# ===== FEED DE ALTERAÇÕES =====
+FEED_LIMITE_PADRAO = 500
+FEED_LIMITE_MAXIMO = 5000
+# Os leitores do feed (cursor do /alteracoes, snapshot colunar, índice de caronas) avançam
+# pelo maior seq visível, então um seq menor não pode ficar visível depois de um maior.
+# No SQLite a trava de escrita já garante isso: ela vai do primeiro INSERT até o commit.
+# No PostgreSQL, quem grava respostas pega esta trava consultiva até o commit.
+TRAVA_FEED_PG = 4203
+
+def _ordenar_alteracoes(sessao, contexto_flush, instancias):
+    """Antes do flush que toca respostas, serializa as transações do feed (PostgreSQL)"""
+    if sessao.get_bind().dialect.name != 'postgresql' or sessao.info.get('trava_feed'):
+        return
+    if any(isinstance(objeto, RespostaEmissao) for objeto in (*sessao.new, *sessao.dirty, *sessao.deleted)):
+        sessao.connection().execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': TRAVA_FEED_PG})
+        sessao.info['trava_feed'] = True
+
+def _liberar_trava_feed(sessao, transacao):
+    # O PostgreSQL solta a trava no fim da transação; a próxima pega de novo
+    sessao.info.pop('trava_feed', None)
+
+def _registrar_alteracoes(sessao, contexto_flush):
+    """Depois de cada flush, registra as respostas inseridas, alteradas e removidas"""
+    alteracoes = []
+    for objeto in sessao.new:
+        if isinstance(objeto, RespostaEmissao):
+            alteracoes.append({'resposta_id': objeto.id, 'operacao': 'insert'})
+    for objeto in sessao.dirty:
+        if isinstance(objeto, RespostaEmissao) and sessao.is_modified(objeto, include_collections=False):
+            alteracoes.append({'resposta_id': objeto.id, 'operacao': 'update'})
+    for objeto in sessao.deleted:
+        if isinstance(objeto, RespostaEmissao):
+            alteracoes.append({'resposta_id': objeto.id, 'operacao': 'delete'})
+    if alteracoes:
+        agora = datetime.utcnow()
+        for alteracao in alteracoes:
+            alteracao['criado_em'] = agora
+        sessao.connection().execute(AlteracaoResposta.__table__.insert(), alteracoes)
+
+event.listen(Session, 'before_flush', _ordenar_alteracoes)
+event.listen(Session, 'after_flush', _registrar_alteracoes)
+event.listen(Session, 'after_transaction_end', _liberar_trava_feed)
+
+def semear_alteracoes():
+    """Na primeira execução, registra as respostas já existentes como inserções"""
+    if db.session.query(AlteracaoResposta.seq).first() is not None:
+        return
+    existentes = db.session.query(func.count(RespostaEmissao.id)).scalar() or 0
+    if existentes:
+        db.session.execute(AlteracaoResposta.__table__.insert().from_select(
+            ['resposta_id', 'operacao', 'criado_em'],
+            db.select(RespostaEmissao.id, db.literal('insert'), db.literal(datetime.utcnow()))
+            .order_by(RespostaEmissao.id)
+        ))
+        db.session.commit()
+        print(f"📦 Feed de alterações iniciado com {existentes} respostas existentes")
+
+def versao_dados():
+    """Versão dos dados ("seq do feed.geração"): muda sempre que alguma resposta é inserida,
+    alterada, removida, arquivada ou restaurada. São duas consultas pela chave primária."""
+    with sessao_leitura() as sessao:
+        seq = sessao.query(func.max(AlteracaoResposta.seq)).scalar() or 0
+        geracao = sessao.query(GeracaoDados.geracao).filter(GeracaoDados.id == 1).scalar() or 0
+    return f"{seq}.{geracao}"
+
+def codificar_cursor(seq):
+    return base64.urlsafe_b64encode(f"v1:{seq}".encode()).decode().rstrip('=')
+
+def decodificar_cursor(cursor):
+    """Seq a partir do cursor opaco; levanta ValueError se o cursor for inválido"""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        versao, seq = texto.split(':')
+        if versao != 'v1':
+            raise ValueError
+        return int(seq)
+    except ValueError:
+        raise ValueError("Cursor inválido")
+
+def ler_alteracoes(apos_seq=0, limite=FEED_LIMITE_PADRAO, desde=None):
+    """Próximo lote do feed: [(seq, operacao, resposta_id, dados ou None)], último seq lido e se há mais"""
+    with sessao_leitura() as sessao:
+        consulta = sessao.query(AlteracaoResposta).filter(AlteracaoResposta.seq > apos_seq)
+        if desde is not None:
+            consulta = consulta.filter(AlteracaoResposta.criado_em >= desde)
+        lote = consulta.order_by(AlteracaoResposta.seq).limit(limite + 1).all()
+        mais = len(lote) > limite
+        lote = lote[:limite]
+
+        # Uma resposta alterada várias vezes no lote sai uma vez só, no seu último seq
+        ultimo_seq_da_resposta = {alteracao.resposta_id: alteracao.seq for alteracao in lote}
+        ids = list(ultimo_seq_da_resposta)
+        respostas = {}
+        for inicio in range(0, len(ids), EXPORTACAO_LOTE_CONSULTA):
+            bloco = ids[inicio:inicio + EXPORTACAO_LOTE_CONSULTA]
+            for resposta in sessao.query(RespostaEmissao).filter(RespostaEmissao.id.in_(bloco)):
+                respostas[resposta.id] = resposta.to_dict()
+
+    itens = []
+    for alteracao in lote:
+        if ultimo_seq_da_resposta[alteracao.resposta_id] != alteracao.seq:
+            continue
+        dados = respostas.get(alteracao.resposta_id)
+        # Sem a linha na tabela, o estado final é de remoção, seja qual for a operação registrada
+        operacao = alteracao.operacao if dados is not None else 'delete'
+        itens.append((alteracao.seq, operacao, alteracao.resposta_id, dados))
+    ultimo_seq = lote[-1].seq if lote else apos_seq
+    return itens, ultimo_seq, mais
+
+
+# ===== ARQUIVAMENTO DE EVENTOS =====
+# Respostas de eventos encerrados saem da tabela principal para arquivos .npz colunares
+ARQUIVO_DIR = os.environ.get('ARQUIVO_DIR') or os.path.join(app.instance_path, 'arquivo')
+
+def _colunas_resposta():
+    return list(RespostaEmissao.__table__.columns)
+
+def _colunas_para_npz(registros):
+    """Uma coluna numpy por campo; campos anuláveis ganham uma máscara 'nulo__<campo>'"""
+    arrays = {}
+    for coluna in _colunas_resposta():
+        valores = [registro[coluna.name] for registro in registros]
+        if isinstance(coluna.type, (db.Integer, db.Numeric)):
+            tipo = np.int64 if isinstance(coluna.type, db.Integer) else np.float64
+            arrays[coluna.name] = np.array([0 if v is None else v for v in valores], dtype=tipo)
+        else:
+            arrays[coluna.name] = np.array(['' if v is None else str(v) for v in valores], dtype=str)
+        if coluna.nullable:
+            arrays[f"nulo__{coluna.name}"] = np.array([v is None for v in valores], dtype=bool)
+    return arrays
+
+def _npz_para_registros(arrays):
+    """Inverso de _colunas_para_npz (colunas que não existem mais no modelo são ignoradas)"""
+    total = len(arrays['id'])
+    colunas = {}
+    for coluna in _colunas_resposta():
+        if coluna.name not in arrays:
+            continue
+        valores = arrays[coluna.name].tolist()
+        if isinstance(coluna.type, db.Numeric):
+            valores = [Decimal(f"{v:.{coluna.type.scale or 2}f}") for v in valores]
+        nulos = arrays.get(f"nulo__{coluna.name}")
+        if nulos is not None:
+            valores = [None if nulo else v for v, nulo in zip(valores, nulos.tolist())]
+        colunas[coluna.name] = valores
+    return [{nome: valores[i] for nome, valores in colunas.items()} for i in range(total)]
+
+def carregar_arquivo(arquivo):
+    with np.load(arquivo, allow_pickle=False) as dados:
+        return {nome: dados[nome] for nome in dados.files}
+
+def agregados_arquivados(id_inicio, id_fim):
+    """Agregados guardados de um evento arquivado com exatamente esse intervalo (ou None)"""
+    if id_inicio is None or id_fim is None:
+        return None
+    with app.app_context():
+        arquivado = ArquivoEvento.query.filter_by(id_inicial=id_inicio, id_final=id_fim).first()
+        return json.loads(arquivado.agregados) if arquivado else None
+
+def colunas_arquivadas(id_inicio, id_fim):
+    """Colunas do simulador de cenários lidas do arquivo de um evento arquivado (ou None)"""
+    if id_inicio is None or id_fim is None:
+        return None
+    with app.app_context():
+        arquivado = ArquivoEvento.query.filter_by(id_inicial=id_inicio, id_final=id_fim).first()
+        if arquivado is None:
+            return None
+        caminho = arquivado.arquivo
+    arrays = carregar_arquivo(caminho)
+    if 'situacao' in arrays:
+        # Arquivos anteriores à revisão de atípicos não têm a coluna: todas contam
+        agregaveis = np.isin(arrays['situacao'], SITUACOES_NOS_AGREGADOS)
+        arrays = {nome: valores[agregaveis] for nome, valores in arrays.items()}
+    return colunas_de_registros(zip(
+        arrays['transporte_cidade'].tolist(), arrays['distancia_cidade'].tolist(),
+        arrays['transporte_local'].tolist(), arrays['distancia_local'].tolist(),
+        arrays['dias_evento'].tolist(),
+    ))
+
+def intervalo_por_datas(desde, ate):
+    """Intervalo de ids das respostas recebidas entre duas datas (pelo feed de alterações)"""
+    id_inicio, id_fim = db.session.query(
+        func.min(AlteracaoResposta.resposta_id), func.max(AlteracaoResposta.resposta_id)
+    ).filter(
+        AlteracaoResposta.operacao == 'insert',
+        AlteracaoResposta.criado_em >= desde,
+        AlteracaoResposta.criado_em < ate,
+    ).one()
+    if id_inicio is None:
+        raise ValueError("Nenhuma resposta recebida nesse período")
+    return id_inicio, id_fim
+
+def arquivar_intervalo(nome, id_inicio, id_fim):
+    """Grava as respostas do intervalo em .npz, guarda os agregados e remove as linhas da tabela"""
+    if ArquivoEvento.query.filter_by(nome=nome).first() is not None:
+        raise ValueError(f"Já existe um arquivo com o nome {nome}")
+
+    # Lidas do primário: a réplica pode não ter as últimas respostas
+    registros = [{coluna.name: getattr(resposta, coluna.name) for coluna in _colunas_resposta()}
+                 for resposta in filtrar_intervalo(RespostaEmissao.query, id_inicio, id_fim)
+                 .order_by(RespostaEmissao.id)]
+    if not registros:
+        raise ValueError("Nenhuma resposta no intervalo")
+    agregados = calcular_agregados(id_inicio, id_fim)
+
+    buffer = BytesIO()
+    np.savez_compressed(buffer, **_colunas_para_npz(registros))
+    caminho = os.path.join(ARQUIVO_DIR, f"{secure_filename(nome) or 'evento'}-{id_inicio}-{id_fim}.npz")
+    gravar_arquivo_atomico(caminho, buffer.getvalue())
+
+    # Confere o arquivo antes de apagar qualquer linha
+    if len(carregar_arquivo(caminho)['id']) != len(registros):
+        raise RuntimeError(f"Arquivo {caminho} não confere com as respostas; nada foi removido")
+
+    db.session.add(ArquivoEvento(
+        nome=nome, id_inicial=id_inicio, id_final=id_fim, total_respostas=len(registros),
+        agregados=json.dumps(agregados, ensure_ascii=False), arquivo=caminho,
+    ))
+    # Remoção em massa (não passa pelo feed de alterações: para o BI, respostas arquivadas continuam existindo)
+    filtrar_intervalo(RespostaEmissao.query, id_inicio, id_fim).delete(synchronize_session=False)
+    avancar_geracao_dados()
+    db.session.commit()
+    return caminho, len(registros), len(buffer.getvalue())
+
+def restaurar_arquivo(nome):
+    """Devolve as respostas de um arquivo à tabela principal, com os ids originais"""
+    arquivado = ArquivoEvento.query.filter_by(nome=nome).first()
+    if arquivado is None:
+        raise ValueError(f"Arquivo não encontrado: {nome}")
+    registros = _npz_para_registros(carregar_arquivo(arquivado.arquivo))
+    for inicio in range(0, len(registros), EXPORTACAO_LOTE_CONSULTA):
+        db.session.execute(RespostaEmissao.__table__.insert(), registros[inicio:inicio + EXPORTACAO_LOTE_CONSULTA])
+    db.session.delete(arquivado)
+    avancar_geracao_dados()
+    db.session.commit()
+    os.replace(arquivado.arquivo, f"{arquivado.arquivo}.restaurado")
+    return len(registros)
+
+
+# ===== SQLITE: ESCRITOR ÚNICO COM COMMITS EM GRUPO =====
+class EscritorSQLite:
+    """Fila de escrita única por processo para o SQLite
+
+    As requisições enfileiram suas respostas e esperam; uma thread grava tudo o
+    que estiver na fila numa única transação (commit em grupo). Entre processos
+    (workers do gunicorn) a escrita é serializada por uma trava de arquivo, e as
+    leituras seguem em paralelo graças ao modo WAL.
+    """
+
+    def __init__(self, obter_engine, obter_caminho_trava=lambda: None, lote_maximo=200):
+        self._obter_engine = obter_engine
+        self._obter_caminho_trava = obter_caminho_trava
+        self._lote_maximo = lote_maximo
+        self._fila = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _iniciar(self):
+        # Uma thread por processo; após o fork do gunicorn ela precisa ser recriada
+        with self._lock:
+            if self._pid != os.getpid():
+                self._fila = queue.Queue()
+                threading.Thread(target=self._laco, name='escritor-sqlite', daemon=True).start()
+                self._pid = os.getpid()
+
+    def pendentes(self):
+        """Pedidos de gravação ainda na fila deste processo"""
+        return self._fila.qsize()
+
+    def executar(self, itens):
+        """Enfileira as respostas e espera o commit do grupo em que elas entraram"""
+        self._iniciar()
+        futuro = Future()
+        self._fila.put((itens, futuro))
+        return futuro.result()
+
+    def _laco(self):
+        fila = self._fila
+        while True:
+            pedidos = [fila.get()]
+            # Tudo o que chegou enquanto o último commit acontecia entra no mesmo grupo
+            while len(pedidos) < self._lote_maximo:
+                try:
+                    pedidos.append(fila.get_nowait())
+                except queue.Empty:
+                    break
+            with app.app_context(), self._travar_arquivo():
+                self._gravar_grupo(pedidos)
+
+    @contextmanager
+    def _travar_arquivo(self):
+        caminho_trava = self._obter_caminho_trava()
+        if fcntl is None or not caminho_trava:
+            yield
+            return
+        with open(caminho_trava, 'a') as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(trava, fcntl.LOCK_UN)
+
+    def _gravar_grupo(self, pedidos):
+        sessao = Session(bind=self._obter_engine())
+        try:
+            itens = [item for itens_pedido, _ in pedidos for item in itens_pedido]
+            try:
+                resultados = inserir_respostas_direto(itens, sessao)
+            except Exception:
+                # Um pedido com problema não derruba os outros: grava cada um separadamente
+                sessao.rollback()
+                for itens_pedido, futuro in pedidos:
+                    try:
+                        futuro.set_result(inserir_respostas_direto(itens_pedido, sessao))
+                    except Exception as e:
+                        sessao.rollback()
+                        futuro.set_exception(e)
+                return
+
+            inicio = 0
+            for itens_pedido, futuro in pedidos:
+                futuro.set_result(resultados[inicio:inicio + len(itens_pedido)])
+                inicio += len(itens_pedido)
+        except Exception as e:
+            for _, futuro in pedidos:
+                if not futuro.done():
+                    futuro.set_exception(e)
+        finally:
+            sessao.close()
+
+def _caminho_trava_sqlite(engine):
+    caminho_banco = engine.url.database
+    if not caminho_banco or caminho_banco == ':memory:':
+        return None
+    return os.path.abspath(caminho_banco) + '.escrita'
+
+def usar_escritor_sqlite():
+    return SQLITE_ESCRITOR_UNICO and db.engine.dialect.name == 'sqlite'
+
+escritor_sqlite = EscritorSQLite(lambda: db.engine, lambda: _caminho_trava_sqlite(db.engine))
+
+
+# ===== CACHE DE ARQUIVOS EM DISCO =====
+# Compartilhado entre os workers do gunicorn (mesma máquina)
+CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(app.instance_path, 'cache')
+
+# Incrementar quando o layout do PDF mudar, para invalidar os PDFs em cache
+VERSAO_MODELO_PDF = 1
+
+def gravar_arquivo_atomico(caminho, conteudo):
+    """Grava bytes num arquivo temporário e renomeia, para leitores nunca verem arquivo parcial"""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporario, 'wb') as arquivo:
+        arquivo.write(conteudo)
+    os.replace(temporario, caminho)
+
+# ===== CACHE COMPARTILHADO ENTRE WORKERS =====
+# Agregados, painéis e PDFs ficam em arquivos sob CACHE_DIR, um por entrada, vistos igual
+# por todos os workers. O que depende dos dados leva versao_dados() na chave: quando uma
+# resposta muda, todos os workers passam a procurar a chave nova ao mesmo tempo.
+CACHE_TAMANHO_MAXIMO_MB = int(os.environ.get('CACHE_TAMANHO_MAXIMO_MB', '512'))
+# Subpastas de CACHE_DIR sob a remoção LRU (o snapshot das estatísticas fica de fora)
+ESPACOS_CACHE = ('agregados', 'paineis', 'pdfs', 'relatorios')
+
+class CacheCompartilhado:
+    """Cache em arquivos com remoção LRU por tamanho total
+
+    O mtime de cada arquivo é o "último uso": um acerto o renova (no máximo uma vez por
+    minuto), e a varredura apaga os mais antigos quando o total passa do limite. Numa
+    falta, uma trava por arquivo faz um só worker calcular; os outros esperam e leem.
+    """
+
+    def __init__(self, pasta, espacos, limite_bytes, idade_minima=60):
+        self.pasta = pasta
+        self.espacos = espacos
+        self.limite_bytes = limite_bytes
+        # Arquivos usados há menos que isso não são apagados (podem estar sendo enviados)
+        self.idade_minima = idade_minima
+        self.acertos = 0
+        self.faltas = 0
+        self._gravados = 0
+        self._lock = threading.Lock()
+
+    def caminho(self, espaco, chave, extensao=''):
+        nome = hashlib.sha1(chave.encode('utf-8')).hexdigest()
+        return os.path.join(self.pasta, espaco, nome[:2], f"{nome}{extensao}")
+
+    def _tocar(self, caminho):
+        try:
+            if time.time() - os.stat(caminho).st_mtime > 60:
+                os.utime(caminho)
+            return True
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def _trava(self, caminho):
+        if fcntl is None:
+            yield
+            return
+        # 256 arquivos de trava fixos (pelo prefixo do nome): nada a limpar depois
+        pasta = os.path.join(self.pasta, 'travas')
+        os.makedirs(pasta, exist_ok=True)
+        with open(os.path.join(pasta, os.path.basename(caminho)[:2]), 'a') as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(trava, fcntl.LOCK_UN)
+
+    def gravar(self, caminho, conteudo):
+        gravar_arquivo_atomico(caminho, conteudo)
+        with self._lock:
+            self._gravados += len(conteudo)
+            varrer = self._gravados > self.limite_bytes // 20
+            if varrer:
+                self._gravados = 0
+        if varrer:
+            self.varrer()
+
+    def ler(self, caminho):
+        try:
+            with open(caminho, 'rb') as arquivo:
+                conteudo = arquivo.read()
+        except FileNotFoundError:
+            return None
+        self._tocar(caminho)
+        return conteudo
+
+    def obter(self, caminho, calcular):
+        """Conteúdo da entrada; numa falta, calcular() gera os bytes (uma vez entre todos os workers)"""
+        conteudo = self.ler(caminho)
+        if conteudo is None:
+            with self._trava(caminho):
+                conteudo = self.ler(caminho)
+                if conteudo is None:
+                    self.faltas += 1
+                    conteudo = calcular()
+                    self.gravar(caminho, conteudo)
+                    return conteudo
+        self.acertos += 1
+        return conteudo
+
+    def garantir_arquivo(self, caminho, calcular):
+        """Como obter, mas devolve o caminho (para send_file) sem ler o conteúdo"""
+        if not self._tocar(caminho):
+            with self._trava(caminho):
+                if not os.path.exists(caminho):
+                    self.faltas += 1
+                    self.gravar(caminho, calcular())
+                    return caminho
+        self.acertos += 1
+        return caminho
+
+    def entradas(self):
+        """[(mtime, tamanho, espaço, caminho)] de todas as entradas"""
+        entradas = []
+        for espaco in self.espacos:
+            for raiz, _, arquivos in os.walk(os.path.join(self.pasta, espaco)):
+                for nome in arquivos:
+                    if nome.endswith('.tmp'):
+                        continue
+                    caminho = os.path.join(raiz, nome)
+                    try:
+                        info = os.stat(caminho)
+                    except FileNotFoundError:
+                        continue
+                    entradas.append((info.st_mtime, info.st_size, espaco, caminho))
+        return entradas
+
+    def varrer(self):
+        """Apaga as entradas usadas há mais tempo até o total voltar a 80% do limite"""
+        entradas = self.entradas()
+        total = sum(tamanho for _, tamanho, _, _ in entradas)
+        if total <= self.limite_bytes:
+            return 0
+        removidos = 0
+        recente = time.time() - self.idade_minima
+        for mtime, tamanho, _, caminho in sorted(entradas):
+            if total <= self.limite_bytes * 0.8 or mtime > recente:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+            removidos += 1
+        return removidos
+
+cache_compartilhado = CacheCompartilhado(CACHE_DIR, ESPACOS_CACHE, CACHE_TAMANHO_MAXIMO_MB * 1024 * 1024)
+
+def caminho_pdf_cache(registro):
+    """Caminho do PDF em cache de uma resposta (muda se os dados da resposta mudarem)"""
+    assinatura = hash_serie({'registro': registro, 'versao': VERSAO_MODELO_PDF})
+    return os.path.join(CACHE_DIR, 'pdfs', f"{registro['id']}-{assinatura[:16]}.pdf")
+
+def obter_pdf_em_cache(registro):
+    """Devolve o caminho do PDF da resposta, gerando-o apenas se não estiver em cache"""
+    with etapa('pdf'):
+        return cache_compartilhado.garantir_arquivo(caminho_pdf_cache(registro), lambda: gerar_pdf(registro).getvalue())
+
+def nome_arquivo_pdf(registro):
+    email_parte = registro['email'].split('@')[0] if registro['email'] else 'sem_email'
+    return f"emissao_co2_{email_parte}.pdf"
+
+
+# ===== EXPORTAÇÃO EM LOTE DOS RELATÓRIOS PDF =====
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', str(os.cpu_count() or 2)))
+EXPORTACAO_LOTE_CONSULTA = 200
+
+def _gerar_pdf_no_pool(registro):
+    """Executado nos processos do pool: gera o PDF em cache e devolve (id, caminho)"""
+    return registro['id'], obter_pdf_em_cache(registro)
+
+def consulta_bloco_exportacao(sessao, id_inicio=None, id_fim=None, ultimo_id=None):
+    """Próximo bloco de respostas do intervalo, em ordem de id (paginação por chave, não OFFSET)"""
+    consulta = filtrar_intervalo(sessao.query(RespostaEmissao), id_inicio, id_fim)
+    if ultimo_id is not None:
+        consulta = consulta.filter(RespostaEmissao.id > ultimo_id)
+    return consulta.order_by(RespostaEmissao.id).limit(EXPORTACAO_LOTE_CONSULTA)
+
+def _registros_do_intervalo(id_inicio=None, id_fim=None):
+    """Percorre as respostas do intervalo em blocos, sem carregar a tabela inteira"""
+    ultimo_id = None
+    while True:
+        with sessao_leitura() as sessao:
+            bloco = [resposta.to_dict() for resposta in
+                     consulta_bloco_exportacao(sessao, id_inicio, id_fim, ultimo_id)]
+        if not bloco:
+            return
+        yield from bloco
+        ultimo_id = bloco[-1]['id']
+
+def contar_respostas(id_inicio=None, id_fim=None):
+    with sessao_leitura() as sessao:
+        consulta = filtrar_intervalo(sessao.query(func.count(RespostaEmissao.id)), id_inicio, id_fim)
+        return consulta.scalar() or 0
+
+def gerar_pdfs_do_intervalo(id_inicio=None, id_fim=None, workers=None):
+    """Gera os PDFs em paralelo e os entrega à medida que ficam prontos: (registro, caminho)
+
+    PDFs já em cache são entregues direto; no máximo 2 tarefas por worker
+    ficam pendentes, então a memória não cresce com o número de participantes.
+    """
+    workers = workers or PDF_WORKERS
+    limite_pendentes = 2 * workers
+    pendentes = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for registro in _registros_do_intervalo(id_inicio, id_fim):
+            caminho = caminho_pdf_cache(registro)
+            if os.path.exists(caminho):
+                yield registro, caminho
+                continue
+
+            pendentes[pool.submit(_gerar_pdf_no_pool, registro)] = registro
+            while len(pendentes) >= limite_pendentes:
+                prontos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in prontos:
+                    yield pendentes.pop(futuro), futuro.result()[1]
+
+        for futuro in as_completed(list(pendentes)):
+            yield pendentes.pop(futuro), futuro.result()[1]
+
+class _SaidaZipContinua:
+    """Destino sem seek para o zipfile: acumula os bytes até o próximo envio"""
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+def gerar_zip_pdfs(id_inicio=None, id_fim=None, progresso=None, workers=None):
+    """Gera um ZIP com os PDFs do intervalo em blocos de bytes, à medida que cada PDF fica pronto"""
+    total = contar_respostas(id_inicio, id_fim)
+    saida = _SaidaZipContinua()
+    concluidos = 0
+
+    # PDFs já são comprimidos: ZIP_STORED evita gastar CPU à toa
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED) as arquivo_zip:
+        for registro, caminho in gerar_pdfs_do_intervalo(id_inicio, id_fim, workers):
+            arquivo_zip.write(caminho, f"{registro['id']:06d}_{nome_arquivo_pdf(registro)}")
+            concluidos += 1
+            if progresso:
+                progresso(concluidos, total)
+            yield saida.esvaziar()
+    yield saida.esvaziar()
+
+def _log_progresso_exportacao(concluidos, total):
+    if concluidos == total or concluidos % 50 == 0:
+        print(f"📦 Exportação de PDFs: {concluidos}/{total}")
+
+
+# ===== RELATÓRIO CONSOLIDADO DO EVENTO =====
+# 'vetor' desenha os painéis com o próprio ReportLab; 'png' embute a imagem do matplotlib
+GRAFICOS_PDF = os.environ.get('GRAFICOS_PDF', 'vetor')
+# Largura do PNG embutido: 14 cm a ~290 dpi, nítido na impressão
+LARGURA_PNG_PDF = 1600
+
+def _imagem_painel(nome, serie, largura=14*cm):
+    """Flowable de um painel: desenho vetorial ou imagem mantendo a proporção do PNG"""
+    if GRAFICOS_PDF == 'vetor':
+        desenho = desenho_painel(nome, serie, largura)
+        desenho.hAlign = 'CENTER'
+        return desenho
+    _, png = painel_da_serie(nome, serie, 'png', LARGURA_PNG_PDF)
+    leitor = ImageReader(BytesIO(png))
+    largura_px, altura_px = leitor.getSize()
+    return Image(BytesIO(png), width=largura, height=largura * altura_px / largura_px)
+
+def _secao_cabecalho_evento(dados):
+    estilos = estilos_relatorio()
+    return [
+        Paragraph("Relatório Consolidado do Evento", estilos['titulo']),
+        Paragraph("Consolidated Event Report", estilos['titulo_en']),
+        Spacer(1, 15),
+        _linha_divisoria(),
+        Spacer(1, 20),
+    ]
+
+def _secao_resumo_evento(dados):
+    estilos = estilos_relatorio()
+    total = dados['total_respostas']
+    media = dados['emissao_total'] / total if total else 0
+    linhas = [
+        ["Indicador / Indicator", "Valor / Value"],
+        ["Evento / Event", escape(dados['evento'])],
+        ["Participantes / Participants", f"{total}"],
+        ["Emissão total / Total emissions", f"{dados['emissao_total']:,.2f} kgCO2e"],
+        ["Média por participante / Average per participant", f"{media:,.2f} kgCO2e"],
+        ["Impacto econômico / Economic impact", f"R$ {dados['gasto_total']:,.2f}"],
+    ]
+    return [
+        Paragraph("RESUMO DO EVENTO", estilos['subtitulo']),
+        Paragraph("EVENT SUMMARY", estilos['subtitulo_en']),
+        criar_tabela_simples(linhas, [9*cm, 7*cm], estilos['base']),
+        Spacer(1, 20),
+    ]
+
+def _secao_transportes_evento(dados):
+    estilos = estilos_relatorio()
+    total = sum(dados['emissoes_transporte'].values()) or 1
+    linhas = [["Transporte / Transport", "Participantes / Participants", "kgCO2e", "%"]]
+    for transporte, emissao in sorted(dados['emissoes_transporte'].items(), key=lambda x: x[1], reverse=True):
+        participantes = dados['transporte_chegada'].get(transporte, 0)
+        if not participantes:
+            continue
+        linhas.append([escape(transporte.capitalize()), f"{participantes}", f"{emissao:,.2f}",
+                       f"{emissao / total * 100:.1f}%"])
+    elementos = [
+        Paragraph("EMISSÕES POR TRANSPORTE DE CHEGADA", estilos['subtitulo']),
+        Paragraph("EMISSIONS BY ARRIVAL TRANSPORT", estilos['subtitulo_en']),
+        criar_tabela_simples(linhas, [5*cm, 4.5*cm, 3.5*cm, 3*cm], estilos['base']),
+        Spacer(1, 10),
+    ]
+    for painel in ('emissoes_transporte', 'transporte_chegada', 'transporte_diario'):
+        if dados['paineis'].get(painel):
+            elementos += [_imagem_painel(painel, dados['paineis'][painel]), Spacer(1, 10)]
+    return elementos
+
+def _secao_tipos_evento(dados):
+    estilos = estilos_relatorio()
+    linhas = [["Tipo / Type", "Participantes / Participants", "kgCO2e", "Média / Avg"]]
+    for tipo, (participantes, emissao) in sorted(dados['emissoes_tipo_participante'].items(),
+                                                 key=lambda x: x[1][1], reverse=True):
+        traducao = translations.get(tipo, tipo).lstrip('-').strip()
+        # Valores gravados viram marcação do Paragraph em criar_tabela_simples: sempre escapados
+        linhas.append([escape(f"{tipo} / {traducao}"), f"{participantes}", f"{emissao:,.2f}",
+                       f"{emissao / participantes:,.2f}" if participantes else "-"])
+    return [
+        Paragraph("EMISSÕES POR TIPO DE PARTICIPANTE", estilos['subtitulo']),
+        Paragraph("EMISSIONS BY PARTICIPANT TYPE", estilos['subtitulo_en']),
+        criar_tabela_simples(linhas, [6.5*cm, 3.5*cm, 3*cm, 3*cm], estilos['base'], '#27ae60'),
+        Spacer(1, 20),
+    ]
+
+def _secao_paises_evento(dados):
+    estilos = estilos_relatorio()
+    linhas = [["País / Country", "Participantes / Participants", "kgCO2e"]]
+    for pais, (participantes, emissao) in sorted(dados['paises'].items(), key=lambda x: (-x[1][0], x[0])):
+        traducao = PAISES_DICT.get(pais, pais).lstrip('-')
+        linhas.append([escape(f"{pais} / {traducao}"), f"{participantes}", f"{emissao:,.2f}"])
+    return [
+        Paragraph("PAÍSES DE ORIGEM", estilos['subtitulo']),
+        Paragraph("COUNTRIES OF ORIGIN", estilos['subtitulo_en']),
+        criar_tabela_simples(linhas, [8*cm, 4.5*cm, 3.5*cm], estilos['base'], '#2775E2'),
+        Spacer(1, 20),
+    ]
+
+def _secao_economica_evento(dados):
+    estilos = estilos_relatorio()
+    linhas = [["Categoria / Category", "R$"]]
+    for categoria, valor in sorted(dados['gastos'].items(), key=lambda x: x[1], reverse=True):
+        if valor > 0:
+            linhas.append([NOMES_CATEGORIAS_GASTOS[categoria], f"{valor:,.2f}"])
+    linhas.append(["TOTAL", f"{dados['gasto_total']:,.2f}"])
+    elementos = [
+        Paragraph("IMPACTO ECONÔMICO", estilos['subtitulo']),
+        Paragraph("ECONOMIC IMPACT", estilos['subtitulo_en']),
+        criar_tabela_simples(linhas, [9*cm, 7*cm], estilos['base'], '#e67e22'),
+        Spacer(1, 10),
+    ]
+    if dados['paineis'].get('economico'):
+        elementos += [_imagem_painel('economico', dados['paineis']['economico']), Spacer(1, 10)]
+    return elementos
+
+def _secao_cenarios_evento(dados):
+    estilos = estilos_relatorio()
+    linhas = [["Cenário / Scenario", "kgCO2e", "Diferença / Change"]]
+    for nome, total, diferenca, percentual in dados['cenarios']:
+        linhas.append([escape(nome), f"{total:,.2f}", f"{diferenca:+,.2f} ({percentual:+.1f}%)"])
+    return [
+        Paragraph("CENÁRIOS DE TRANSPORTE", estilos['subtitulo']),
+        Paragraph("TRANSPORT SCENARIOS", estilos['subtitulo_en']),
+        criar_tabela_simples(linhas, [9*cm, 3*cm, 4*cm], estilos['base'], '#16a085'),
+        Paragraph("Emissões de transporte recalculadas com os fatores da calculadora. "
+                  "Transport emissions recalculated with the calculator factors.", estilos['nota']),
+        Spacer(1, 20),
+    ]
+
+def _secao_rodape_evento(dados):
+    estilos = estilos_relatorio()
+    return [
+        Spacer(1, 10),
+        _linha_divisoria('#95a5a6', abaixo=False),
+        Paragraph("Calculadora de Emissão de CO2e - Eventos Esportivos Sustentáveis<br/>"
+                  "Uma iniciativa da parceria entre CBVela e ETTA/UFF com o apoio do CNPq e Faperj "
+                  "para promover a conscientização ambiental em eventos esportivos", estilos['rodape']),
+        Paragraph("<font color='#666666'><i>CO2e Emissions Calculator - Sustainable Sporting Events</i></font>",
+                  estilos['rodape_en']),
+    ]
+
+# (nome, função, chaves de dados usadas) — uma seção só é reconstruída quando seus dados mudam
+SECOES_RELATORIO_EVENTO = [
+    ('cabecalho', _secao_cabecalho_evento, ()),
+    ('resumo', _secao_resumo_evento, ('evento', 'total_respostas', 'emissao_total', 'gasto_total')),
+    ('transportes', _secao_transportes_evento, ('emissoes_transporte', 'transporte_chegada', 'hash_paineis')),
+    ('tipos', _secao_tipos_evento, ('emissoes_tipo_participante',)),
+    ('paises', _secao_paises_evento, ('paises',)),
+    ('economico', _secao_economica_evento, ('gastos', 'gasto_total', 'hash_paineis')),
+    ('cenarios', _secao_cenarios_evento, ('cenarios',)),
+    ('rodape', _secao_rodape_evento, ()),
+]
+
+# Flowables das seções por thread. O ReportLab guarda estado de layout nos flowables
+# durante o build, então cada build recebe cópias rasas dos objetos guardados.
+_secoes_relatorio_local = threading.local()
+
+def _secao_relatorio(nome, construir, chaves, dados):
+    cache = getattr(_secoes_relatorio_local, 'secoes', None)
+    if cache is None:
+        cache = _secoes_relatorio_local.secoes = {}
+    assinatura = hash_serie({chave: dados[chave] for chave in chaves})
+    guardado = cache.get(nome)
+    if guardado is None or guardado[0] != assinatura:
+        guardado = cache[nome] = (assinatura, construir(dados))
+    return [copy.copy(flowable) for flowable in guardado[1]]
+
+def dados_relatorio_evento(nome_evento=None, id_inicio=None, id_fim=None):
+    """Monta os dados do relatório a partir da camada de agregados e das séries dos painéis"""
+    agregados = calcular_agregados(id_inicio, id_fim)
+    paineis, hashes = {}, {}
+    for painel, (extrair, _) in PAINEIS.items():
+        paineis[painel] = extrair(agregados)
+        hashes[painel] = hash_serie(paineis[painel]) if paineis[painel] else None
+    return {
+        **agregados,
+        'evento': nome_evento or 'Todas as respostas / All responses',
+        'gasto_total': sum(agregados['gastos'].values()),
+        'paineis': paineis,
+        'hash_paineis': hashes,
+        'cenarios': cenarios_padrao_evento(id_inicio, id_fim),
+    }
+
+def gerar_pdf_evento(nome_evento=None, id_inicio=None, id_fim=None):
+    """Gera (ou reaproveita do cache) o PDF consolidado do evento; devolve (assinatura, caminho)"""
+    dados = dados_relatorio_evento(nome_evento, id_inicio, id_fim)
+    assinatura = hash_serie({
+        chave: valor for chave, valor in dados.items() if chave != 'paineis'
+    } | {'versao': VERSAO_MODELO_PDF, 'graficos': GRAFICOS_PDF})
+    caminho = os.path.join(CACHE_DIR, 'relatorios', f"evento-{assinatura[:16]}.pdf")
+
+    def construir_pdf():
+        elements = []
+        for nome, construir, chaves in SECOES_RELATORIO_EVENTO:
+            elements += _secao_relatorio(nome, construir, chaves, dados)
+        buffer = BytesIO()
+        doc = documento_pdf(buffer, f"Relatório do Evento | Event Report - {dados['evento']}")
+        doc.build(elements)
+        return buffer.getvalue()
+
+    return assinatura, cache_compartilhado.garantir_arquivo(caminho, construir_pdf)
+
+
+# ===== TAREFAS EM SEGUNDO PLANO =====
+# Manutenções longas (recalcular emissões, reavaliar respostas, regerar PDFs e agregados)
+# não rodam nas requisições: entram na tabela tarefas e um processo à parte
+# (`flask worker-tarefas`) as executa em lotes. Cada lote confirma o que fez junto com o
+# checkpoint, então uma tarefa interrompida recomeça do último lote confirmado.
+TAREFAS_LOTE = int(os.environ.get('TAREFAS_LOTE', '500'))
+TAREFAS_LOTE_PDFS = 50
+# Pausa entre lotes: as gravações das respostas ao vivo passam na frente
+TAREFAS_PAUSA_MS = float(os.environ.get('TAREFAS_PAUSA_MS', '50'))
+TAREFAS_LEASE_SEGUNDOS = int(os.environ.get('TAREFAS_LEASE_SEGUNDOS', '120'))
+TAREFAS_MAX_FALHAS = int(os.environ.get('TAREFAS_MAX_FALHAS', '3'))
+# Espera antes de tentar de novo, dobrando a cada falha
+TAREFAS_ESPERA_FALHA_SEGUNDOS = int(os.environ.get('TAREFAS_ESPERA_FALHA_SEGUNDOS', '30'))
+TAREFAS_INTERVALO_SEGUNDOS = 2
+
+@contextmanager
+def _gravacao_tarefas():
+    """No SQLite, os commits das tarefas entram na trava do escritor único, entre os grupos de respostas"""
+    if not usar_escritor_sqlite():
+        yield
+        return
+    with escritor_sqlite._travar_arquivo():
+        yield
+
+def _intervalo_tarefa(parametros):
+    return intervalo_respostas(parametros.get('evento'), parametros.get('de'), parametros.get('ate'))
+
+def _bloco_tarefa(sessao, parametros, ultimo_id, tamanho, *filtros):
+    """Próximo bloco de respostas da tarefa depois do último id processado, em ordem de id"""
+    id_inicio, id_fim = _intervalo_tarefa(parametros)
+    consulta = filtrar_intervalo(sessao.query(RespostaEmissao), id_inicio, id_fim).filter(*filtros)
+    if ultimo_id is not None:
+        consulta = consulta.filter(RespostaEmissao.id > ultimo_id)
+    return consulta.order_by(RespostaEmissao.id).limit(tamanho).all()
+
+def _contar_respostas_tarefa(parametros):
+    return contar_respostas(*_intervalo_tarefa(parametros))
+
+def _lote_recalcular_emissoes(sessao, parametros, checkpoint):
+    """Recalcula emissao_total com os fatores atuais; só as respostas que mudam são gravadas (e vão para o feed)"""
+    respostas = _bloco_tarefa(sessao, parametros, (checkpoint or {}).get('ultimo_id'), TAREFAS_LOTE)
+    alteradas = (checkpoint or {}).get('alteradas', 0)
+    for resposta in respostas:
+        emissao = Decimal(str(round(calcular_emissao_total(
+            resposta.transporte_cidade, float(resposta.distancia_cidade),
+            resposta.transporte_local, float(resposta.distancia_local), resposta.dias_evento), 2)))
+        if emissao != resposta.emissao_total:
+            resposta.emissao_total = emissao
+            alteradas += 1
+    if not respostas:
+        return checkpoint, 0, True
+    return {'ultimo_id': respostas[-1].id, 'alteradas': alteradas}, len(respostas), len(respostas) < TAREFAS_LOTE
+
+def _filtros_reavaliacao():
+    # Respostas aceitas sem motivos: as que chegaram antes da verificação de atípicos (as revisadas por alguém têm motivos)
+    return RespostaEmissao.situacao == 'aceita', RespostaEmissao.motivos_revisao.is_(None)
+
+def _contar_reavaliacao(parametros):
+    with sessao_leitura() as sessao:
+        consulta = filtrar_intervalo(sessao.query(func.count(RespostaEmissao.id)), *_intervalo_tarefa(parametros))
+        return consulta.filter(*_filtros_reavaliacao()).scalar() or 0
+
+def _lote_reavaliar_respostas(sessao, parametros, checkpoint):
+    """Passa as respostas antigas pela verificação de atípicos e de distância, como classificar_respostas"""
+    checkpoint = dict(checkpoint or {})
+    if 'referencia' not in checkpoint:
+        # Referência fixada no primeiro lote: as respostas que saem de 'aceita' não a deslocam depois
+        colunas = snapshot_respostas(*_intervalo_tarefa(parametros), situacoes=('aceita',), campos=COLUNAS_ATIPICOS)
+        for grupo in {grupo for grupo in CAMPOS_ATIPICOS.values() if grupo}:
+            colunas[grupo] = rotulos_snapshot(colunas, grupo)
+        checkpoint['referencia'] = calcular_referencia_atipicos(colunas)
+    if parametros.get('evento'):
+        evento = Evento.query.filter_by(nome=parametros['evento']).first()
+        local = evento.local if evento else None
+    else:
+        local = local_evento_aberto()
+
+    respostas = _bloco_tarefa(sessao, parametros, checkpoint.get('ultimo_id'), TAREFAS_LOTE,
+                              *_filtros_reavaliacao())
+    if not respostas:
+        return checkpoint, 0, True
+    lista_campos = [resposta.to_dict() for resposta in respostas]
+    situacao_atipica = 'pendente' if ATIPICOS_ACAO == 'quarentena' else 'sinalizada'
+    for resposta, atipicos, geograficos in zip(respostas, avaliar_atipicos(lista_campos, checkpoint['referencia']),
+                                               avaliar_distancias_declaradas(lista_campos, local)):
+        if atipicos + geograficos:
+            resposta.situacao = situacao_atipica
+            resposta.motivos_revisao = '; '.join(atipicos + geograficos)
+            checkpoint['em_revisao'] = checkpoint.get('em_revisao', 0) + 1
+    checkpoint['ultimo_id'] = respostas[-1].id
+    return checkpoint, len(respostas), len(respostas) < TAREFAS_LOTE
+
+def _lote_regerar_pdfs(sessao, parametros, checkpoint):
+    """Gera no cache os PDFs que faltam (ex.: depois de mudar o modelo do relatório)"""
+    respostas = _bloco_tarefa(sessao, parametros, (checkpoint or {}).get('ultimo_id'), TAREFAS_LOTE_PDFS)
+    for resposta in respostas:
+        obter_pdf_em_cache(resposta.to_dict())
+    if not respostas:
+        return checkpoint, 0, True
+    return {'ultimo_id': respostas[-1].id}, len(respostas), len(respostas) < TAREFAS_LOTE_PDFS
+
+def _alvos_agregados():
+    """Cada evento e, por último, todas as respostas"""
+    return [(evento.nome, evento.id_inicial, evento.id_final)
+            for evento in Evento.query.order_by(Evento.id)] + [(None, None, None)]
+
+def _lote_reconstruir_agregados(sessao, parametros, checkpoint):
+    """Agregados, painéis e PDF consolidado de um evento por lote, gravados no cache compartilhado"""
+    indice = (checkpoint or {}).get('indice', 0)
+    alvos = _alvos_agregados()
+    if indice < len(alvos):
+        nome, id_inicio, id_fim = alvos[indice]
+        agregados = calcular_agregados(id_inicio, id_fim)
+        if agregados['total_respostas']:
+            for painel in PAINEIS:
+                obter_painel(painel, agregados, 'svg')
+            gerar_pdf_evento(nome, id_inicio, id_fim)
+    return {'indice': indice + 1}, 1, indice + 1 >= len(alvos)
+
+# Cada tipo: (função que conta os itens da tarefa, função que executa um lote)
+# O lote recebe (sessão de escrita, parâmetros, checkpoint ou None) e devolve
+# (novo checkpoint, itens processados, concluída); o worker faz o commit.
+TIPOS_TAREFA = {
+    'recalcular_emissoes': (_contar_respostas_tarefa, _lote_recalcular_emissoes),
+    'reavaliar_respostas': (_contar_reavaliacao, _lote_reavaliar_respostas),
+    'regerar_pdfs': (_contar_respostas_tarefa, _lote_regerar_pdfs),
+    'reconstruir_agregados': (lambda parametros: len(_alvos_agregados()), _lote_reconstruir_agregados),
+}
+
+def enfileirar_tarefa(tipo, parametros=None):
+    """Cria a tarefa como 'pendente'; levanta ValueError para tipo ou evento desconhecido"""
+    if tipo not in TIPOS_TAREFA:
+        raise ValueError(f"Tipo de tarefa desconhecido: {tipo} (use {', '.join(TIPOS_TAREFA)})")
+    parametros = {chave: valor for chave, valor in (parametros or {}).items() if valor is not None}
+    _intervalo_tarefa(parametros)
+    tarefa = Tarefa(tipo=tipo, parametros=json.dumps(parametros, ensure_ascii=False))
+    db.session.add(tarefa)
+    db.session.commit()
+    return tarefa
+
+def cancelar_tarefa(tarefa_id):
+    """Pendente: cancelada na hora; em execução: o worker para ao fim do lote atual"""
+    tarefa = db.session.get(Tarefa, tarefa_id)
+    if tarefa is None:
+        raise ValueError(f"Tarefa não encontrada: {tarefa_id}")
+    if tarefa.situacao == 'pendente':
+        tarefa.situacao, tarefa.concluido_em = 'cancelada', datetime.utcnow()
+    elif tarefa.situacao == 'executando':
+        tarefa.cancelamento_pedido = True
+    db.session.commit()
+    return tarefa
+
+def retomar_tarefa(tarefa_id):
+    """Devolve à fila uma tarefa que falhou ou foi cancelada; ela continua do checkpoint"""
+    tarefa = db.session.get(Tarefa, tarefa_id)
+    if tarefa is None:
+        raise ValueError(f"Tarefa não encontrada: {tarefa_id}")
+    if tarefa.situacao not in ('falhou', 'cancelada'):
+        raise ValueError(f"Só tarefas que falharam ou foram canceladas podem ser retomadas (situação: {tarefa.situacao})")
+    tarefa.situacao, tarefa.cancelamento_pedido, tarefa.falhas = 'pendente', False, 0
+    tarefa.erro, tarefa.concluido_em, tarefa.executar_apos = None, None, datetime.utcnow()
+    db.session.commit()
+    return tarefa
+
+def identificacao_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _condicao_reservavel(agora):
+    # Pendente e na hora, ou em execução num worker que parou de dar sinal (morreu ou travou)
+    return db.or_(
+        db.and_(Tarefa.situacao == 'pendente', Tarefa.executar_apos <= agora),
+        db.and_(Tarefa.situacao == 'executando',
+                Tarefa.batimento_em < agora - timedelta(seconds=TAREFAS_LEASE_SEGUNDOS)),
+    )
+
+def reservar_tarefa(sessao, worker):
+    """Reserva a próxima tarefa para este worker, ou None se não há nenhuma"""
+    agora = datetime.utcnow()
+    candidatas = sessao.query(Tarefa.id).filter(_condicao_reservavel(agora)).order_by(Tarefa.id).limit(5).all()
+    for (tarefa_id,) in candidatas:
+        # UPDATE condicional: se outro worker reservou antes, nenhuma linha muda
+        with _gravacao_tarefas():
+            reservada = sessao.execute(
+                db.update(Tarefa)
+                .where(Tarefa.id == tarefa_id, _condicao_reservavel(agora))
+                .values(situacao='executando', worker=worker, batimento_em=agora,
+                        iniciado_em=func.coalesce(Tarefa.iniciado_em, agora))
+                .execution_options(synchronize_session=False)
+            ).rowcount == 1
+            sessao.commit()
+        if reservada:
+            return sessao.get(Tarefa, tarefa_id)
+    return None
+
+def _atualizar_tarefa(sessao, tarefa_id, worker, **valores):
+    """Grava o estado da tarefa na transação em curso, se ela ainda pertence a este worker"""
+    return sessao.execute(
+        db.update(Tarefa).where(Tarefa.id == tarefa_id, Tarefa.worker == worker)
+        .values(**valores).execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+def executar_tarefa(sessao, tarefa, worker):
+    """Executa os lotes da tarefa até concluir, falhar, ser cancelada ou perder a reserva; devolve a situação final"""
+    contar, executar_lote = TIPOS_TAREFA[tarefa.tipo]
+    tarefa_id = tarefa.id
+    parametros = json.loads(tarefa.parametros)
+    print(f"⚙️  Tarefa {tarefa_id} ({tarefa.tipo}) iniciada em {worker}"
+          + (f", retomada do checkpoint {tarefa.checkpoint}" if tarefa.checkpoint else ""))
+    try:
+        while True:
+            sessao.expire_all()
+            tarefa = sessao.get(Tarefa, tarefa_id)
+            if tarefa.worker != worker:
+                print(f"⚠️  Tarefa {tarefa_id} reservada por outro worker ({tarefa.worker}); abandonando")
+                return tarefa.situacao
+            if tarefa.cancelamento_pedido:
+                with _gravacao_tarefas():
+                    _atualizar_tarefa(sessao, tarefa_id, worker, situacao='cancelada',
+                                      concluido_em=datetime.utcnow())
+                    sessao.commit()
+                print(f"🛑 Tarefa {tarefa_id} cancelada após {tarefa.processados} itens")
+                return 'cancelada'
+            if tarefa.total is None:
+                total = contar(parametros)
+                with _gravacao_tarefas():
+                    _atualizar_tarefa(sessao, tarefa_id, worker, total=total)
+                    sessao.commit()
+
+            checkpoint = json.loads(tarefa.checkpoint) if tarefa.checkpoint else None
+            inicio = time.perf_counter()
+            checkpoint, processados, concluida = executar_lote(sessao, parametros, checkpoint)
+            agora = datetime.utcnow()
+            valores = dict(
+                checkpoint=json.dumps(checkpoint, ensure_ascii=False),
+                processados=Tarefa.processados + processados,
+                lotes=Tarefa.lotes + 1,
+                segundos_execucao=Tarefa.segundos_execucao + (time.perf_counter() - inicio),
+                batimento_em=agora,
+            )
+            if concluida:
+                valores.update(situacao='concluida', concluido_em=agora, erro=None)
+            # O trabalho do lote e o checkpoint vão no mesmo commit
+            with _gravacao_tarefas():
+                if not _atualizar_tarefa(sessao, tarefa_id, worker, **valores):
+                    sessao.rollback()
+                    print(f"⚠️  Tarefa {tarefa_id} reservada por outro worker; lote descartado")
+                    return None
+                sessao.commit()
+
+            if concluida:
+                tarefa = sessao.get(Tarefa, tarefa_id)
+                vazao = tarefa.to_dict()['itens_por_segundo']
+                print(f"✅ Tarefa {tarefa_id} ({tarefa.tipo}) concluída: {tarefa.processados} itens em "
+                      f"{tarefa.lotes} lotes, {tarefa.segundos_execucao:.1f}s ({vazao or 0:.1f} itens/s)")
+                return 'concluida'
+            time.sleep(TAREFAS_PAUSA_MS / 1000)
+    except Exception as e:
+        sessao.rollback()
+        tarefa = sessao.get(Tarefa, tarefa_id)
+        falhas = tarefa.falhas + 1
+        situacao = 'falhou' if falhas >= TAREFAS_MAX_FALHAS else 'pendente'
+        with _gravacao_tarefas():
+            _atualizar_tarefa(
+                sessao, tarefa_id, worker, situacao=situacao, falhas=falhas, erro=f"{type(e).__name__}: {e}",
+                executar_apos=datetime.utcnow() + timedelta(seconds=TAREFAS_ESPERA_FALHA_SEGUNDOS * 2 ** (falhas - 1)),
+                concluido_em=datetime.utcnow() if situacao == 'falhou' else None,
+            )
+            sessao.commit()
+        print(f"❌ Tarefa {tarefa_id} falhou ({falhas}/{TAREFAS_MAX_FALHAS}): {e}")
+        return situacao
+    except BaseException:
+        # Worker encerrado (Ctrl+C, SIGTERM): a tarefa volta para a fila sem esperar o lease
+        sessao.rollback()
+        with _gravacao_tarefas():
+            _atualizar_tarefa(sessao, tarefa_id, worker, situacao='pendente', worker=None)
+            sessao.commit()
+        raise
+
+def laco_worker_tarefas(ate_esvaziar=False):
+    """Reserva e executa tarefas até ser interrompido (ou até a fila esvaziar)"""
+    worker = identificacao_worker()
+    sessao = Session(bind=db.engine)
+    try:
+        while True:
+            tarefa = reservar_tarefa(sessao, worker)
+            if tarefa is None:
+                if ate_esvaziar:
+                    return
+                time.sleep(TAREFAS_INTERVALO_SEGUNDOS)
+                continue
+            executar_tarefa(sessao, tarefa, worker)
+    finally:
+        sessao.close()
+
+
+# ===== PÁGINAS PRÉ-RENDERIZADAS E PRÉ-COMPRIMIDAS =====
+PAGINAS_MAX_AGE = int(os.environ.get('PAGINAS_MAX_AGE', str(24 * 3600)))
+ESTATICOS_MAX_AGE = 365 * 24 * 3600
+TIPOS_COMPRIMIVEIS = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+class ConteudoPreComprimido:
+    """Um conteúdo pronto para envio, com as variantes identity, gzip e br calculadas uma vez"""
+
+    def __init__(self, conteudo, mimetype):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(conteudo).hexdigest()[:20]
+        self.variantes = {'identity': conteudo}
+        if mimetype.startswith(TIPOS_COMPRIMIVEIS):
+            self.variantes['gzip'] = gzip.compress(conteudo, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variantes['br'] = brotli.compress(conteudo, quality=11)
+
+    def responder(self, max_age, imutavel=False):
+        """Resposta com a melhor codificação aceita pelo cliente, ETag e cabeçalhos de cache"""
+        codificacao = 'identity'
+        for candidata in ('br', 'gzip'):
+            if candidata in self.variantes and request.accept_encodings[candidata]:
+                codificacao = candidata
+                break
+
+        resposta = make_response(self.variantes[codificacao])
+        resposta.mimetype = self.mimetype
+        if self.mimetype.startswith('text/'):
+            resposta.charset = 'utf-8'
+        if codificacao != 'identity':
+            resposta.headers['Content-Encoding'] = codificacao
+        resposta.headers['Vary'] = 'Accept-Encoding'
+        resposta.set_etag(self.etag if codificacao == 'identity' else f"{self.etag}-{codificacao}")
+        resposta.headers['Cache-Control'] = (
+            f"public, max-age={max_age}" + (", immutable" if imutavel else "")
+        )
+        return resposta.make_conditional(request)
+
+_paginas_prontas = {}
+_estaticos_prontos = {}
+_lock_paginas = threading.Lock()
+
+def pagina_pre_renderizada(nome):
+    """Renderiza a página uma única vez por processo (em modo debug, a cada acesso)"""
+    pagina = None if app.debug else _paginas_prontas.get(nome)
+    if pagina is None:
+        pagina = ConteudoPreComprimido(PAGINAS_ESTATICAS[nome]().encode('utf-8'), 'text/html')
+        with _lock_paginas:
+            _paginas_prontas[nome] = pagina
+    return pagina
+
+def servir_pagina(nome):
+    return pagina_pre_renderizada(nome).responder(PAGINAS_MAX_AGE)
+
+def estatico_pre_comprimido(filename):
+    """Arquivo de static/ em memória, comprimido; recarregado se o arquivo mudar"""
+    caminho = safe_join(app.static_folder, filename)
+    if caminho is None or not os.path.isfile(caminho):
+        return None
+    versao = os.stat(caminho).st_mtime_ns
+    guardado = _estaticos_prontos.get(filename)
+    if guardado is None or guardado[0] != versao:
+        with open(caminho, 'rb') as arquivo:
+            conteudo = arquivo.read()
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        guardado = (versao, ConteudoPreComprimido(conteudo, mimetype))
+        with _lock_paginas:
+            _estaticos_prontos[filename] = guardado
+    return guardado[1]
+
+def servir_estatico(filename):
+    """Substitui a rota static do Flask: URLs com ?v=<hash> podem ficar em cache por um ano"""
+    conteudo = estatico_pre_comprimido(filename)
+    if conteudo is None:
+        return "Arquivo não encontrado", 404
+    if request.args.get('v') == conteudo.etag:
+        return conteudo.responder(ESTATICOS_MAX_AGE, imutavel=True)
+    return conteudo.responder(0)
+
+app.view_functions['static'] = servir_estatico
+
+@app.url_defaults
+def _versionar_estaticos(endpoint, values):
+    # url_for('static', ...) ganha ?v=<hash do conteúdo>, então cada deploy muda a URL
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        conteudo = estatico_pre_comprimido(values['filename'])
+        if conteudo is not None:
+            values['v'] = conteudo.etag
+
+def aquecer_paginas():
+    """Pré-renderiza as páginas estáticas na inicialização"""
+    with app.test_request_context('/'):
+        for nome in PAGINAS_ESTATICAS:
+            pagina_pre_renderizada(nome)
+
+
+# ===== EVENTOS CONGELADOS (SITE ESTÁTICO) =====
+# Evento encerrado vira um diretório autocontido, servido por qualquer servidor estático ou CDN
+CONGELADOS_DIR = os.environ.get('CONGELADOS_DIR') or os.path.join(app.instance_path, 'congelados')
+
+def registros_evento(id_inicio, id_fim):
+    """Respostas do intervalo no formato de to_dict(), lidas do arquivo se o evento foi arquivado"""
+    arquivado = ArquivoEvento.query.filter_by(id_inicial=id_inicio, id_final=id_fim).first()
+    if arquivado is None:
+        yield from _registros_do_intervalo(id_inicio, id_fim)
+        return
+    for registro in _npz_para_registros(carregar_arquivo(arquivado.arquivo)):
+        yield RespostaEmissao(**registro).to_dict()
+
+def _parquet_respostas(registros):
+    """respostas.parquet em bytes (None se o pyarrow não estiver instalado)"""
+    if pa is None:
+        return None
+    buffer = BytesIO()
+    pq.write_table(pa.Table.from_pylist(registros), buffer, compression='zstd')
+    return buffer.getvalue()
+
+def congelar_evento(nome, destino=None):
+    """Gera o site estático do evento (páginas, gráficos, JSON, CSV/Parquet e PDF); devolve (destino, arquivos)"""
+    evento = Evento.query.filter_by(nome=nome).first()
+    if evento is None:
+        raise ValueError(f"Evento não encontrado: {nome}")
+    if not evento.encerrado:
+        raise ValueError(f"O evento {nome} ainda está aberto")
+    id_inicio, id_fim = evento.id_inicial, evento.id_final
+    destino = destino or os.path.join(CONGELADOS_DIR, secure_filename(nome) or 'evento')
+
+    # Montado ao lado e trocado no fim: quem serve o diretório nunca vê um site pela metade
+    temporario = f"{destino.rstrip(os.sep)}.novo-{os.getpid()}"
+    shutil.rmtree(temporario, ignore_errors=True)
+    os.makedirs(os.path.join(temporario, 'graficos'))
+    arquivos = {}
+
+    def gravar(relativo, conteudo, mimetype):
+        caminho = os.path.join(temporario, relativo)
+        with open(caminho, 'wb') as arquivo:
+            arquivo.write(conteudo)
+        # Variantes .gz/.br ao lado do original (gzip_static/brotli_static do nginx, CDNs)
+        for codificacao, variante in ConteudoPreComprimido(conteudo, mimetype).variantes.items():
+            if codificacao != 'identity' and len(variante) < len(conteudo):
+                with open(f"{caminho}.{'gz' if codificacao == 'gzip' else 'br'}", 'wb') as arquivo:
+                    arquivo.write(variante)
+        arquivos[relativo] = {'bytes': len(conteudo), 'sha256': hashlib.sha256(conteudo).hexdigest()}
+
+    agregados = calcular_agregados(id_inicio, id_fim)
+    if not agregados['total_respostas']:
+        shutil.rmtree(temporario)
+        raise ValueError(f"O evento {nome} não tem respostas")
+    gravar('agregados.json', json.dumps(agregados, ensure_ascii=False, indent=1).encode('utf-8'), 'application/json')
+
+    # SVG para a página; o PNG fica ao lado para quem baixa o gráfico ou não exibe SVG
+    paineis = {}
+    for painel in PAINEIS:
+        _, svg = obter_painel(painel, agregados, 'svg')
+        if svg:
+            _, png = obter_painel(painel, agregados)
+            paineis[painel] = f"graficos/{painel}"
+            gravar(f"{paineis[painel]}.svg", svg, 'image/svg+xml')
+            gravar(f"{paineis[painel]}.png", png, 'image/png')
+
+    # Sem email: o diretório é público
+    registros = [{campo: valor for campo, valor in registro.items() if campo != 'email'}
+                 for registro in registros_evento(id_inicio, id_fim)]
+    si = StringIO()
+    escrever_csv_respostas(si, registros, sem_email=True)
+    gravar('respostas.csv', si.getvalue().encode('utf-8'), 'text/csv')
+    parquet = _parquet_respostas(registros)
+    if parquet is not None:
+        gravar('respostas.parquet', parquet, 'application/vnd.apache.parquet')
+    else:
+        print("⚠️  pyarrow não instalado: respostas.parquet não foi gerado")
+
+    _, caminho_pdf = gerar_pdf_evento(nome, id_inicio, id_fim)
+    with open(caminho_pdf, 'rb') as arquivo:
+        gravar('relatorio_evento.pdf', arquivo.read(), 'application/pdf')
+
+    with open(os.path.join(app.static_folder, 'style.css'), 'rb') as arquivo:
+        gravar('style.css', arquivo.read(), 'text/css')
+
+    with app.test_request_context('/'):
+        pagina = render_template(
+            'evento.html',
+            evento=evento.to_dict(),
+            agregados=agregados,
+            media=agregados['emissao_total'] / agregados['total_respostas'],
+            gasto_total=sum(agregados['gastos'].values()),
+            paineis=paineis,
+            cenarios=cenarios_padrao_evento(id_inicio, id_fim),
+            com_parquet='respostas.parquet' in arquivos,
+            gerado_em=datetime.utcnow(),
+            translations=translations,
+        )
+    gravar('index.html', pagina.encode('utf-8'), 'text/html')
+
+    gravar('manifest.json', json.dumps({
+        'evento': nome,
+        'id_inicial': id_inicio,
+        'id_final': id_fim,
+        'gerado_em': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'arquivos': arquivos,
+    }, ensure_ascii=False, indent=1).encode('utf-8'), 'application/json')
+
+    antigo = f"{destino.rstrip(os.sep)}.antigo-{os.getpid()}"
+    if os.path.exists(destino):
+        os.replace(destino, antigo)
+    os.replace(temporario, destino)
+    shutil.rmtree(antigo, ignore_errors=True)
+    return destino, arquivos
+
+
+# ===== BUSCA DE PAÍSES =====
+# Nomes alternativos comuns, além dos nomes oficiais em português e inglês
+APELIDOS_PAISES = {
+    "Estados Unidos": ["EUA", "USA", "US", "Estados Unidos da América", "United States of America", "América"],
+    "Reino Unido": ["UK", "Inglaterra", "England", "Escócia", "Scotland", "País de Gales", "Wales",
+                    "Grã-Bretanha", "Great Britain", "Britain"],
+    "Holanda (Países Baixos)": ["Países Baixos", "Holland"],
+    "República Tcheca": ["Tchéquia", "Czech Republic"],
+    "Myanmar (Birmânia)": ["Birmânia"],
+    "Coreia do Sul": ["Korea"],
+    "Emirados Árabes Unidos": ["EAU", "UAE", "Emirados"],
+    "Costa do Marfim": ["Ivory Coast"],
+    "Essuatíni": ["Suazilândia", "Swaziland"],
+    "Vaticano (Santa Sé)": ["Santa Sé", "Vatican"],
+    "Macedônia do Norte": ["Macedônia", "Macedonia"],
+    "Cabo Verde": ["Cape Verde"],
+    "Timor-Leste": ["Timor Leste", "East Timor"],
+    "Rússia": ["Federação Russa", "Russian Federation"],
+    "Brasil": ["Brazil", "BR"],
+    "Congo (Congo-Brazzaville)": ["República do Congo"],
+    "República Democrática do Congo": ["RDC", "DRC", "Congo-Kinshasa"],
+}
+
+def normalizar_busca(texto):
+    """Minúsculas, sem acentos e com pontuação trocada por espaço"""
+    sem_acentos = ''.join(
+        c for c in unicodedata.normalize('NFKD', str(texto)) if not unicodedata.combining(c)
+    )
+    return re.sub(r'[^a-z0-9]+', ' ', sem_acentos.casefold()).strip()
+
+class IndicePaises:
+    """Índice de prefixos em array ordenado sobre os nomes PT/EN e apelidos de cada país
+
+    Cada palavra de cada nome gera uma chave (para "sul" achar "Coreia do Sul"); a busca é
+    um bisect até o fim do intervalo de chaves que começam com o prefixo digitado.
+    """
+
+    def __init__(self, paises):
+        # paises: [(nome_pt, nome_en, [apelidos])]
+        self.paises = paises
+        self.exatos = {}
+        entradas = []
+        for i, (pt, en, apelidos) in enumerate(paises):
+            for posicao_nome, nome in enumerate([pt, en] + apelidos):
+                normalizado = normalizar_busca(nome)
+                self.exatos.setdefault(normalizado, i)
+                palavras = normalizado.split(' ')
+                for j in range(len(palavras)):
+                    # 0: início do nome em PT, 1: início de outro nome, 2: palavra do meio
+                    prioridade = 2 if j else (0 if posicao_nome == 0 else 1)
+                    entradas.append((' '.join(palavras[j:]), prioridade, i))
+        entradas.sort()
+        self.chaves = [chave for chave, _, _ in entradas]
+        self.entradas = [(prioridade, i) for _, prioridade, i in entradas]
+        self.ordem_alfabetica = [normalizar_busca(pt) for pt, _, _ in paises]
+
+    def buscar(self, texto, limite=10):
+        prefixo = normalizar_busca(texto)
+        if not prefixo:
+            return []
+        melhores = {}
+        for posicao in range(bisect.bisect_left(self.chaves, prefixo), len(self.chaves)):
+            if not self.chaves[posicao].startswith(prefixo):
+                break
+            prioridade, i = self.entradas[posicao]
+            if prioridade < melhores.get(i, 3):
+                melhores[i] = prioridade
+        ordenados = sorted(melhores, key=lambda i: (melhores[i], self.ordem_alfabetica[i]))
+        return [{'pt': self.paises[i][0], 'en': self.paises[i][1]} for i in ordenados[:limite]]
+
+    def resolver(self, texto):
+        """Nome canônico em PT para um nome, tradução ou apelido exato; senão o próprio texto"""
+        i = self.exatos.get(normalizar_busca(texto))
+        return texto if i is None else self.paises[i][0]
+
+@lru_cache(maxsize=None)
+def indice_paises():
+    return IndicePaises([
+        (pt, PAISES_DICT[pt].lstrip('-'), APELIDOS_PAISES.get(pt, []))
+        for pt in PAISES_PORTUGUES
+    ])
+
+@lru_cache(maxsize=None)
+def paises_json():
+    """Lista compacta [pt, en, apelidos] para a busca no navegador, já comprimida"""
+    conteudo = json.dumps([list(pais) for pais in indice_paises().paises],
+                          ensure_ascii=False, separators=(',', ':'))
+    return ConteudoPreComprimido(conteudo.encode('utf-8'), 'application/json')
+
+
+# ===== CARONA SOLIDÁRIA =====
+# Faixas de distância (km, ida e volta) usadas como balde do índice de caronas
+FAIXAS_DISTANCIA_CARONA = [0, 50, 150, 400, 1000, 2500]
+CARONA_OCUPANTES = 4
+CARONA_MAXIMO_CANDIDATOS = 10
+
+def faixa_distancia(distancia):
+    return bisect.bisect_right(FAIXAS_DISTANCIA_CARONA, distancia) - 1
+
+def emissao_carro_kg(distancia):
+    return EMISSOES_TRANSPORTE['carro'] * distancia / 1000
+
+class IndiceCaronas:
+    """Índice em baldes (país, estado, faixa de distância) dos inscritos de um evento que chegam de carro
+
+    A busca olha só o balde do participante e as faixas vizinhas, então o custo não
+    cresce com o total de inscritos como numa comparação par a par. Os dias de evento
+    entram na pontuação, não na chave: dentro de um evento eles variam pouco, e um balde
+    por número de dias separaria quem chega no mesmo carro e fica um dia a mais.
+    """
+
+    def __init__(self):
+        self.baldes = defaultdict(list)
+        self.por_resposta = {}
+        self.ultima_inscricao = 0
+        self.total = 0
+        self.seq_feed = 0
+
+    def adicionar(self, inscrito):
+        chave = (inscrito['pais'], inscrito['estado'], faixa_distancia(inscrito['distancia']))
+        self.baldes[chave].append(inscrito)
+        self.por_resposta[inscrito['resposta_id']] = inscrito
+
+    def candidatos(self, inscrito, limite=CARONA_MAXIMO_CANDIDATOS):
+        """Candidatos ordenados por semelhança de distância e de dias de evento"""
+        faixa = faixa_distancia(inscrito['distancia'])
+        encontrados = []
+        for vizinha in (faixa - 1, faixa, faixa + 1):
+            for outro in self.baldes.get((inscrito['pais'], inscrito['estado'], vizinha), ()):
+                if outro['resposta_id'] == inscrito['resposta_id']:
+                    continue
+                maior = max(inscrito['distancia'], outro['distancia']) or 1
+                pontuacao = (abs(inscrito['distancia'] - outro['distancia']) / maior
+                             + 0.1 * abs(inscrito['dias_evento'] - outro['dias_evento']))
+                encontrados.append((pontuacao, outro))
+        encontrados.sort(key=lambda x: x[0])
+        return [
+            {
+                'resposta_id': outro['resposta_id'],
+                'email': outro['email'],
+                'pais_origem': outro['pais'],
+                'estado_origem': outro['estado'],
+                'distancia_cidade': outro['distancia'],
+                'dias_evento': outro['dias_evento'],
+                'pontuacao': round(pontuacao, 3),
+                # Quem vai de carona deixa de fazer a própria viagem: conta a menor das duas
+                'kgco2_economizado': round(emissao_carro_kg(min(inscrito['distancia'], outro['distancia'])), 2),
+            }
+            for pontuacao, outro in encontrados[:limite]
+        ]
+
+    def economia_evento(self):
+        """Economia estimada se os inscritos de cada balde dividirem carros (agrupamento guloso)"""
+        carros_evitados, economia = 0, 0.0
+        for inscritos in self.baldes.values():
+            ordenados = sorted(inscritos, key=lambda x: x['distancia'], reverse=True)
+            for inicio in range(0, len(ordenados), CARONA_OCUPANTES):
+                grupo = ordenados[inicio:inicio + CARONA_OCUPANTES]
+                # O primeiro (maior distância) dirige; os demais deixam o carro em casa
+                for passageiro in grupo[1:]:
+                    economia += emissao_carro_kg(passageiro['distancia'])
+                    carros_evitados += 1
+        return {
+            'inscritos': len(self.por_resposta),
+            'carros_evitados': carros_evitados,
+            'kgco2_economizado': round(economia, 2),
+        }
+
+# Um índice por evento, pelo intervalo de ids das respostas
+_indices_caronas = {}
+_lock_caronas = threading.Lock()
+CARONA_INDICES_MAXIMO = 16
+
+def periodo_da_resposta(sessao, resposta_id):
+    """Intervalo de ids do evento da resposta; fora de eventos, o trecho entre os eventos vizinhos"""
+    evento = sessao.query(Evento).filter(
+        Evento.id_inicial <= resposta_id,
+        db.or_(Evento.id_final.is_(None), Evento.id_final >= resposta_id),
+    ).first()
+    if evento is not None:
+        return evento.id_inicial, evento.id_final
+    anterior = sessao.query(func.max(Evento.id_final)).filter(Evento.id_final < resposta_id).scalar()
+    seguinte = sessao.query(func.min(Evento.id_inicial)).filter(Evento.id_inicial > resposta_id).scalar()
+    return (anterior + 1 if anterior is not None else None,
+            seguinte - 1 if seguinte is not None else None)
+
+def periodo_atual(sessao):
+    """Intervalo do evento aberto, ou das respostas recebidas depois do último evento"""
+    ultima = sessao.query(func.max(RespostaEmissao.id)).scalar() or 0
+    return periodo_da_resposta(sessao, ultima + 1)
+
+def indice_caronas(periodo):
+    """Índice do período (id_inicio, id_fim) atualizado: acrescenta só as inscrições novas
+
+    Reconstrói se alguma foi cancelada ou se a resposta de algum inscrito foi substituída
+    depois da última atualização. Lê do primário: quem acabou de se inscrever precisa se
+    ver no índice, e a réplica pode estar atrasada.
+    """
+    id_inicio, id_fim = periodo
+    with _lock_caronas, Session(bind=db.engine) as sessao:
+        def no_periodo(consulta):
+            if id_inicio is not None:
+                consulta = consulta.filter(InscricaoCarona.resposta_id >= id_inicio)
+            if id_fim is not None:
+                consulta = consulta.filter(InscricaoCarona.resposta_id <= id_fim)
+            return consulta
+
+        ultima, total = no_periodo(sessao.query(func.max(InscricaoCarona.id), func.count(InscricaoCarona.id))).one()
+        ultima, total = ultima or 0, total or 0
+        seq_feed = sessao.query(func.max(AlteracaoResposta.seq)).scalar() or 0
+        indice = _indices_caronas.get(periodo) or IndiceCaronas()
+        if seq_feed != indice.seq_feed and indice.por_resposta:
+            alteradas = {resposta_id for (resposta_id,) in sessao.query(AlteracaoResposta.resposta_id).filter(
+                AlteracaoResposta.seq > indice.seq_feed, AlteracaoResposta.operacao != 'insert'
+            )}
+            if alteradas & indice.por_resposta.keys():
+                indice = IndiceCaronas()
+        if ultima == indice.ultima_inscricao and total == indice.total:
+            indice.seq_feed = seq_feed
+            _indices_caronas[periodo] = indice
+            return indice
+
+        def inscricoes_apos(id_inscricao):
+            return no_periodo(sessao.query(InscricaoCarona, RespostaEmissao).outerjoin(
+                RespostaEmissao, RespostaEmissao.id == InscricaoCarona.resposta_id
+            )).filter(InscricaoCarona.id > id_inscricao).order_by(InscricaoCarona.id).all()
+
+        novas = inscricoes_apos(indice.ultima_inscricao)
+        if indice.total + len(novas) != total:
+            # Houve cancelamento: o índice é refeito do zero
+            indice = IndiceCaronas()
+            novas = inscricoes_apos(0)
+
+        for _, resposta in novas:
+            if resposta is not None and resposta.transporte_cidade == 'carro':
+                indice.adicionar({
+                    'resposta_id': resposta.id,
+                    'email': resposta.email,
+                    'pais': resposta.pais_origem_pt,
+                    'estado': resposta.estado_origem,
+                    'distancia': float(resposta.distancia_cidade),
+                    'dias_evento': resposta.dias_evento,
+                })
+        indice.ultima_inscricao, indice.total, indice.seq_feed = ultima, total, seq_feed
+        if periodo not in _indices_caronas and len(_indices_caronas) >= CARONA_INDICES_MAXIMO:
+            _indices_caronas.clear()
+        _indices_caronas[periodo] = indice
+        return indice
+
+def _resposta_do_participante(resposta_id):
+    """Carrega a resposta conferindo o email informado (evita expor inscritos a quem só sabe o id)"""
+    resposta = db.session.get(RespostaEmissao, resposta_id)
+    email = (request.get_json(silent=True) or request.form or {}).get('email', '') or request.args.get('email', '')
+    if resposta is None or resposta.email.strip().lower() != str(email).strip().lower():
+        return None
+    return resposta
+
+
+# ===== ACESSO ADMINISTRATIVO =====
+def requer_admin(funcao):
+    """Exige o ADMIN_TOKEN no cabeçalho X-Admin-Token
+
+    Sem ADMIN_TOKEN configurado as rotas de organização não existem (404). O token não é
+    aceito na query string, que acaba em logs, no histórico do navegador e em proxies.
+    """
+    @wraps(funcao)
+    def verificar(*args, **kwargs):
+        token = os.environ.get('ADMIN_TOKEN')
+        if not token:
+            return "Não encontrado", 404
+        informado = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(informado.encode('utf-8'), token.encode('utf-8')):
+            return "Acesso negado", 403
+        return funcao(*args, **kwargs)
+    return verificar
+
+
+# ===== DIAGNÓSTICO: PERFIL POR AMOSTRAGEM E REQUISIÇÕES LENTAS =====
+# Controle e resultados ficam em arquivos para valer em todos os workers do gunicorn: o admin
+# liga o perfil em um worker e todos passam a amostrar, cada um no seu arquivo .folded
+PERFIL_DIR = os.path.join(CACHE_DIR, 'perfil')
+PERFIL_INTERVALO_MS = float(os.environ.get('PERFIL_INTERVALO_MS', '10'))
+PERFIL_DURACAO_MAXIMA = 600
+PERFIL_PROFUNDIDADE_MAXIMA = 120
+# Cada worker relê o arquivo de controle no máximo uma vez por este intervalo
+PERFIL_RELEITURA_SEGUNDOS = 1.0
+# Requisições mais lentas que isso vão para o log com as etapas (0 desliga; o admin pode mudar)
+REQUISICOES_LENTAS_MS = float(os.environ.get('REQUISICOES_LENTAS_MS', '0'))
+
+def _caminho_controle_perfil():
+    return os.path.join(PERFIL_DIR, 'controle.json')
+
+def _rotulo_quadro(quadro):
+    codigo = quadro.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+def pilha_dobrada(raiz, quadro):
+    """Pilha no formato 'dobrado' dos flame graphs: raiz;externa;...;interna"""
+    rotulos = []
+    while quadro is not None and len(rotulos) < PERFIL_PROFUNDIDADE_MAXIMA:
+        rotulos.append(_rotulo_quadro(quadro))
+        quadro = quadro.f_back
+    return ';'.join([raiz] + rotulos[::-1])
+
+class PerfilAmostragem:
+    """Perfil por amostragem do processo
+
+    Só as threads de requisições escolhidas pela sessão ativa são amostradas. Uma thread
+    própria lê as pilhas delas com sys._current_frames() a cada intervalo, sem instrumentar
+    funções, então o custo fica fora das requisições.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.sessao = None
+        self.pilhas = defaultdict(int)
+        self.amostrador = None
+        self._controle = ({}, None)
+
+    def controle(self):
+        """Conteúdo de controle.json, relido no máximo a cada PERFIL_RELEITURA_SEGUNDOS"""
+        controle, lido_em = self._controle
+        agora = time.monotonic()
+        if lido_em is None or agora - lido_em >= PERFIL_RELEITURA_SEGUNDOS:
+            try:
+                with open(_caminho_controle_perfil(), encoding='utf-8') as arquivo:
+                    controle = json.load(arquivo)
+            except (OSError, ValueError):
+                controle = {}
+            self._controle = (controle, agora)
+        return controle
+
+    def sessao_ativa(self):
+        sessao = self.controle().get('sessao')
+        if sessao and time.time() < sessao['ate'] and not sessao_perfil_completa(sessao):
+            return sessao
+        return None
+
+    def acompanhar(self, sessao, raiz):
+        """Passa a amostrar a thread da requisição atual"""
+        with self.lock:
+            if self.sessao is None or self.sessao['id'] != sessao['id']:
+                self._gravar()
+                self.sessao, self.pilhas = sessao, defaultdict(int)
+            self.threads[threading.get_ident()] = raiz
+            if self.amostrador is None:
+                self.amostrador = threading.Thread(target=self._amostrar, daemon=True, name='perfil-amostragem')
+                self.amostrador.start()
+
+    def liberar(self):
+        with self.lock:
+            self.threads.pop(threading.get_ident(), None)
+
+    def _amostrar(self):
+        intervalo = self.sessao.get('intervalo_ms', PERFIL_INTERVALO_MS) / 1000
+        proxima_gravacao = time.monotonic() + 1
+        while True:
+            time.sleep(intervalo)
+            with self.lock:
+                threads = dict(self.threads)
+                sessao = self.sessao
+                if not threads and (time.time() >= sessao['ate'] or sessao_perfil_completa(sessao)
+                                    or (self.controle().get('sessao') or {}).get('id') != sessao['id']):
+                    self._gravar()
+                    self.amostrador = None
+                    return
+            quadros = sys._current_frames()
+            with self.lock:
+                for ident, raiz in threads.items():
+                    quadro = quadros.get(ident)
+                    if quadro is not None:
+                        self.pilhas[pilha_dobrada(raiz, quadro)] += 1
+                if time.monotonic() >= proxima_gravacao:
+                    self._gravar()
+                    proxima_gravacao = time.monotonic() + 1
+            del quadros
+
+    def _gravar(self):
+        if self.sessao is None or not self.pilhas:
+            return
+        linhas = ''.join(f"{pilha} {amostras}\n" for pilha, amostras in sorted(self.pilhas.items()))
+        gravar_arquivo_atomico(os.path.join(PERFIL_DIR, self.sessao['id'], f"{os.getpid()}.folded"),
+                               linhas.encode('utf-8'))
+
+perfil_amostragem = PerfilAmostragem()
+
+def _caminho_contador_perfil(sessao):
+    return os.path.join(PERFIL_DIR, sessao['id'], 'requisicoes')
+
+def requisicoes_perfiladas(sessao):
+    try:
+        return os.path.getsize(_caminho_contador_perfil(sessao))
+    except OSError:
+        return 0
+
+def sessao_perfil_completa(sessao):
+    return bool(sessao.get('requisicoes')) and requisicoes_perfiladas(sessao) >= sessao['requisicoes']
+
+def reservar_requisicao_perfil(sessao):
+    """Conta a requisição na sessão; False se as N requisições pedidas já foram perfiladas
+
+    Cada worker acrescenta um byte ao contador com O_APPEND: a posição depois da escrita
+    é a ordem da requisição entre todos os processos, sem trava.
     """
-    Cria uma tabela simples monolíngue com cabeçalho colorido.
-    dados: lista de listas (primeira linha é cabeçalho)
-    col_widths: larguras das colunas em cm
-    styles: objeto StyleSheet do reportlab
-    header_color: cor de fundo do cabeçalho (hex)
+    descritor = os.open(_caminho_contador_perfil(sessao), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descritor, b'.')
+        ordem = os.lseek(descritor, 0, os.SEEK_CUR)
+    finally:
+        os.close(descritor)
+    return not sessao.get('requisicoes') or ordem <= sessao['requisicoes']
+
+def gravar_controle_perfil(controle):
+    gravar_arquivo_atomico(_caminho_controle_perfil(), json.dumps(controle).encode('utf-8'))
+    perfil_amostragem._controle = (controle, time.monotonic())
+
+def ler_perfil_dobrado(sessao_id, raiz=None):
+    """Pilhas dobradas de todos os workers somadas (entrada de flamegraph.pl ou speedscope)"""
+    pasta = os.path.join(PERFIL_DIR, secure_filename(sessao_id))
+    pilhas = defaultdict(int)
+    for nome in sorted(os.listdir(pasta)) if os.path.isdir(pasta) else ():
+        if not nome.endswith('.folded'):
+            continue
+        with open(os.path.join(pasta, nome), encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                pilha, _, amostras = linha.rstrip('\n').rpartition(' ')
+                if raiz is None or pilha.split(';', 1)[0] == raiz:
+                    pilhas[pilha] += int(amostras)
+    return pilhas
+
+def diagnostico_requisicao():
+    """Tempos da requisição atual (ou None fora de uma requisição)
+
+    Ficam no environ e não em g: vários trechos abrem app.app_context(), que traz um g novo.
     """
-    from reportlab.platypus import Table, TableStyle, Paragraph
-    from reportlab.lib import colors
-    
-    tabela_dados = []
-    for i, linha in enumerate(dados):
-        nova_linha = []
-        for item in linha:
-            if isinstance(item, str):
-                if i == 0:  # cabeçalho
-                    estilo = ParagraphStyle('Header', parent=styles['Normal'], 
-                                            fontSize=10, textColor=colors.white, alignment=1)
-                else:
-                    estilo = styles['Normal']
-                nova_linha.append(Paragraph(item, estilo))
-            else:
-                nova_linha.append(item)
-        tabela_dados.append(nova_linha)
-    
-    tabela = Table(tabela_dados, colWidths=col_widths)
-    tabela.setStyle(TableStyle([
-        ('FONT', (0,0), (-1,0), 'Helvetica-Bold', 10),
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor(header_color)),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.HexColor('#bdc3c7')),
-        ('PADDING', (0,0), (-1,-1), 6),
-    ]))
-    return tabela
+    return request.environ.get('co2.diagnostico') if has_request_context() else None
+
+@contextmanager
+def etapa(nome):
+    """Soma a duração do bloco à etapa da requisição atual (aparece no log de requisições lentas)"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        diagnostico = diagnostico_requisicao()
+        if diagnostico is not None:
+            diagnostico['etapas'][nome] += time.perf_counter() - inicio
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _inicio_consulta(conexao, cursor, sql, parametros, contexto, executemany):
+    conexao.info['inicio_consulta'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _fim_consulta(conexao, cursor, sql, parametros, contexto, executemany):
+    diagnostico = diagnostico_requisicao()
+    if diagnostico is not None:
+        diagnostico['etapas']['banco'] += time.perf_counter() - conexao.info['inicio_consulta']
+        diagnostico['consultas'] += 1
+
+@app.before_request
+def _iniciar_diagnostico():
+    request.environ['co2.diagnostico'] = {'inicio': time.perf_counter(), 'etapas': defaultdict(float), 'consultas': 0}
+    sessao = perfil_amostragem.sessao_ativa()
+    if sessao and sessao.get('rota') in (None, request.endpoint) and reservar_requisicao_perfil(sessao):
+        perfil_amostragem.acompanhar(sessao, request.endpoint or 'sem_rota')
+
+@app.after_request
+def _registrar_requisicao_lenta(resposta):
+    perfil_amostragem.liberar()
+    limiar = perfil_amostragem.controle().get('lentas_ms', REQUISICOES_LENTAS_MS)
+    diagnostico = diagnostico_requisicao()
+    if limiar and diagnostico is not None:
+        total = (time.perf_counter() - diagnostico['inicio']) * 1000
+        if total >= limiar:
+            etapas = ', '.join(f"{nome} {duracao * 1000:.0f} ms"
+                               for nome, duracao in sorted(diagnostico['etapas'].items(), key=lambda x: -x[1]))
+            # Só o caminho e o endpoint: a query string pode trazer emails
+            print(f"🐢 {request.method} {request.path} [{request.endpoint}] → {resposta.status_code} em {total:.0f} ms "
+                  f"({diagnostico['consultas']} consultas{'; ' + etapas if etapas else ''})")
+    return resposta
+
+@app.teardown_request
+def _encerrar_diagnostico(erro=None):
+    # Requisições que terminam em exceção não passam pelo after_request
+    perfil_amostragem.liberar()
+
+
+# ===== EXPORTAÇÃO CSV =====
+def _valor_ou_vazio(campo):
+    return lambda registro: registro[campo] if registro[campo] else ''
+
+# (cabeçalho, valor a partir do registro de to_dict())
+COLUNAS_CSV = [
+    ('ID', lambda r: r['id']),
+    ('Email', lambda r: r['email']),
+    ('País de Origem', lambda r: f"{r['pais_origem_pt']} / {r['pais_origem_en']}"),
+    ('Estado de Origem', _valor_ou_vazio('estado_origem')),
+    ('Tipo Participante', lambda r: r['tipo_participante']),
+    ('Transporte até a Cidade', lambda r: r['transporte_cidade']),
+    ('Distância até a Cidade (km)', lambda r: r['distancia_cidade']),
+    ('Custo Transporte (R$)', _valor_ou_vazio('custo_transporte')),
+    ('Transporte Local', lambda r: r['transporte_local']),
+    ('Distância Local (km)', lambda r: r['distancia_local']),
+    ('Dias de Evento', lambda r: r['dias_evento']),
+    ('Custo Transporte Diário (R$)', _valor_ou_vazio('custo_transporte_diario')),
+    ('Gasto Alimentação (R$)', _valor_ou_vazio('gasto_alimentacao')),
+    ('Gasto Transporte Equipamentos (R$)', _valor_ou_vazio('gasto_equipamentos')),
+    ('Gasto Aluguel Botes (R$)', _valor_ou_vazio('gasto_botes')),
+    ('Gasto Hospedagem (R$)', _valor_ou_vazio('gasto_hospedagem')),
+    ('Pontos Turísticos Visitados', _valor_ou_vazio('pontos_turisticos')),
+    ('Emissão Total (kgCO2)', lambda r: r['emissao_total']),
+]
+
+def escrever_csv_respostas(arquivo, registros, sem_email=False):
+    """Escreve as respostas (dicts de to_dict) em CSV; sem_email para exportações públicas"""
+    colunas = [(titulo, valor) for titulo, valor in COLUNAS_CSV if not (sem_email and titulo == 'Email')]
+    cw = csv.writer(arquivo)
+    cw.writerow([titulo for titulo, _ in colunas])
+    for registro in registros:
+        cw.writerow([valor(registro) for _, valor in colunas])
+
+# Cabeçalhos do CSV exportado → campos do formulário, para a importação aceitar o mesmo formato
+CAMPOS_IMPORTACAO = {
+    'Email': 'email',
+    'País de Origem': 'pais_origem',
+    'Estado de Origem': 'estado_origem',
+    'Tipo Participante': 'tipo_participante',
+    'Transporte até a Cidade': 'transporte_cidade',
+    'Distância até a Cidade (km)': 'distancia_cidade',
+    'Custo Transporte (R$)': 'custo_transporte',
+    'Transporte Local': 'transporte_local',
+    'Distância Local (km)': 'distancia_local',
+    'Dias de Evento': 'dias_evento',
+    'Custo Transporte Diário (R$)': 'custo_transporte_diario',
+    'Gasto Alimentação (R$)': 'gasto_alimentacao',
+    'Gasto Transporte Equipamentos (R$)': 'gasto_equipamentos',
+    'Gasto Aluguel Botes (R$)': 'gasto_botes',
+    'Gasto Hospedagem (R$)': 'gasto_hospedagem',
+    'Pontos Turísticos Visitados': 'pontos_turisticos',
+}
+
+def ler_csv_respostas(arquivo):
+    """Linhas de um CSV de respostas como dicts do formulário (cabeçalhos do /download ou nomes dos campos)"""
+    for linha in csv.DictReader(arquivo):
+        dados = {CAMPOS_IMPORTACAO.get(titulo, titulo): valor for titulo, valor in linha.items()}
+        # O export traz "Brasil / Brazil"
+        dados['pais_origem'] = (dados.get('pais_origem') or '').split(' / ')[0]
+        yield dados
 
 
 # Rotas Flask
-@app.route('/')
-def index():
+def renderizar_index():
     return render_template('index.html',translations=translations)
 
-@app.route('/questionario')
-def questionario():
+def renderizar_questionario():
     return render_template('questionario.html', 
                           transportes=EMISSOES_TRANSPORTE.keys(),
                           tipos_participante=TIPOS_PARTICIPANTE,
-                          #estados_brasil=ESTADOS_BRASIL,
-                          paises_portugues=PAISES_PORTUGUES,  
-                          paises_ingles=PAISES_INGLES,        
-                          paises_dict=PAISES_DICT,            
+                          estados_brasil=ESTADOS_BRASIL,
+                          url_paises=url_for('paises_lista', v=paises_json().etag),
                           translations=translations)
 
-@app.route('/submit', methods=['POST'])
-def submit():
-    try:
-        dados_form = request.form
-        
-        pais_pt = dados_form.get('pais_origem', '').strip()
-        if not pais_pt:
-            return "Erro: Selecione um país de origem.", 400
-        pais_en = PAISES_DICT.get(pais_pt, pais_pt)
-        
+# Páginas que não mudam entre deploys: renderizadas uma vez e servidas já comprimidas
+PAGINAS_ESTATICAS = {
+    'index': renderizar_index,
+    'questionario': renderizar_questionario,
+}
 
-        tipo_participante = dados_form['tipo_participante']
-        if tipo_participante not in TIPOS_PARTICIPANTE:
-            tipo_participante = "Outro"
-        
-        distancia_principal = float(dados_form['distancia_cidade'])
-        transporte_principal = dados_form['transporte_cidade']
-        emissao_principal = EMISSOES_TRANSPORTE.get(transporte_principal, 5.0) * distancia_principal
+@app.route('/')
+def index():
+    return servir_pagina('index')
 
-        custo_transporte = dados_form.get('custo_transporte', '')
-        if custo_transporte:
-            custo_transporte = float(custo_transporte)
-        else:
-            custo_transporte = None
+@app.route('/questionario')
+def questionario():
+    return servir_pagina('questionario')
 
-        custo_diario = dados_form.get('custo_transporte_diario', '')
-        if custo_diario and custo_diario.strip():
-            try:
-                custo_diario_valor = float(custo_diario)
-            except ValueError:
-                custo_diario_valor = None
-        else:
-            custo_diario_valor = None
+@app.route('/paises.json')
+def paises_lista():
+    """Lista de países para a busca no navegador; com ?v=<hash> fica em cache por um ano"""
+    conteudo = paises_json()
+    if request.args.get('v') == conteudo.etag:
+        return conteudo.responder(ESTATICOS_MAX_AGE, imutavel=True)
+    return conteudo.responder(PAGINAS_MAX_AGE)
 
-        distancia_local = float(dados_form['distancia_local'])
-        transporte_local = dados_form['transporte_local']
-        dias_evento = int(dados_form['dias_evento'])
-        emissao_local = EMISSOES_TRANSPORTE.get(transporte_local, 5.0) * distancia_local * dias_evento
-        
-        emissao_total = (emissao_principal + emissao_local)/1000  # Converte para kgCO2
-        
-        def processar_campo_numerico(nome_campo):
-            valor = dados_form.get(nome_campo, '')
-            if valor and valor.strip():
-                try:
-                    return float(valor)
-                except ValueError:
-                    return None
-            return None
-        
-        custo_transporte = processar_campo_numerico('custo_transporte')
-        custo_diario_valor = processar_campo_numerico('custo_transporte_diario')
-        gasto_alimentacao_valor = processar_campo_numerico('gasto_alimentacao')      
-        gasto_equipamentos_valor = processar_campo_numerico('gasto_equipamentos')    
-        gasto_botes_valor = processar_campo_numerico('gasto_botes')                  
-        gasto_hospedagem_valor = processar_campo_numerico('gasto_hospedagem')
+@app.route('/paises/busca')
+def paises_busca():
+    """Sugestões de país por prefixo (?q=), sem diferenciar acentos e maiúsculas"""
+    limite = min(request.args.get('limite', 10, type=int), 50)
+    resposta = jsonify(indice_paises().buscar(request.args.get('q', ''), limite))
+    resposta.headers['Cache-Control'] = f"public, max-age={PAGINAS_MAX_AGE}"
+    return resposta
+
+@app.route('/distancia-estimada')
+def distancia_estimada_evento():
+    """Distância ida e volta estimada (?pais=&estado=&transporte=) até o evento aberto
 
-        pontos_turisticos = dados_form.get('pontos_turisticos', '').strip()
-        pontos_turisticos = pontos_turisticos if pontos_turisticos else None
+    Usada pelo questionário para pré-preencher a distância; sem local do evento ou
+    origem conhecida devolve distancia_km nula.
+    """
+    pais = indice_paises().resolver(request.args.get('pais', '').strip())
+    km, origem = distancia_estimada(local_evento_aberto(), pais, request.args.get('estado'),
+                                    request.args.get('transporte'))
+    resposta = jsonify({
+        "distancia_km": round(km) if km is not None else None,
+        "origem": origem[1] if origem else None,
+        "tipo_origem": origem[0] if origem else None,
+    })
+    # O local só muda quando um evento é aberto: alguns minutos de cache bastam
+    resposta.headers['Cache-Control'] = 'public, max-age=300'
+    return resposta
+
+@app.route('/submit', methods=['POST'])
+def submit():
+    try:
+        dados_form = request.form
+
+        try:
+            with etapa('validacao'):
+                campos = processar_formulario(dados_form)
+        except ValueError as e:
+            return f"Erro: {e}", 400
 
-        # Criar registro no banco
+        # A chave (gerada no navegador) evita duplicar a resposta quando o envio é repetido
+        chave = dados_form.get('chave_idempotencia', '').strip() or None
         with app.app_context():
-            nova_resposta = RespostaEmissao(
-                email=dados_form['email'],
-#                estado_origem=dados_form['estado_origem'],
-                pais_origem_pt=pais_pt,
-                pais_origem_en=pais_en,
-                tipo_participante=tipo_participante,
-                transporte_cidade=transporte_principal,
-                distancia_cidade=distancia_principal,
-                custo_transporte=custo_transporte, 
-                transporte_local=transporte_local,
-                distancia_local=distancia_local,
-                dias_evento=dias_evento,
-                custo_transporte_diario=custo_diario_valor,
-
-                gasto_alimentacao=gasto_alimentacao_valor,
-                gasto_equipamentos=gasto_equipamentos_valor,
-                gasto_botes=gasto_botes_valor,
-                gasto_hospedagem=gasto_hospedagem_valor,
-                pontos_turisticos=pontos_turisticos,
-                
-
-                emissao_total=emissao_total
-            )
-            
-            db.session.add(nova_resposta)
-            db.session.commit()
-            
-            resposta_id = nova_resposta.id
+            with monitor_carga.medir(), etapa('gravacao'):
+                [(_, resposta_id, status)] = inserir_respostas([(chave, campos)])
+            nova_resposta = db.session.get(RespostaEmissao, resposta_id)
         
-        # Gerar gráfico 
-        grafico_base64 = gerar_grafico_base64()
+        # Última versão boa dos painéis; a atualização (se houver) roda em segundo plano
+        with etapa('estatisticas'):
+            paineis, idade_paineis, paineis_desatualizados = estatisticas_coletivas()
+        registro = nova_resposta.to_dict()
         
         return render_template('resultados.html', 
-                              registro=nova_resposta.to_dict(), 
-                              grafico_base64=grafico_base64,
+                              registro=registro,
+                              alternativas=alternativas_individuais(registro),
+                              paineis=paineis,
+                              larguras_grafico=LARGURAS_GRAFICO,
+                              idade_paineis=idade_paineis,
+                              paineis_desatualizados=paineis_desatualizados,
                               resposta_id=resposta_id,
+                              resposta_substituida=status == 'atualizado',
                               paises_dict=PAISES_DICT,
                               translations=translations)
                               
@@ -1229,51 +4762,350 @@ def submit():
         print(f"Erro no submit: {e}")
         return f"Erro ao salvar dados: {str(e)}", 500
 
+@app.route('/submit-lote', methods=['POST'])
+def submit_lote():
+    """Recebe várias respostas (fila offline do navegador) e grava todas numa única transação
+
+    Corpo: {"respostas": [{"chave_idempotencia": "...", <campos do formulário>}, ...]}
+    Se alguma resposta for inválida nada é gravado e os erros são devolvidos por índice.
+    """
+    try:
+        corpo = request.get_json(silent=True) or {}
+        itens = corpo.get('respostas')
+        if not isinstance(itens, list) or not itens:
+            return jsonify({"erro": "Envie uma lista 'respostas'"}), 400
+        if len(itens) > LOTE_MAXIMO:
+            return jsonify({"erro": f"Máximo de {LOTE_MAXIMO} respostas por lote"}), 413
+
+        validos, erros = [], []
+        for indice, item in enumerate(itens):
+            if not isinstance(item, dict):
+                erros.append({"indice": indice, "erro": "Resposta inválida"})
+                continue
+            chave = str(item.get('chave_idempotencia') or '').strip()
+            if not chave or len(chave) > 64:
+                erros.append({"indice": indice, "chave_idempotencia": chave or None,
+                              "erro": "chave_idempotencia obrigatória (até 64 caracteres)"})
+                continue
+            try:
+                validos.append((chave, processar_formulario(item)))
+            except ValueError as e:
+                erros.append({"indice": indice, "chave_idempotencia": chave, "erro": str(e)})
+
+        if erros:
+            return jsonify({"erros": erros}), 400
+
+        with app.app_context(), monitor_carga.medir():
+            resultados = inserir_respostas(validos)
+
+        # Uma única revalidação das estatísticas por lote, não uma por resposta
+        if any(status != 'duplicado' for _, _, status in resultados):
+            estatisticas_coletivas()
+
+        return jsonify({"resultados": [
+            {"chave_idempotencia": chave, "id": resposta_id, "status": status}
+            for chave, resposta_id, status in resultados
+        ]})
+
+    except Exception as e:
+        print(f"Erro no submit-lote: {e}")
+        return jsonify({"erro": f"Erro ao salvar dados: {str(e)}"}), 500
+
+@app.route('/carona/<int:resposta_id>/inscrever', methods=['POST'])
+def carona_inscrever(resposta_id):
+    """Inscreve o participante na carona solidária e devolve os candidatos"""
+    with app.app_context():
+        resposta = _resposta_do_participante(resposta_id)
+        if resposta is None:
+            return jsonify({"erro": "Resposta não encontrada"}), 404
+        if not InscricaoCarona.query.filter_by(resposta_id=resposta_id).first():
+            db.session.add(InscricaoCarona(resposta_id=resposta_id))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+    return carona_candidatos(resposta_id)
+
+@app.route('/carona/<int:resposta_id>/cancelar', methods=['POST'])
+def carona_cancelar(resposta_id):
+    with app.app_context():
+        if _resposta_do_participante(resposta_id) is None:
+            return jsonify({"erro": "Resposta não encontrada"}), 404
+        InscricaoCarona.query.filter_by(resposta_id=resposta_id).delete()
+        db.session.commit()
+    return jsonify({"inscrito": False})
+
+@app.route('/carona/<int:resposta_id>', methods=['GET', 'POST'])
+def carona_candidatos(resposta_id):
+    """Candidatos de carona para um participante inscrito (?email= para confirmar)"""
+    with app.app_context():
+        resposta = _resposta_do_participante(resposta_id)
+        if resposta is None:
+            return jsonify({"erro": "Resposta não encontrada"}), 404
+        inscrito = InscricaoCarona.query.filter_by(resposta_id=resposta_id).first() is not None
+        periodo = periodo_da_resposta(db.session, resposta_id)
+
+    if not inscrito:
+        return jsonify({"inscrito": False, "candidatos": []})
+
+    # Só inscritos do mesmo evento: quem se inscreveu numa regata anterior não vai a esta
+    indice = indice_caronas(periodo)
+    participante = indice.por_resposta.get(resposta_id)
+    return jsonify({
+        "inscrito": True,
+        # Só quem chega de carro entra no índice: para os demais a carona não reduz emissões
+        "transporte_compativel": participante is not None,
+        "candidatos": indice.candidatos(participante) if participante else [],
+    })
+
+@app.route('/carona/economia')
+@requer_admin
+def carona_economia():
+    """Estimativa de kgCO2 economizados no evento (?evento=, padrão: o atual) se os inscritos dividirem carros"""
+    try:
+        if request.args.get('evento'):
+            periodo = intervalo_respostas(request.args['evento'])
+        else:
+            periodo = periodo_atual(db.session)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 404
+    return jsonify(indice_caronas(periodo).economia_evento())
+
+@app.route('/cenarios', methods=['POST'])
+def cenarios():
+    """Simula trocas de meio de transporte para um participante (resposta_id + email) ou para o evento"""
+    dados = request.get_json(silent=True) or {}
+    try:
+        regras = validar_regras_cenario(dados.get('regras', []))
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    with app.app_context():
+        if dados.get('resposta_id') is not None:
+            try:
+                resposta = _resposta_do_participante(int(dados['resposta_id']))
+            except (TypeError, ValueError):
+                resposta = None
+            if resposta is None:
+                return jsonify({"erro": "Resposta não encontrada"}), 404
+            colunas = colunas_de_registros([(
+                resposta.transporte_cidade, resposta.distancia_cidade,
+                resposta.transporte_local, resposta.distancia_local, resposta.dias_evento,
+            )])
+        else:
+            try:
+                id_inicio, id_fim = intervalo_respostas(dados.get('evento'), dados.get('de'), dados.get('ate'))
+            except ValueError as e:
+                return jsonify({"erro": str(e)}), 404
+            colunas = colunas_emissoes(id_inicio, id_fim)
+
+    return jsonify(comparar_cenario(colunas, regras))
+
+@app.route('/alteracoes')
+@requer_admin
+def alteracoes():
+    """Feed NDJSON das respostas inseridas/alteradas/removidas depois do cursor (?cursor=, ?desde=, ?limite=)
+
+    Cada linha traz o cursor para retomar a partir dela; X-Proximo-Cursor retoma depois do lote
+    e X-Mais-Alteracoes indica se vale pedir de novo imediatamente.
+    """
+    try:
+        apos_seq = decodificar_cursor(request.args['cursor']) if request.args.get('cursor') else 0
+        desde = request.args.get('desde')
+        desde = datetime.fromisoformat(desde) if desde else None
+    except ValueError as e:
+        return str(e), 400
+    limite = max(1, min(request.args.get('limite', FEED_LIMITE_PADRAO, type=int), FEED_LIMITE_MAXIMO))
+
+    itens, ultimo_seq, mais = ler_alteracoes(apos_seq, limite, desde)
+    linhas = (
+        json.dumps({'cursor': codificar_cursor(seq), 'operacao': operacao,
+                    'id': resposta_id, 'resposta': dados}, ensure_ascii=False) + '\n'
+        for seq, operacao, resposta_id, dados in itens
+    )
+    resposta = Response(linhas, mimetype='application/x-ndjson')
+    resposta.headers['X-Proximo-Cursor'] = codificar_cursor(ultimo_seq)
+    resposta.headers['X-Mais-Alteracoes'] = '1' if mais else '0'
+    resposta.headers['Cache-Control'] = 'no-store'
+    return resposta
+
+@app.route('/agregados')
+@requer_admin
+def agregados():
+    """Agregados de um evento (?evento=) ou intervalo (?de=&ate=), inclusive de eventos arquivados"""
+    try:
+        id_inicio, id_fim = intervalo_respostas(
+            request.args.get('evento'),
+            request.args.get('de', type=int),
+            request.args.get('ate', type=int),
+        )
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 404
+    return jsonify(calcular_agregados(id_inicio, id_fim))
+
+@app.route('/revisao')
+@requer_admin
+def revisao_respostas():
+    """Respostas com valores atípicos aguardando revisão (?situacao=pendente,sinalizada)"""
+    respostas = []
+    # Uma consulta por situação: com IN o SQLite deixa de usar o índice (poucos valores distintos)
+    for situacao in request.args.get('situacao', 'pendente,sinalizada').split(','):
+        respostas += RespostaEmissao.query.filter(RespostaEmissao.situacao == situacao).all()
+    return jsonify({"respostas": [resposta.to_dict() for resposta in sorted(respostas, key=lambda r: r.id)]})
+
+@app.route('/revisao/<int:resposta_id>', methods=['POST'])
+@requer_admin
+def revisar_resposta(resposta_id):
+    """Decide uma resposta em revisão: {"acao": "aceitar"} a leva para os agregados, "rejeitar" a deixa de fora"""
+    acao = (request.get_json(silent=True) or request.form).get('acao')
+    situacao = {'aceitar': 'aceita', 'rejeitar': 'rejeitada'}.get(acao)
+    if situacao is None:
+        return jsonify({"erro": "acao deve ser 'aceitar' ou 'rejeitar'"}), 400
+    resposta = db.session.get(RespostaEmissao, resposta_id)
+    if resposta is None:
+        return jsonify({"erro": "Resposta não encontrada"}), 404
+    resposta.situacao = situacao
+    db.session.commit()
+    # O 'update' no feed muda a versão dos dados: as estatísticas coletivas são refeitas
+    estatisticas_coletivas()
+    return jsonify(resposta.to_dict())
+
+@app.route('/admin/perfil', methods=['GET', 'POST', 'DELETE'])
+@requer_admin
+def perfil_admin():
+    """Perfil por amostragem das requisições em todos os workers
+
+    POST {"segundos": 30} perfila tudo por uma janela; {"rota": "submit", "requisicoes": 50}
+    perfila as próximas N requisições de um endpoint. "intervalo_ms" muda a amostragem e
+    "lentas_ms" o limiar do log de requisições lentas (0 desliga). DELETE encerra a sessão.
+    """
+    controle = dict(perfil_amostragem.controle())
+    if request.method == 'DELETE':
+        controle['sessao'] = None
+        gravar_controle_perfil(controle)
+    elif request.method == 'POST':
+        corpo = request.get_json(silent=True) or {}
+        try:
+            if 'lentas_ms' in corpo:
+                controle['lentas_ms'] = max(float(corpo['lentas_ms']), 0.0)
+            if corpo.keys() - {'lentas_ms'}:
+                requisicoes = int(corpo.get('requisicoes') or 0)
+                segundos = float(corpo.get('segundos') or PERFIL_DURACAO_MAXIMA)
+                intervalo_ms = float(corpo.get('intervalo_ms') or PERFIL_INTERVALO_MS)
+                if not (0 < segundos <= PERFIL_DURACAO_MAXIMA and 1 <= intervalo_ms <= 1000 and requisicoes >= 0):
+                    raise ValueError(f"segundos deve estar entre 0 e {PERFIL_DURACAO_MAXIMA} "
+                                     "e intervalo_ms entre 1 e 1000")
+                rota = corpo.get('rota') or None
+                if rota is not None and rota not in app.view_functions:
+                    raise ValueError(f"Rota desconhecida: {rota} (use o nome do endpoint, ex.: submit)")
+                controle['sessao'] = {
+                    'id': datetime.utcnow().strftime('%Y%m%d-%H%M%S'),
+                    'ate': time.time() + segundos,
+                    'rota': rota,
+                    'requisicoes': requisicoes,
+                    'intervalo_ms': intervalo_ms,
+                }
+                os.makedirs(os.path.join(PERFIL_DIR, controle['sessao']['id']), exist_ok=True)
+        except (TypeError, ValueError) as e:
+            return jsonify({"erro": str(e)}), 400
+        gravar_controle_perfil(controle)
+
+    sessoes = []
+    for nome in sorted(os.listdir(PERFIL_DIR)) if os.path.isdir(PERFIL_DIR) else ():
+        if os.path.isdir(os.path.join(PERFIL_DIR, nome)):
+            sessoes.append({
+                'id': nome,
+                'amostras': sum(ler_perfil_dobrado(nome).values()),
+                'requisicoes': requisicoes_perfiladas({'id': nome}),
+                'url': url_for('perfil_dobrado', sessao_id=nome),
+            })
+    return jsonify({
+        'sessao': controle.get('sessao'),
+        'ativa': perfil_amostragem.sessao_ativa() is not None,
+        'lentas_ms': controle.get('lentas_ms', REQUISICOES_LENTAS_MS),
+        'sessoes': sessoes,
+    })
+
+@app.route('/admin/perfil/<sessao_id>.folded')
+@requer_admin
+def perfil_dobrado(sessao_id):
+    """Pilhas dobradas da sessão (?rota= filtra um endpoint), prontas para flamegraph.pl ou speedscope"""
+    pilhas = ler_perfil_dobrado(sessao_id, request.args.get('rota'))
+    if not pilhas and not os.path.isdir(os.path.join(PERFIL_DIR, secure_filename(sessao_id))):
+        return jsonify({"erro": "Sessão de perfil não encontrada"}), 404
+    conteudo = ''.join(f"{pilha} {amostras}\n" for pilha, amostras in sorted(pilhas.items()))
+    return Response(conteudo, mimetype='text/plain')
+
+@app.route('/admin/tarefas', methods=['GET', 'POST'])
+@requer_admin
+def tarefas_admin():
+    """Fila de tarefas de manutenção
+
+    POST {"tipo": "recalcular_emissoes", "evento": "..."} (ou "de"/"ate") enfileira uma
+    tarefa para o `flask worker-tarefas`; GET lista as mais recentes (?situacao= filtra).
+    """
+    if request.method == 'POST':
+        corpo = request.get_json(silent=True) or {}
+        try:
+            tarefa = enfileirar_tarefa(corpo.get('tipo'), {
+                'evento': corpo.get('evento'),
+                'de': int(corpo['de']) if corpo.get('de') is not None else None,
+                'ate': int(corpo['ate']) if corpo.get('ate') is not None else None,
+            })
+        except (TypeError, ValueError) as e:
+            return jsonify({"erro": str(e)}), 400
+        resposta = jsonify(tarefa.to_dict())
+        resposta.status_code = 202
+        resposta.headers['Location'] = url_for('tarefa_admin', tarefa_id=tarefa.id)
+        return resposta
+
+    consulta = Tarefa.query
+    if request.args.get('situacao'):
+        consulta = consulta.filter(Tarefa.situacao == request.args['situacao'])
+    return jsonify({
+        "tipos": list(TIPOS_TAREFA),
+        "tarefas": [tarefa.to_dict() for tarefa in consulta.order_by(Tarefa.id.desc()).limit(100)],
+    })
+
+@app.route('/admin/tarefas/<int:tarefa_id>', methods=['GET', 'DELETE'])
+@requer_admin
+def tarefa_admin(tarefa_id):
+    """Progresso e vazão de uma tarefa; DELETE a cancela"""
+    try:
+        tarefa = cancelar_tarefa(tarefa_id) if request.method == 'DELETE' else db.session.get(Tarefa, tarefa_id)
+    except ValueError:
+        tarefa = None
+    if tarefa is None:
+        return jsonify({"erro": "Tarefa não encontrada"}), 404
+    return jsonify(tarefa.to_dict())
+
+@app.route('/admin/tarefas/<int:tarefa_id>/retomar', methods=['POST'])
+@requer_admin
+def retomar_tarefa_admin(tarefa_id):
+    """Volta para a fila uma tarefa que falhou ou foi cancelada, a partir do checkpoint"""
+    if db.session.get(Tarefa, tarefa_id) is None:
+        return jsonify({"erro": "Tarefa não encontrada"}), 404
+    try:
+        return jsonify(retomar_tarefa(tarefa_id).to_dict())
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 409
+
 @app.route('/dados')
 def get_dados():
-    with app.app_context():
-        respostas = RespostaEmissao.query.all()
+    with app.app_context(), sessao_leitura() as sessao:
+        respostas = filtrar_respostas(sessao.query(RespostaEmissao), **filtros_da_requisicao()).all()
         dados = {"respostas": [resposta.to_dict() for resposta in respostas]}
     return jsonify(dados)
 
 @app.route('/download')
 def download_dados():
     try:
-        with app.app_context():
-            respostas = RespostaEmissao.query.all()
+        with app.app_context(), sessao_leitura() as sessao:
+            respostas = filtrar_respostas(sessao.query(RespostaEmissao), **filtros_da_requisicao()).all()
         
         # Criar CSV
         si = StringIO()
-        cw = csv.writer(si)
-        cw.writerow(['ID', 'Email', 'País de Origem', 'Tipo Participante', 
-                     'Transporte até a Cidade', 'Distância até a Cidade (km)', 'Custo Transporte (R$)', 
-                     'Transporte Local', 'Distância Local (km)', 'Dias de Evento',
-                     'Custo Transporte Diário (R$)','Gasto Alimentação (R$)', 
-                     'Gasto Transporte Equipamentos (R$)', 'Gasto Aluguel Botes (R$)','Gasto Hospedagem (R$)',
-                     'Pontos Turísticos Visitados','Emissão Total (kgCO2)'])
-        
-        for resposta in respostas:
-            cw.writerow([
-                resposta.id,
-                resposta.email,
-                f"{resposta.pais_origem_pt} / {resposta.pais_origem_en}",
-             #   resposta.estado_origem,
-                resposta.tipo_participante,
-                resposta.transporte_cidade,
-                float(resposta.distancia_cidade),
-                float(resposta.custo_transporte) if resposta.custo_transporte else '',  
-                resposta.transporte_local,
-                float(resposta.distancia_local),
-                resposta.dias_evento,
-                float(resposta.custo_transporte_diario) if resposta.custo_transporte_diario else '',
-                float(resposta.gasto_alimentacao) if resposta.gasto_alimentacao else '',
-                float(resposta.gasto_equipamentos) if resposta.gasto_equipamentos else '',
-                float(resposta.gasto_botes) if resposta.gasto_botes else '',
-                float(resposta.gasto_hospedagem) if resposta.gasto_hospedagem else '',
-                resposta.pontos_turisticos if resposta.pontos_turisticos else '',
-                
-                float(resposta.emissao_total),
-            ])
+        escrever_csv_respostas(si, (resposta.to_dict() for resposta in respostas))
         
         output = make_response(si.getvalue())
         output.headers["Content-Disposition"] = "attachment; filename=emissoes_co2_regata.csv"
@@ -1283,38 +5115,815 @@ def download_dados():
     except Exception as e:
         return f"Erro ao gerar CSV: {str(e)}", 500
 
+# Conteúdos prontos (com gzip/br) dos gráficos servidos por este worker
+_graficos_prontos = {}
+GRAFICOS_PRONTOS_MAXIMO = 64
+
+def formato_grafico_pedido(formato):
+    """(formato, largura) de um pedido de gráfico
+
+    A extensão da URL (ou, sem ela, ?formato=) decide; sem nenhum dos dois, SVG só para
+    quem o anuncia no Accept. O PNG sai na largura de ?largura= (arredondada para uma das
+    padronizadas) ou, com Save-Data, na menor delas.
+    """
+    formato = formato or request.args.get('formato')
+    if formato is None:
+        formato = 'svg' if any(tipo == 'image/svg+xml' and q for tipo, q in request.accept_mimetypes) else 'png'
+    if formato == 'svg':
+        return formato, None
+    if formato != 'png':
+        return None, None
+    largura = request.args.get('largura', type=int)
+    if largura is None:
+        largura = LARGURAS_GRAFICO[0] if request.headers.get('Save-Data') == 'on' else LARGURA_GRAFICO_PADRAO
+    return formato, largura_grafico(largura)
+
+@app.route('/grafico/<painel>.png', defaults={'formato': 'png'})
+@app.route('/grafico/<painel>.svg', defaults={'formato': 'svg'})
+@app.route('/grafico/<painel>', defaults={'formato': None})
+def grafico_painel(painel, formato):
+    """Um único painel das estatísticas coletivas, em SVG ou PNG
+
+    Com ?v=<hash> igual ao do painel atual (as URLs da página de resultados), a resposta
+    é imutável; sem ele, o cliente revalida pelo ETag.
+    """
+    if painel not in PAINEIS:
+        return "Painel não encontrado", 404
+    negociado = formato is None and 'formato' not in request.args
+    formato, largura = formato_grafico_pedido(formato)
+    if formato is None:
+        return "Formato deve ser 'svg' ou 'png'", 400
+    try:
+        paineis, idade, desatualizado = estatisticas_coletivas()
+        if not paineis or painel not in paineis:
+            return "Sem dados para o painel", 404
+
+        serie = ler_snapshot_estatisticas()['series'][painel]
+        chave = (painel, paineis[painel], formato, largura)
+        conteudo = _graficos_prontos.get(chave)
+        if conteudo is None:
+            _, dados = painel_da_serie(painel, serie, formato, largura)
+            conteudo = ConteudoPreComprimido(dados, 'image/svg+xml' if formato == 'svg' else 'image/png')
+            with _lock_paginas:
+                if len(_graficos_prontos) >= GRAFICOS_PRONTOS_MAXIMO:
+                    _graficos_prontos.clear()
+                _graficos_prontos[chave] = conteudo
+
+        if request.args.get('v') == paineis[painel]:
+            resposta = conteudo.responder(ESTATICOS_MAX_AGE, imutavel=True)
+        else:
+            resposta = conteudo.responder(0)
+            resposta.headers['Cache-Control'] = 'no-cache'
+        if negociado:
+            resposta.headers['Vary'] = 'Accept-Encoding, Accept, Save-Data'
+        resposta.headers['Age'] = str(int(idade))
+        if desatualizado:
+            resposta.headers['X-Estatisticas-Desatualizadas'] = '1'
+        return resposta
+    except Exception as e:
+        return f"Erro ao gerar gráfico: {str(e)}", 500
+
 @app.route('/download-pdf/<int:resposta_id>')
 def download_pdf(resposta_id):
     try:
+        # Lê do primário: o participante acabou de enviar e a réplica pode estar atrasada
         with app.app_context():
             resposta = RespostaEmissao.query.get_or_404(resposta_id)
         
-        pdf_buffer = gerar_pdf(resposta.to_dict())
-        email_parte = resposta.email.split('@')[0] if resposta.email else 'sem_email'
-        
+        registro = resposta.to_dict()
         return send_file(
-            pdf_buffer,
+            obter_pdf_em_cache(registro),
             as_attachment=True,
-            download_name=f"emissao_co2_{email_parte}.pdf",
+            download_name=nome_arquivo_pdf(registro),
             mimetype='application/pdf'
         )
     except Exception as e:
         return f"Erro ao gerar PDF: {str(e)}", 500
 
+@app.route('/relatorio-evento')
+@requer_admin
+def relatorio_evento():
+    """PDF consolidado do evento (?evento=) ou de um intervalo (?de=&ate=), regenerado só quando os dados mudam"""
+    try:
+        nome_evento = request.args.get('evento')
+        id_inicio, id_fim = intervalo_respostas(
+            nome_evento,
+            request.args.get('de', type=int),
+            request.args.get('ate', type=int),
+        )
+        assinatura, caminho = gerar_pdf_evento(nome_evento, id_inicio, id_fim)
+        resposta = send_file(
+            caminho,
+            download_name=f"relatorio_{secure_filename(nome_evento or 'evento')}.pdf",
+            mimetype='application/pdf',
+            etag=assinatura,
+            conditional=True
+        )
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta
+    except ValueError as e:
+        return str(e), 404
+    except Exception as e:
+        return f"Erro ao gerar relatório do evento: {str(e)}", 500
+
+@app.route('/exportar-pdfs')
+@requer_admin
+def exportar_pdfs():
+    """ZIP com os PDFs de todos os participantes de um evento (?evento=) ou intervalo (?de=&ate=)"""
+    try:
+        id_inicio, id_fim = intervalo_respostas(
+            request.args.get('evento'),
+            request.args.get('de', type=int),
+            request.args.get('ate', type=int),
+        )
+    except ValueError as e:
+        return str(e), 404
+
+    nome_zip = request.args.get('evento') or f"respostas_{id_inicio or 'inicio'}_{id_fim or 'fim'}"
+    resposta = Response(
+        stream_with_context(gerar_zip_pdfs(id_inicio, id_fim, progresso=_log_progresso_exportacao)),
+        mimetype='application/zip'
+    )
+    resposta.headers['Content-Disposition'] = f"attachment; filename=relatorios_{secure_filename(nome_zip)}.zip"
+    resposta.headers['X-Total-Relatorios'] = str(contar_respostas(id_inicio, id_fim))
+    return resposta
+
+# ===== PLANOS DAS CONSULTAS CRÍTICAS =====
+# Consultas que só escalam com índice: verificar-planos falha se alguma voltar a varrer a tabela
+CONSULTAS_CRITICAS = {
+    'resposta por email': lambda sessao: filtrar_respostas(sessao.query(RespostaEmissao), email='Participante@Exemplo.com'),
+    'filtro por tipo de participante': lambda sessao: filtrar_respostas(sessao.query(RespostaEmissao), tipo='Velejador(a)'),
+    'filtro por transporte de chegada': lambda sessao: filtrar_respostas(sessao.query(RespostaEmissao), transporte='carro'),
+    'filtro por país de origem': lambda sessao: filtrar_respostas(sessao.query(RespostaEmissao), pais='Brasil'),
+    'respostas em revisão': lambda sessao: sessao.query(RespostaEmissao).filter(RespostaEmissao.situacao == 'pendente'),
+    'bloco da exportação por intervalo de ids': lambda sessao: consulta_bloco_exportacao(sessao, 100, 900, 350),
+}
+
+def plano_consulta(engine, sql):
+    """Plano da consulta (linhas legíveis) e as tabelas varridas por inteiro"""
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conexao:
+            linhas = [linha[-1] for linha in conexao.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+        varridas = [m.group(2) for m in (re.match(r'SCAN (TABLE )?(\w+)', linha) for linha in linhas) if m]
+        return linhas, varridas
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conexao:
+            # Com poucas linhas o planejador prefere Seq Scan mesmo havendo índice; aqui
+            # interessa se existe um índice utilizável, então a varredura sequencial é desencorajada
+            conexao.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            [[plano]] = conexao.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").all()
+        linhas, varridas = [], []
+        pendentes = [(plano[0]['Plan'], 0)]
+        while pendentes:
+            no, nivel = pendentes.pop()
+            linhas.append("  " * nivel + f"{no['Node Type']} {no.get('Relation Name', '')} {no.get('Index Name', '')}".rstrip())
+            if no['Node Type'] == 'Seq Scan':
+                varridas.append(no['Relation Name'])
+            pendentes += [(filho, nivel + 1) for filho in reversed(no.get('Plans', []))]
+        return linhas, varridas
+    raise ValueError(f"EXPLAIN não suportado para {engine.dialect.name}")
+
+def semear_respostas_sinteticas(engine, total, semente=42):
+    """Respostas variadas para o planejador ter estatísticas realistas (só em bancos descartáveis)"""
+    sorteio = np.random.default_rng(semente)
+    meios = list(EMISSOES_TRANSPORTE)
+    linhas = []
+    for i in range(total):
+        distancia = float(sorteio.integers(5, 3000))
+        meio = meios[int(sorteio.integers(len(meios)))]
+        linhas.append({
+            'email': f"participante{i}@exemplo.com",
+            'pais_origem_pt': PAISES_PORTUGUES[int(sorteio.integers(len(PAISES_PORTUGUES)))],
+            'pais_origem_en': '--',
+            'tipo_participante': TIPOS_PARTICIPANTE[int(sorteio.integers(len(TIPOS_PARTICIPANTE)))],
+            'transporte_cidade': meio,
+            'distancia_cidade': distancia,
+            'transporte_local': meios[int(sorteio.integers(len(meios)))],
+            'distancia_local': float(sorteio.integers(1, 30)),
+            'dias_evento': int(sorteio.integers(1, 8)),
+            'emissao_total': round(EMISSOES_TRANSPORTE[meio] * distancia / 1000, 2),
+            # Poucas em revisão, como num evento real
+            'situacao': 'pendente' if i % 100 == 0 else 'sinalizada' if i % 150 == 0 else 'aceita',
+        })
+    with engine.begin() as conexao:
+        conexao.execute(RespostaEmissao.__table__.insert(), linhas)
+        conexao.exec_driver_sql("ANALYZE")
+
+def preparar_banco_planos(engine, respostas=5000):
+    """Esquema, migrações e (se a tabela estiver vazia) respostas sintéticas num banco descartável"""
+    db.metadata.create_all(engine)
+    aplicar_migracoes(engine)
+    with engine.connect() as conexao:
+        existentes = conexao.execute(db.select(func.count()).select_from(RespostaEmissao.__table__)).scalar()
+    if not existentes:
+        semear_respostas_sinteticas(engine, respostas)
+
+def plano_consulta_critica(engine, nome):
+    """Plano de uma das CONSULTAS_CRITICAS e se ele varre respostas_emissao inteira"""
+    with Session(engine) as sessao:
+        sql = str(CONSULTAS_CRITICAS[nome](sessao).statement.compile(
+            dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+    linhas, varridas = plano_consulta(engine, sql)
+    return linhas, RespostaEmissao.__tablename__ in varridas
+
+
 # Inicialização 
 def init_database():
     with app.app_context():
         try:
             db.create_all()
+            for versao, descricao in aplicar_migracoes():
+                print(f"✅ Migração {versao} aplicada: {descricao}")
+            semear_alteracoes()
+            aquecer_paginas()
             print("✅ Banco de dados inicializado com sucesso!")
             print(f"✅ Usando banco: {app.config['SQLALCHEMY_DATABASE_URI']}")
         except Exception as e:
             print(f"❌ Erro ao inicializar banco: {e}")
 
+@app.cli.command('migrar')
+@click.option('--status', is_flag=True, help='Só lista as migrações aplicadas e pendentes')
+def migrar(status):
+    """Aplica as migrações pendentes do esquema"""
+    if status:
+        VersaoEsquema.__table__.create(bind=db.engine, checkfirst=True)
+        feitas = {v.versao: v for v in VersaoEsquema.query}
+        for versao, descricao, _ in MIGRACOES:
+            aplicada = feitas.get(versao)
+            situacao = f"aplicada em {aplicada.aplicada_em:%Y-%m-%d %H:%M}" if aplicada else "pendente"
+            print(f"{versao:>3} {descricao}: {situacao}")
+        return
+    db.create_all()
+    aplicadas = aplicar_migracoes()
+    for versao, descricao in aplicadas:
+        print(f"✅ Migração {versao} aplicada: {descricao}")
+    if not aplicadas:
+        print("✅ Esquema já está na versão mais recente")
+
+@app.cli.command('verificar-planos')
+@click.option('--banco', help='URL de um banco descartável (padrão: SQLite temporário)')
+@click.option('--respostas', default=5000, help='Respostas sintéticas semeadas se a tabela estiver vazia')
+def verificar_planos(banco, respostas):
+    """Roda EXPLAIN nas consultas críticas e falha se alguma varrer respostas_emissao inteira"""
+    import tempfile
+
+    falhas = 0
+    with tempfile.TemporaryDirectory() as pasta:
+        engine = create_engine(_normalizar_url_banco(banco) or f"sqlite:///{os.path.join(pasta, 'planos.db')}")
+        try:
+            preparar_banco_planos(engine, respostas)
+            for nome in CONSULTAS_CRITICAS:
+                linhas, varre_respostas = plano_consulta_critica(engine, nome)
+                if varre_respostas:
+                    falhas += 1
+                    print(f"❌ {nome}: varredura completa")
+                else:
+                    print(f"✅ {nome}")
+                for linha in linhas:
+                    print(f"     {linha}")
+        finally:
+            engine.dispose()
+    if falhas:
+        print(f"❌ {falhas} consulta(s) sem índice")
+        raise SystemExit(1)
+
+@app.cli.command('cache-status')
+def cache_status():
+    """Ocupação do cache compartilhado por espaço"""
+    por_espaco = defaultdict(lambda: [0, 0])
+    for _, tamanho, espaco, _ in cache_compartilhado.entradas():
+        por_espaco[espaco][0] += 1
+        por_espaco[espaco][1] += tamanho
+    for espaco in ESPACOS_CACHE:
+        entradas, tamanho = por_espaco[espaco]
+        print(f"📦 {espaco}: {entradas} entrada(s), {tamanho / 1024 / 1024:.1f} MB")
+    total = sum(tamanho for _, tamanho in por_espaco.values())
+    print(f"📦 Total: {total / 1024 / 1024:.1f} MB de {CACHE_TAMANHO_MAXIMO_MB} MB (CACHE_TAMANHO_MAXIMO_MB)")
+    print(f"📦 Versão dos dados: {versao_dados()}")
+
+@app.cli.command('limpar-cache')
+@click.option('--espaco', type=click.Choice(ESPACOS_CACHE), help='Só este espaço')
+def limpar_cache(espaco):
+    """Apaga as entradas do cache compartilhado (todas, ou só as de um espaço)"""
+    removidas = 0
+    for _, _, espaco_entrada, caminho in cache_compartilhado.entradas():
+        if espaco in (None, espaco_entrada):
+            os.remove(caminho)
+            removidas += 1
+    print(f"✅ {removidas} entrada(s) removida(s)")
+
+@app.cli.command('status-replica')
+def status_replica():
+    """Mede agora o atraso da réplica e mostra qual banco atenderia as leituras"""
+    print(f"Primário: {db.engine.url.render_as_string(hide_password=True)}")
+    replica = db.engines.get('replica')
+    if replica is None:
+        print("Leituras: primário (DATABASE_REPLICA_URL não configurada)")
+        return
+    # Medição síncrona: engine_leitura() só consultaria a thread deste processo, que ainda não mediu nada
+    saudavel, atraso = verificar_replica(replica)
+    engine = replica if saudavel else db.engine
+    print(f"Leituras: {engine.url.render_as_string(hide_password=True)}")
+    print(f"Atraso da réplica: {'indisponível' if atraso is None else f'{atraso:.1f}s'}"
+          f" (máximo {REPLICA_ATRASO_MAXIMO:g}s)")
+
+@app.cli.command('abrir-evento')
+@click.argument('nome')
+@click.option('--deduplicacao', type=click.Choice(DEDUPLICACAO_MODOS),
+              help='Reenvio do mesmo email (padrão: DEDUPLICACAO_PADRAO)')
+@click.option('--local', help="Local do evento: 'lat,lon' ou nome de um estado/país")
+def abrir_evento(nome, deduplicacao, local):
+    """Encerra o evento aberto (se houver) e abre um novo a partir da próxima resposta"""
+    try:
+        coordenadas = resolver_local(local) if local else (None, None)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    ultimo_id = db.session.query(func.max(RespostaEmissao.id)).scalar() or 0
+    aberto = Evento.query.filter(Evento.id_final.is_(None)).first()
+    if aberto:
+        aberto.id_final = ultimo_id
+        print(f"✅ Evento '{aberto.nome}' encerrado (respostas {aberto.id_inicial}-{ultimo_id})")
+    evento = Evento(nome=nome, id_inicial=ultimo_id + 1, deduplicacao=deduplicacao,
+                    local_latitude=coordenadas[0], local_longitude=coordenadas[1])
+    db.session.add(evento)
+    db.session.commit()
+    print(f"✅ Evento '{nome}' aberto a partir da resposta {ultimo_id + 1} "
+          f"(deduplicação: {evento.modo_deduplicacao})")
+
+@app.cli.command('local-evento')
+@click.argument('nome')
+@click.argument('local')
+def local_evento(nome, local):
+    """Define o local do evento ('lat,lon' ou nome de estado/país) e mostra as distâncias estimadas"""
+    evento = Evento.query.filter_by(nome=nome).first()
+    if evento is None:
+        print(f"❌ Evento não encontrado: {nome}")
+        raise SystemExit(1)
+    try:
+        evento.local_latitude, evento.local_longitude = resolver_local(local)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    db.session.commit()
+    print(f"✅ Local de '{nome}': {evento.local_latitude}, {evento.local_longitude}")
+    tabela = tabela_distancias(*evento.local)
+    for origem in sorted(tabela, key=tabela.get)[:5]:
+        print(f"   {origem[1]}: {2 * tabela[origem]:.0f} km ida e volta em linha reta")
+
+@app.cli.command('deduplicacao-evento')
+@click.argument('nome')
+@click.argument('modo', type=click.Choice(DEDUPLICACAO_MODOS))
+def deduplicacao_evento(nome, modo):
+    """Muda o tratamento de reenvios do mesmo email num evento (vale para as próximas respostas)"""
+    evento = Evento.query.filter_by(nome=nome).first()
+    if evento is None:
+        print(f"❌ Evento não encontrado: {nome}")
+        raise SystemExit(1)
+    evento.deduplicacao = modo
+    db.session.commit()
+    print(f"✅ Deduplicação de '{nome}': {modo}")
+
+@app.cli.command('importar-respostas')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+def importar_respostas(arquivo):
+    """Importa respostas de um CSV, com a mesma validação e verificação de atípicos do formulário"""
+    with open(arquivo, 'rb') as f:
+        conteudo = f.read()
+    # Chave por arquivo e linha: importar o mesmo arquivo de novo não duplica respostas
+    prefixo = hashlib.sha256(conteudo).hexdigest()[:16]
+    itens, erros = [], []
+    for numero, dados in enumerate(ler_csv_respostas(StringIO(conteudo.decode('utf-8-sig'))), start=2):
+        try:
+            itens.append((f"importacao:{prefixo}:{numero}", processar_formulario(dados)))
+        except ValueError as e:
+            erros.append((numero, e))
+    if erros:
+        for numero, erro in erros[:20]:
+            print(f"❌ Linha {numero}: {erro}")
+        print(f"❌ {len(erros)} linha(s) inválida(s); nada foi importado")
+        raise SystemExit(1)
+
+    # O próprio arquivo também serve de referência: um evento inteiro importado num
+    # banco vazio ainda tem os atípicos separados
+    do_arquivo = calcular_referencia_atipicos(colunas_atipicos(
+        [tuple(campos.get(nome) for nome in COLUNAS_ATIPICOS) for _, campos in itens]))
+    do_evento = referencia_atipicos()
+    referencia = {campo: {**do_evento.get(campo, {}), **do_arquivo[campo]} for campo in CAMPOS_ATIPICOS}
+
+    status, ids = defaultdict(int), []
+    for inicio in range(0, len(itens), LOTE_MAXIMO):
+        for _, resposta_id, situacao in inserir_respostas(itens[inicio:inicio + LOTE_MAXIMO], referencia):
+            status[situacao] += 1
+            ids.append(resposta_id)
+    em_revisao = RespostaEmissao.query.filter(
+        RespostaEmissao.id.in_(ids), RespostaEmissao.situacao.in_(('pendente', 'sinalizada'))).count()
+    print(f"✅ {status['criado']} resposta(s) importada(s), {status['atualizado']} atualizada(s), "
+          f"{status['duplicado']} já existente(s); {em_revisao} aguardando revisão")
+
+@app.cli.command('encerrar-evento')
+def encerrar_evento():
+    """Encerra o evento aberto na última resposta recebida"""
+    aberto = Evento.query.filter(Evento.id_final.is_(None)).first()
+    if aberto is None:
+        print("⚠️  Nenhum evento aberto")
+        return
+    aberto.id_final = db.session.query(func.max(RespostaEmissao.id)).scalar() or 0
+    db.session.commit()
+    print(f"✅ Evento '{aberto.nome}' encerrado (respostas {aberto.id_inicial}-{aberto.id_final})")
+
+@app.cli.command('exportar-pdfs')
+@click.option('--evento', help='Nome do evento')
+@click.option('--de', 'id_inicio', type=int, help='Primeiro id de resposta')
+@click.option('--ate', 'id_fim', type=int, help='Último id de resposta')
+@click.option('--workers', type=int, help='Processos geradores de PDF')
+@click.option('--saida', required=True, help='Arquivo .zip de destino')
+def exportar_pdfs_cli(evento, id_inicio, id_fim, workers, saida):
+    """Exporta os relatórios PDF dos participantes para um arquivo ZIP"""
+    id_inicio, id_fim = intervalo_respostas(evento, id_inicio, id_fim)
+    inicio = time.perf_counter()
+    with open(saida, 'wb') as arquivo:
+        for bloco in gerar_zip_pdfs(id_inicio, id_fim, progresso=_log_progresso_exportacao, workers=workers):
+            arquivo.write(bloco)
+    print(f"✅ {saida} gerado em {time.perf_counter() - inicio:.1f}s")
+
+@app.cli.command('relatorio-evento')
+@click.option('--evento', help='Nome do evento')
+@click.option('--de', 'id_inicio', type=int, help='Primeiro id de resposta')
+@click.option('--ate', 'id_fim', type=int, help='Último id de resposta')
+@click.option('--saida', required=True, help='Arquivo .pdf de destino')
+def relatorio_evento_cli(evento, id_inicio, id_fim, saida):
+    """Gera o relatório consolidado do evento em PDF"""
+    id_inicio, id_fim = intervalo_respostas(evento, id_inicio, id_fim)
+    inicio = time.perf_counter()
+    _, caminho = gerar_pdf_evento(evento, id_inicio, id_fim)
+    shutil.copyfile(caminho, saida)
+    print(f"✅ {saida} gerado em {time.perf_counter() - inicio:.2f}s")
+
+@app.cli.command('arquivar-evento')
+@click.argument('nome', required=False)
+@click.option('--desde', type=click.DateTime(), help='Arquivar as respostas recebidas a partir desta data (UTC)')
+@click.option('--ate', type=click.DateTime(), help='... e antes desta data (UTC)')
+def arquivar_evento(nome, desde, ate):
+    """Move as respostas de um evento encerrado (ou de um período) para o arquivo compactado"""
+    try:
+        if desde and ate:
+            id_inicio, id_fim = intervalo_por_datas(desde, ate)
+            nome = nome or f"periodo_{desde:%Y%m%d}_{ate:%Y%m%d}"
+            aberto = Evento.query.filter(Evento.id_final.is_(None)).first()
+            if aberto is not None and aberto.id_inicial <= id_fim:
+                raise ValueError(f"O período inclui respostas do evento aberto {aberto.nome}")
+        elif nome:
+            evento = Evento.query.filter_by(nome=nome).first()
+            if evento is None:
+                raise ValueError(f"Evento não encontrado: {nome}")
+            if not evento.encerrado:
+                raise ValueError(f"O evento {nome} ainda está aberto")
+            id_inicio, id_fim = evento.id_inicial, evento.id_final
+        else:
+            raise ValueError("Informe o nome de um evento encerrado ou --desde e --ate")
+        inicio = time.perf_counter()
+        caminho, total, tamanho = arquivar_intervalo(nome, id_inicio, id_fim)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    print(f"📦 {total} respostas ({id_inicio}-{id_fim}) arquivadas em {caminho} "
+          f"({tamanho / 1024:.1f} KB, {time.perf_counter() - inicio:.1f}s)")
+
+@app.cli.command('congelar-evento')
+@click.argument('nome')
+@click.option('--saida', help='Diretório de destino (padrão: CONGELADOS_DIR/<evento>)')
+def congelar_evento_cli(nome, saida):
+    """Gera (ou refaz) o site estático de um evento encerrado"""
+    inicio = time.perf_counter()
+    try:
+        destino, arquivos = congelar_evento(nome, saida)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    tamanho = sum(arquivo['bytes'] for arquivo in arquivos.values())
+    print(f"🧊 {nome} congelado em {destino}: {len(arquivos)} arquivos, "
+          f"{tamanho / 1024:.1f} KB ({time.perf_counter() - inicio:.1f}s)")
+
+@app.cli.command('restaurar-evento')
+@click.argument('nome')
+def restaurar_evento(nome):
+    """Devolve à tabela principal as respostas de um evento arquivado"""
+    try:
+        total = restaurar_arquivo(nome)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    print(f"✅ {total} respostas de {nome} restauradas")
+
+@app.cli.command('listar-arquivos')
+def listar_arquivos():
+    """Lista os eventos arquivados"""
+    for arquivado in ArquivoEvento.query.order_by(ArquivoEvento.id_inicial):
+        agregados = json.loads(arquivado.agregados)
+        print(f"{arquivado.nome}: respostas {arquivado.id_inicial}-{arquivado.id_final}, "
+              f"{arquivado.total_respostas} participantes, {agregados['emissao_total']:,.2f} kgCO2, "
+              f"arquivado em {arquivado.arquivado_em:%Y-%m-%d}")
+
+@app.cli.command('enfileirar-tarefa')
+@click.argument('tipo')
+@click.option('--evento', help='Nome do evento')
+@click.option('--de', 'id_inicio', type=int, help='Primeiro id de resposta')
+@click.option('--ate', 'id_fim', type=int, help='Último id de resposta')
+def enfileirar_tarefa_cli(tipo, evento, id_inicio, id_fim):
+    """Enfileira uma tarefa de manutenção (recalcular_emissoes, reavaliar_respostas, regerar_pdfs, reconstruir_agregados)"""
+    try:
+        tarefa = enfileirar_tarefa(tipo, {'evento': evento, 'de': id_inicio, 'ate': id_fim})
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    print(f"✅ Tarefa {tarefa.id} ({tipo}) enfileirada; rode `flask worker-tarefas` para executá-la")
+
+@app.cli.command('listar-tarefas')
+@click.option('--situacao', help='Só as tarefas nesta situação')
+def listar_tarefas(situacao):
+    """Tarefas mais recentes, com progresso e vazão"""
+    consulta = Tarefa.query
+    if situacao:
+        consulta = consulta.filter(Tarefa.situacao == situacao)
+    for tarefa in reversed(consulta.order_by(Tarefa.id.desc()).limit(50).all()):
+        dados = tarefa.to_dict()
+        progresso = f"{tarefa.processados}/{tarefa.total if tarefa.total is not None else '?'}"
+        vazao = f", {dados['itens_por_segundo']} itens/s" if dados['itens_por_segundo'] else ""
+        eta = f", faltam ~{dados['eta_segundos']:.0f}s" if tarefa.situacao == 'executando' and dados['eta_segundos'] else ""
+        erro = f" — {tarefa.erro}" if tarefa.erro else ""
+        print(f"{tarefa.id:>5} {tarefa.tipo:<22} {tarefa.situacao:<11} {progresso}{vazao}{eta}{erro}")
+
+@app.cli.command('cancelar-tarefa')
+@click.argument('tarefa_id', type=int)
+def cancelar_tarefa_cli(tarefa_id):
+    """Cancela uma tarefa pendente, ou pede ao worker que pare uma em execução ao fim do lote"""
+    try:
+        tarefa = cancelar_tarefa(tarefa_id)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    print(f"✅ Tarefa {tarefa_id}: {'cancelamento pedido ao worker' if tarefa.situacao == 'executando' else tarefa.situacao}")
+
+@app.cli.command('retomar-tarefa')
+@click.argument('tarefa_id', type=int)
+def retomar_tarefa_cli(tarefa_id):
+    """Devolve à fila uma tarefa que falhou ou foi cancelada; ela continua do checkpoint"""
+    try:
+        tarefa = retomar_tarefa(tarefa_id)
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    print(f"✅ Tarefa {tarefa_id} de volta à fila ({tarefa.processados} itens já processados)")
+
+@app.cli.command('worker-tarefas')
+@click.option('--ate-esvaziar', is_flag=True, help='Sai quando não houver mais tarefas na fila')
+def worker_tarefas(ate_esvaziar):
+    """Processo que executa as tarefas da fila; vários podem rodar juntos, cada tarefa vai para um só"""
+    import signal
+
+    # SIGTERM (systemd, supervisor) encerra como Ctrl+C: a tarefa em curso volta para a fila
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"👷 Worker de tarefas {identificacao_worker()} aguardando tarefas")
+    laco_worker_tarefas(ate_esvaziar)
+
+def _processo_benchmark_sqlite(modo, arquivo, threads, respostas, saida):
+    """Um 'worker do gunicorn' do benchmark: várias threads gravando e uma lendo"""
+    engine = create_engine(f"sqlite:///{arquivo}")
+    if modo == 'wal':
+        event.listen(engine, 'connect', configurar_conexao_sqlite)
+        escritor = EscritorSQLite(lambda: engine, lambda: arquivo + '.escrita')
+
+    campos = processar_formulario({
+        'pais_origem': 'Brasil', 'email': 'benchmark@exemplo.com', 'tipo_participante': 'Velejador(a)',
+        'transporte_cidade': 'carro', 'distancia_cidade': '120', 'transporte_local': 'carro',
+        'distancia_local': '10', 'dias_evento': '3', 'gasto_alimentacao': '80',
+    })
+    latencias, erros, leituras = [], [], [0]
+    parar = threading.Event()
+
+    def gravar(i):
+        # Um email por gravação: com o mesmo email a deduplicação transformaria tudo em atualizações
+        campos_gravacao = dict(campos, email=f"benchmark-{os.getpid()}-{i}@exemplo.com")
+        inicio = time.perf_counter()
+        try:
+            if modo == 'wal':
+                escritor.executar([(None, campos_gravacao)])
+            else:
+                with Session(engine) as sessao:
+                    sessao.add(RespostaEmissao(**campos_gravacao))
+                    sessao.commit()
+            latencias.append(time.perf_counter() - inicio)
+        except Exception as e:
+            erros.append(type(e).__name__)
+
+    def ler():
+        while not parar.is_set():
+            with Session(engine) as sessao:
+                sessao.query(func.count(RespostaEmissao.id), func.sum(RespostaEmissao.emissao_total)).one()
+            leituras[0] += 1
+
+    leitor = threading.Thread(target=ler, daemon=True)
+    leitor.start()
+    with app.app_context(), ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(gravar, range(respostas)))
+    parar.set()
+    leitor.join()
+    saida.put((latencias, erros, leituras[0]))
+
+@app.cli.command('benchmark-sqlite')
+@click.option('--processos', default=4, help='Workers simulados')
+@click.option('--threads', default=8, help='Requisições simultâneas por worker')
+@click.option('--respostas', default=200, help='Inserções por worker')
+def benchmark_sqlite(processos, threads, respostas):
+    """Compara o SQLite atual (journal padrão, um commit por requisição) com WAL + escritor único"""
+    import multiprocessing
+    import tempfile
+
+    contexto = multiprocessing.get_context('fork')
+    for modo in ('atual', 'wal'):
+        with tempfile.TemporaryDirectory() as pasta:
+            arquivo = os.path.join(pasta, 'benchmark.db')
+            engine = create_engine(f"sqlite:///{arquivo}")
+            db.metadata.create_all(engine, tables=[RespostaEmissao.__table__, AlteracaoResposta.__table__,
+                                                   Evento.__table__])
+            engine.dispose()
+
+            saida = contexto.Queue()
+            inicio = time.perf_counter()
+            filhos = [contexto.Process(target=_processo_benchmark_sqlite,
+                                       args=(modo, arquivo, threads, respostas, saida))
+                      for _ in range(processos)]
+            for filho in filhos:
+                filho.start()
+            resultados = [saida.get() for _ in filhos]
+            for filho in filhos:
+                filho.join()
+            duracao = time.perf_counter() - inicio
+
+        latencias = sorted(l for r in resultados for l in r[0])
+        erros = [e for r in resultados for e in r[1]]
+        leituras = sum(r[2] for r in resultados)
+        p50 = latencias[len(latencias) // 2] * 1000 if latencias else 0
+        p95 = latencias[int(len(latencias) * 0.95)] * 1000 if latencias else 0
+        print(f"{modo:>5}: {len(latencias)} gravações em {duracao:.2f}s "
+              f"({len(latencias) / duracao:.0f}/s), p50 {p50:.1f} ms, p95 {p95:.1f} ms, "
+              f"{len(erros)} erros, {leituras} leituras em paralelo")
+
+@app.cli.command('benchmark-snapshot')
+@click.option('--respostas', default=200000, help='Respostas sintéticas no SQLite temporário')
+@click.option('--acrescimos', default=1000, help='Respostas novas na atualização incremental')
+def benchmark_snapshot(respostas, acrescimos):
+    """Leituras analíticas: objetos do ORM × GROUP BY no banco × snapshot colunar em memória"""
+    import tempfile
+    import tracemalloc
+
+    def medir(funcao):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        return resultado, (time.perf_counter() - inicio) * 1000
+
+    with tempfile.TemporaryDirectory() as pasta:
+        engine = create_engine(f"sqlite:///{os.path.join(pasta, 'snapshot.db')}")
+        try:
+            db.metadata.create_all(engine, tables=[RespostaEmissao.__table__])
+            semear_respostas_sinteticas(engine, respostas)
+            with Session(engine) as sessao:
+                amostra = min(respostas, 10000)
+                tracemalloc.start()
+                objetos = sessao.query(RespostaEmissao).limit(amostra).all()
+                bytes_orm = tracemalloc.get_traced_memory()[0] / amostra
+                tracemalloc.stop()
+                del objetos
+                sessao.expunge_all()
+                _, ms_orm = medir(lambda: sum(float(r.emissao_total) for r in sessao.query(RespostaEmissao)))
+                sessao.expunge_all()
+                no_banco, ms_banco = medir(lambda: agregar_no_banco(sessao=sessao))
+                snapshot, ms_carga = medir(lambda: _carregar_snapshot(sessao, 0))
+                no_snapshot, ms_snapshot = medir(lambda: agregar_colunas(
+                    snapshot.selecionar(campos=CAMPOS_AGREGADOS)))
+                _, ms_cenario = medir(lambda: comparar_cenario(
+                    colunas_cenario(snapshot.selecionar(campos=CAMPOS_CENARIO)), CENARIOS_PADRAO[0][1]))
+
+                ultimo_id = int(snapshot.coluna('id')[-1])
+                semear_respostas_sinteticas(engine, acrescimos, semente=7)
+                _, ms_incremental = medir(lambda: snapshot.aplicar(
+                    _consulta_snapshot(sessao).filter(RespostaEmissao.id > ultimo_id).all()))
+        finally:
+            engine.dispose()
+
+    print(f"📦 {respostas} respostas")
+    print(f"   objetos do ORM:          {ms_orm:8.0f} ms  (~{bytes_orm:.0f} bytes por resposta)")
+    print(f"   GROUP BY no banco:       {ms_banco:8.0f} ms")
+    print(f"   carga do snapshot:       {ms_carga:8.0f} ms  "
+          f"({snapshot.bytes_ocupados() / 2**20:.1f} MB, {snapshot.bytes_ocupados() / snapshot.tamanho:.0f} bytes por resposta)")
+    print(f"   agregados no snapshot:   {ms_snapshot:8.1f} ms")
+    print(f"   cenário no snapshot:     {ms_cenario:8.1f} ms")
+    print(f"   +{acrescimos} respostas:        {ms_incremental:8.1f} ms")
+    # O SQLite soma Numeric em ponto flutuante; o snapshot soma centésimos exatos
+    banco, memoria = _achatar_agregados(no_banco), _achatar_agregados(no_snapshot)
+    if banco.keys() != memoria.keys() or any(
+            not math.isclose(banco[chave], memoria[chave], rel_tol=1e-9, abs_tol=0.011) for chave in banco):
+        print("❌ Agregados do snapshot diferentes dos do banco")
+        raise SystemExit(1)
+    print("✅ Agregados do snapshot iguais aos do banco")
+
+def _achatar_agregados(valor, caminho=()):
+    """{caminho: número} de um dicionário de agregados, para comparar valor a valor"""
+    if isinstance(valor, dict):
+        itens = valor.items()
+    elif isinstance(valor, list):
+        itens = enumerate(valor)
+    else:
+        return {caminho: valor}
+    return {chave: numero for nome, item in itens for chave, numero in _achatar_agregados(item, caminho + (nome,)).items()}
+
+@app.cli.command('benchmark-pdf')
+@click.option('--pdfs', default=200, help='PDFs gerados em cada modo')
+def benchmark_pdf(pdfs):
+    """Tempo de CPU por PDF individual: modelo reconstruído a cada chamada × modelo reaproveitado"""
+    registro = {
+        'id': 0, 'email': 'benchmark@exemplo.com', 'pais_origem_pt': 'Brasil', 'pais_origem_en': '--Brazil',
+        'tipo_participante': 'Velejador(a)', 'transporte_cidade': 'carro', 'distancia_cidade': 120.0,
+        'custo_transporte': None, 'transporte_local': 'ônibus', 'distancia_local': 5.0, 'dias_evento': 3,
+        'custo_transporte_diario': None, 'gasto_alimentacao': None, 'gasto_equipamentos': None,
+        'gasto_botes': None, 'gasto_hospedagem': None, 'pontos_turisticos': None, 'emissao_total': 12.75,
+    }
+
+    def descartar_modelo():
+        estilos_relatorio.cache_clear()
+        estilos_tabelas_participante.cache_clear()
+        _modelo_participante_local.partes = None
+
+    for modo in ('sem modelo', 'com modelo'):
+        descartar_modelo()
+        gerar_pdf(registro)
+        inicio = time.process_time()
+        for i in range(pdfs):
+            if modo == 'sem modelo':
+                descartar_modelo()
+            gerar_pdf(dict(registro, id=i)).getvalue()
+        print(f"{modo:>10}: {(time.process_time() - inicio) / pdfs * 1000:.2f} ms de CPU por PDF")
+
+@app.cli.command('benchmark-graficos')
+@click.option('--renderizacoes', default=30, help='Renderizações de cada painel em cada modo')
+def benchmark_graficos(renderizacoes):
+    """Tempo por painel: figura reconstruída × persistente, e tempo e tamanho por formato"""
+    sorteio = np.random.default_rng(42)
+    series = {
+        'transporte_chegada': lambda: {t: int(sorteio.integers(1, 500)) for t in ('carro', 'avião', 'ônibus', 'bicicleta/a pé')},
+        'transporte_diario': lambda: {t: int(sorteio.integers(1, 500)) for t in ('carro', 'ônibus', 'bicicleta/a pé')},
+        'emissoes_transporte': lambda: {t: float(sorteio.uniform(1, 9000)) for t in ('carro', 'avião', 'ônibus')},
+        'economico': lambda: {c: float(sorteio.uniform(10, 50000)) for c in NOMES_CATEGORIAS_GASTOS},
+    }
+    for nome, (_, criar) in PAINEIS.items():
+        dados = [series[nome]() for _ in range(renderizacoes)]
+        tempos = {}
+        for modo in ('reconstruída', 'persistente'):
+            persistente = criar()
+            persistente.renderizar(dados[0])
+            inicio = time.perf_counter()
+            for serie in dados:
+                renderizador = persistente if modo == 'persistente' else criar()
+                renderizador.renderizar(serie)
+            tempos[modo] = (time.perf_counter() - inicio) / renderizacoes * 1000
+        print(f"{nome:>20}: reconstruída {tempos['reconstruída']:.1f} ms, persistente "
+              f"{tempos['persistente']:.1f} ms ({1 - tempos['persistente'] / tempos['reconstruída']:.0%} menos)")
+
+    # Por formato, sempre com a figura persistente; o PNG de referência é o antigo (RGBA, dpi 100)
+    print("\nTempo e tamanho por formato (bytes transferidos: gzip para o SVG, o PNG não comprime)")
+    formatos = [
+        ('png original', lambda r, serie: _png_sem_paleta(r, serie)),
+        (f'png {LARGURA_GRAFICO_PADRAO}', lambda r, serie: r.renderizar(serie, 'png', LARGURA_GRAFICO_PADRAO)),
+        (f'png {LARGURAS_GRAFICO[1]}', lambda r, serie: r.renderizar(serie, 'png', LARGURAS_GRAFICO[1])),
+        ('svg', lambda r, serie: gzip.compress(r.renderizar(serie, 'svg'), compresslevel=9)),
+        ('pdf vetor', lambda r, serie: _pdf_com_desenho(r.desenho_vetorial(serie, 14*cm))),
+    ]
+    for nome, (_, criar) in PAINEIS.items():
+        dados = [series[nome]() for _ in range(renderizacoes)]
+        renderizador = criar()
+        renderizador.renderizar(dados[0])
+        medidas = []
+        for formato, gerar in formatos:
+            inicio = time.perf_counter()
+            tamanhos = [len(gerar(renderizador, serie)) for serie in dados]
+            medidas.append(f"{formato} {(time.perf_counter() - inicio) / renderizacoes * 1000:.1f} ms "
+                           f"{sum(tamanhos) / len(tamanhos) / 1024:.1f} KB")
+        print(f"{nome:>20}: " + ", ".join(medidas))
+
+def _png_sem_paleta(renderizador, serie):
+    renderizador.atualizar(serie)
+    buffer = BytesIO()
+    renderizador.fig.savefig(buffer, format='png', bbox_inches='tight', dpi=100,
+                             facecolor='white', edgecolor='none')
+    return buffer.getvalue()
+
+def _pdf_com_desenho(desenho):
+    # PDF de uma página só com o desenho, comprimido como os relatórios
+    from reportlab.graphics import renderPDF
+    return renderPDF.drawToString(desenho)
+
 if __name__ == '__main__':
     init_database()
     print("🚀 Servidor iniciando em http://127.0.0.1:5000")
     app.run(debug=True)
-
-
-
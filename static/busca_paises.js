@@ -0,0 +1,110 @@
+// Busca de país por prefixo, sem diferenciar acentos e maiúsculas.
+// A lista compacta vem de /paises.json (em cache) e o índice é um array ordenado de chaves.
+(function () {
+    var LIMITE = 10;
+
+    function normalizar(texto) {
+        return texto.normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase()
+            .replace(/[^a-z0-9]+/g, ' ').trim();
+    }
+
+    function montarIndice(paises) {
+        var entradas = [];
+        paises.forEach(function (pais, i) {
+            [pais[0], pais[1]].concat(pais[2]).forEach(function (nome, posicaoNome) {
+                var palavras = normalizar(nome).split(' ');
+                for (var j = 0; j < palavras.length; j++) {
+                    // 0: início do nome em PT, 1: início de outro nome, 2: palavra do meio
+                    var prioridade = j ? 2 : (posicaoNome === 0 ? 0 : 1);
+                    entradas.push([palavras.slice(j).join(' '), prioridade, i]);
+                }
+            });
+        });
+        entradas.sort(function (a, b) { return a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : a[1] - b[1]; });
+        return entradas;
+    }
+
+    function buscar(indice, paises, texto) {
+        var prefixo = normalizar(texto);
+        if (!prefixo) {
+            return [];
+        }
+        var baixo = 0, alto = indice.length;
+        while (baixo < alto) {
+            var meio = (baixo + alto) >> 1;
+            if (indice[meio][0] < prefixo) { baixo = meio + 1; } else { alto = meio; }
+        }
+        var melhores = {};
+        for (var k = baixo; k < indice.length && indice[k][0].lastIndexOf(prefixo, 0) === 0; k++) {
+            var i = indice[k][2];
+            if (!(i in melhores) || indice[k][1] < melhores[i]) {
+                melhores[i] = indice[k][1];
+            }
+        }
+        return Object.keys(melhores).map(Number).sort(function (a, b) {
+            return melhores[a] - melhores[b] || (normalizar(paises[a][0]) < normalizar(paises[b][0]) ? -1 : 1);
+        }).slice(0, LIMITE).map(function (i) { return paises[i]; });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        var bloco = document.querySelector('.busca-pais');
+        var campo = document.getElementById('pais_origem');
+        var lista = document.getElementById('pais_sugestoes');
+        if (!bloco || !campo || !lista) {
+            return;
+        }
+        var paises = [], indice = [], ativa = -1;
+
+        fetch(bloco.dataset.url).then(function (r) { return r.json(); }).then(function (dados) {
+            paises = dados;
+            indice = montarIndice(paises);
+        });
+
+        function escolher(pais) {
+            campo.value = pais[0];
+            lista.hidden = true;
+            campo.dispatchEvent(new Event('change'));
+        }
+
+        function mostrar() {
+            var encontrados = buscar(indice, paises, campo.value);
+            lista.innerHTML = '';
+            ativa = -1;
+            encontrados.forEach(function (pais) {
+                var item = document.createElement('li');
+                item.textContent = pais[0];
+                var en = document.createElement('span');
+                en.className = 'en';
+                en.textContent = pais[1];
+                item.appendChild(en);
+                item.addEventListener('mousedown', function (e) {
+                    e.preventDefault();
+                    escolher(pais);
+                });
+                lista.appendChild(item);
+            });
+            lista.hidden = !encontrados.length;
+            lista.encontrados = encontrados;
+        }
+
+        campo.addEventListener('input', mostrar);
+        campo.addEventListener('blur', function () { lista.hidden = true; });
+        campo.addEventListener('keydown', function (e) {
+            var itens = lista.children;
+            if (lista.hidden || !itens.length) {
+                return;
+            }
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                if (ativa >= 0) { itens[ativa].classList.remove('ativa'); }
+                ativa = (ativa + (e.key === 'ArrowDown' ? 1 : itens.length - 1)) % itens.length;
+                itens[ativa].classList.add('ativa');
+            } else if (e.key === 'Enter' && ativa >= 0) {
+                e.preventDefault();
+                escolher(lista.encontrados[ativa]);
+            } else if (e.key === 'Escape') {
+                lista.hidden = true;
+            }
+        });
+    });
+})();
@@ -0,0 +1,40 @@
+// Carona solidária: inscreve o participante e lista quem vem de distância parecida
+(function () {
+    document.addEventListener('DOMContentLoaded', function () {
+        var bloco = document.getElementById('carona-solidaria');
+        var botao = document.getElementById('carona-inscrever');
+        if (!bloco || !botao) {
+            return;
+        }
+        var lista = document.getElementById('carona-candidatos');
+
+        function mostrarCandidatos(corpo) {
+            lista.innerHTML = '';
+            if (!corpo.candidatos || !corpo.candidatos.length) {
+                lista.innerHTML = '<li><span class="pt">Ainda não há outros inscritos compatíveis. ' +
+                    'Volte mais tarde!</span><span class="en">No compatible participants yet. ' +
+                    'Check back later!</span></li>';
+                return;
+            }
+            corpo.candidatos.forEach(function (c) {
+                var item = document.createElement('li');
+                item.textContent = c.email + ' — ' + c.pais_origem + ', ' + c.distancia_cidade + ' km, ' +
+                    c.dias_evento + ' dia(s) · −' + c.kgco2_economizado + ' kgCO2';
+                lista.appendChild(item);
+            });
+        }
+
+        botao.addEventListener('click', function () {
+            botao.disabled = true;
+            fetch('/carona/' + bloco.dataset.resposta + '/inscrever', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({email: bloco.dataset.email})
+            }).then(function (resposta) {
+                return resposta.json();
+            }).then(mostrarCandidatos).catch(function () {
+                botao.disabled = false;
+            });
+        });
+    });
+})();
@@ -0,0 +1,76 @@
+// Distância sugerida: a partir do país (e do estado, no Brasil) e do transporte,
+// /distancia-estimada devolve a distância ida e volta até o local do evento aberto.
+// O valor só preenche o campo enquanto o participante não digitar o seu.
+(function () {
+    document.addEventListener('DOMContentLoaded', function () {
+        var pais = document.getElementById('pais_origem');
+        var grupoEstado = document.getElementById('grupo_estado_origem');
+        var estado = document.getElementById('estado_origem');
+        var transporte = document.getElementById('transporte_cidade');
+        var distancia = document.getElementById('distancia_cidade');
+        var aviso = document.getElementById('distancia_sugerida');
+        if (!pais || !estado || !transporte || !distancia) {
+            return;
+        }
+        var editadaPeloUsuario = false, ultimaConsulta = null;
+
+        function doBrasil() {
+            return /^brasil$|^brazil$/i.test(pais.value.trim());
+        }
+
+        function atualizarEstado() {
+            var mostrar = doBrasil();
+            grupoEstado.hidden = !mostrar;
+            if (!mostrar) {
+                estado.value = '';
+            }
+        }
+
+        function sugerir() {
+            atualizarEstado();
+            if (!pais.value.trim() || !transporte.value) {
+                return;
+            }
+            var consulta = '/distancia-estimada?' + new URLSearchParams({
+                pais: pais.value.trim(), estado: estado.value, transporte: transporte.value
+            });
+            if (consulta === ultimaConsulta) {
+                return;
+            }
+            ultimaConsulta = consulta;
+            fetch(consulta).then(function (r) { return r.json(); }).then(function (dados) {
+                if (consulta !== ultimaConsulta || dados.distancia_km === null) {
+                    return;
+                }
+                if (!editadaPeloUsuario) {
+                    distancia.value = dados.distancia_km;
+                }
+                if (aviso) {
+                    aviso.innerHTML = '<span class="pt">Estimativa a partir de ' + dados.origem + ': ' +
+                        dados.distancia_km + ' km</span><span class="en">Estimate from ' + dados.origem +
+                        ': ' + dados.distancia_km + ' km</span>';
+                    aviso.hidden = false;
+                }
+            }).catch(function () {
+                ultimaConsulta = null;
+            });
+        }
+
+        distancia.addEventListener('input', function () {
+            editadaPeloUsuario = distancia.value !== '';
+        });
+        pais.addEventListener('change', sugerir);
+        pais.addEventListener('blur', sugerir);
+        estado.addEventListener('change', sugerir);
+        transporte.addEventListener('change', sugerir);
+        distancia.form.addEventListener('reset', function () {
+            editadaPeloUsuario = false;
+            ultimaConsulta = null;
+            grupoEstado.hidden = true;
+            if (aviso) {
+                aviso.hidden = true;
+            }
+        });
+        atualizarEstado();
+    });
+})();
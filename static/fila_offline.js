@@ -0,0 +1,117 @@
+// Fila offline do questionário: sem conexão, a resposta fica guardada no navegador
+// e é enviada em lote para /submit-lote assim que a internet voltar.
+(function () {
+    var CHAVE_FILA = 'fila_respostas_co2';
+    var TAMANHO_LOTE = 50;
+    var enviando = false;
+
+    function novaChave() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+    }
+
+    function lerFila() {
+        try {
+            return JSON.parse(localStorage.getItem(CHAVE_FILA)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function gravarFila(fila) {
+        localStorage.setItem(CHAVE_FILA, JSON.stringify(fila));
+        mostrarAviso(fila.length);
+    }
+
+    function mostrarAviso(pendentes) {
+        var aviso = document.getElementById('aviso-fila-offline');
+        if (!aviso) {
+            return;
+        }
+        if (pendentes > 0) {
+            aviso.innerHTML = '<span class="pt">📶 Sem conexão: ' + pendentes +
+                ' resposta(s) salva(s) neste aparelho serão enviadas automaticamente.</span>' +
+                '<span class="en">No connection: ' + pendentes +
+                ' answer(s) saved on this device will be sent automatically.</span>';
+            aviso.style.display = 'block';
+        } else {
+            aviso.style.display = 'none';
+        }
+    }
+
+    function enviarFila() {
+        var fila = lerFila();
+        if (enviando || !fila.length || !navigator.onLine) {
+            return;
+        }
+        enviando = true;
+        var lote = fila.slice(0, TAMANHO_LOTE);
+
+        fetch('/submit-lote', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({respostas: lote})
+        }).then(function (resposta) {
+            return resposta.json().then(function (corpo) {
+                return {status: resposta.status, corpo: corpo};
+            });
+        }).then(function (retorno) {
+            var concluidas = {};
+            if (retorno.status === 200) {
+                retorno.corpo.resultados.forEach(function (r) { concluidas[r.chave_idempotencia] = true; });
+            } else if (retorno.status === 400 && retorno.corpo.erros) {
+                // Respostas inválidas nunca serão aceitas: saem da fila para não travar as demais
+                retorno.corpo.erros.forEach(function (e) {
+                    var item = lote[e.indice];
+                    if (item) {
+                        console.warn('Resposta descartada da fila:', e.erro);
+                        concluidas[item.chave_idempotencia] = true;
+                    }
+                });
+            }
+            gravarFila(lerFila().filter(function (item) { return !concluidas[item.chave_idempotencia]; }));
+            enviando = false;
+            if (Object.keys(concluidas).length) {
+                enviarFila();
+            }
+        }).catch(function () {
+            enviando = false;
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        var form = document.querySelector('.questionario-form');
+        var campoChave = document.getElementById('chave_idempotencia');
+        if (campoChave) {
+            campoChave.value = novaChave();
+        }
+
+        if (form) {
+            form.addEventListener('submit', function (evento) {
+                if (navigator.onLine) {
+                    return;
+                }
+                evento.preventDefault();
+                var resposta = {};
+                new FormData(form).forEach(function (valor, nome) { resposta[nome] = valor; });
+                resposta.chave_idempotencia = resposta.chave_idempotencia || novaChave();
+
+                var fila = lerFila();
+                fila.push(resposta);
+                gravarFila(fila);
+                form.reset();
+                if (campoChave) {
+                    campoChave.value = novaChave();
+                }
+                window.scrollTo(0, 0);
+            });
+        }
+
+        mostrarAviso(lerFila().length);
+        enviarFila();
+    });
+
+    window.addEventListener('online', enviarFila);
+})();
@@ -0,0 +1,63 @@
+"""Ambiente dos testes: banco SQLite e pastas de cache descartáveis, criados antes de importar o app"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+_PASTA_TESTES = tempfile.mkdtemp(prefix='testes-co2-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_PASTA_TESTES, 'testes.db')}"
+os.environ['CACHE_DIR'] = os.path.join(_PASTA_TESTES, 'cache')
+os.environ['ARQUIVO_DIR'] = os.path.join(_PASTA_TESTES, 'arquivo')
+os.environ['CONGELADOS_DIR'] = os.path.join(_PASTA_TESTES, 'congelados')
+os.environ['ADMIN_TOKEN'] = 'token-dos-testes'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as modulo_app  # noqa: E402
+
+
+def _zerar_caches():
+    # Com o banco recriado os seqs do feed recomeçam: caches de um teste valeriam no seguinte
+    shutil.rmtree(modulo_app.CACHE_DIR, ignore_errors=True)
+    modulo_app._snapshot_respostas = modulo_app.SnapshotRespostas()
+    for cache in (modulo_app._referencia_atipicos, modulo_app._paginas_prontas, modulo_app._estaticos_prontos,
+                  modulo_app._indices_caronas, modulo_app._graficos_prontos):
+        cache.clear()
+
+
+@pytest.fixture
+def app():
+    """Banco zerado a cada teste, com o esquema e as migrações aplicados"""
+    _zerar_caches()
+    with modulo_app.app.app_context():
+        modulo_app.db.session.remove()
+        modulo_app.db.drop_all()
+        modulo_app.db.create_all()
+        modulo_app.aplicar_migracoes()
+        yield modulo_app
+        modulo_app.db.session.remove()
+
+
+@pytest.fixture
+def cliente(app):
+    return app.app.test_client()
+
+
+@pytest.fixture
+def admin():
+    return {'X-Admin-Token': os.environ['ADMIN_TOKEN']}
+
+
+def formulario(i=0, **campos):
+    """Resposta válida do questionário; os campos informados substituem os padrões"""
+    dados = {
+        'pais_origem': 'Brasil', 'estado_origem': 'Rio de Janeiro', 'tipo_participante': 'Velejador(a)',
+        'email': f"participante{i}@exemplo.com",
+        'transporte_cidade': 'carro', 'distancia_cidade': '120', 'custo_transporte': '100',
+        'transporte_local': 'bicicleta/a pé', 'distancia_local': '5', 'dias_evento': '3',
+        'gasto_alimentacao': '50', 'gasto_hospedagem': '200',
+    }
+    dados.update(campos)
+    return dados
@@ -0,0 +1,27 @@
+"""Rotas de organização: só com ADMIN_TOKEN configurado e enviado no cabeçalho"""
+from conftest import formulario
+
+
+def test_sem_token_configurado_as_rotas_nao_existem(cliente, monkeypatch):
+    monkeypatch.delenv('ADMIN_TOKEN')
+    for rota in ('/admin/tarefas', '/alteracoes', '/revisao', '/admin/perfil'):
+        assert cliente.get(rota).status_code == 404
+        assert cliente.get(rota, headers={'X-Admin-Token': ''}).status_code == 404
+
+
+def test_token_so_no_cabecalho(cliente, admin):
+    assert cliente.get('/admin/tarefas').status_code == 403
+    assert cliente.get('/admin/tarefas', headers={'X-Admin-Token': 'errado'}).status_code == 403
+    assert cliente.get(f"/admin/tarefas?token={admin['X-Admin-Token']}").status_code == 403
+    assert cliente.get('/admin/tarefas', headers=admin).status_code == 200
+
+
+def test_log_de_requisicao_lenta_sem_query_string(app, cliente, admin, capsys, monkeypatch):
+    monkeypatch.setattr(app, 'REQUISICOES_LENTAS_MS', 0.001)
+    cliente.post('/submit', data=formulario(1))
+    cliente.get('/alteracoes?cursor=&email=segredo@exemplo.com', headers=admin)
+    saida = capsys.readouterr().out
+    linhas = [linha for linha in saida.splitlines() if linha.startswith('🐢')]
+    assert any('/alteracoes [alteracoes]' in linha for linha in linhas)
+    assert 'segredo@exemplo.com' not in saida
+    assert 'token' not in '\n'.join(linhas)
@@ -0,0 +1,75 @@
+"""Carona solidária: candidatos do mesmo evento e da mesma origem, lidos do primário"""
+from sqlalchemy import create_engine
+
+from conftest import formulario
+
+
+def enviar(cliente, i, **campos):
+    resposta = cliente.post('/submit-lote', json={'respostas': [
+        formulario(i, chave_idempotencia=f"carona-{i}", **campos)]})
+    assert resposta.status_code == 200, resposta.json
+    return resposta.json['resultados'][0]['id']
+
+
+def inscrever(cliente, resposta_id, i):
+    return cliente.post(f"/carona/{resposta_id}/inscrever", json={'email': f"participante{i}@exemplo.com"}).json
+
+
+def candidatos(cliente, resposta_id, i):
+    return [c['resposta_id'] for c in cliente.get(f"/carona/{resposta_id}?email=participante{i}@exemplo.com").json['candidatos']]
+
+
+def test_candidatos_so_do_mesmo_evento(app, cliente):
+    runner = app.app.test_cli_runner()
+    runner.invoke(args=['abrir-evento', 'Regata de Verão'])
+    antigo = enviar(cliente, 1)
+    inscrever(cliente, antigo, 1)
+    runner.invoke(args=['abrir-evento', 'Regata de Inverno'])
+    atual = enviar(cliente, 2)
+    vizinho = enviar(cliente, 3, distancia_cidade='130')
+    inscrever(cliente, vizinho, 3)
+
+    assert candidatos(cliente, atual, 2) == []
+    inscrever(cliente, atual, 2)
+    assert candidatos(cliente, atual, 2) == [vizinho]
+    assert candidatos(cliente, antigo, 1) == []
+
+
+def test_baldes_separam_estados(app, cliente):
+    rio = enviar(cliente, 1)
+    outro_rio = enviar(cliente, 2, distancia_cidade='125')
+    bahia = enviar(cliente, 3, estado_origem='Bahia', distancia_cidade='125')
+    for resposta_id, i in ((rio, 1), (outro_rio, 2), (bahia, 3)):
+        inscrever(cliente, resposta_id, i)
+    assert candidatos(cliente, rio, 1) == [outro_rio]
+    assert candidatos(cliente, bahia, 3) == []
+
+
+def test_inscricao_visivel_mesmo_com_replica_atrasada(app, cliente, monkeypatch, tmp_path):
+    # Réplica "parada" antes de qualquer resposta: só tem o esquema
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    app.db.metadata.create_all(replica)
+    monkeypatch.setattr(app, 'engine_leitura', lambda: replica)
+
+    motorista = enviar(cliente, 1)
+    inscrever(cliente, motorista, 1)
+    passageiro = enviar(cliente, 2, distancia_cidade='110')
+    corpo = inscrever(cliente, passageiro, 2)
+    assert corpo['transporte_compativel'] is True
+    assert [c['resposta_id'] for c in corpo['candidatos']] == [motorista]
+
+
+def test_economia_do_evento(app, cliente, admin):
+    runner = app.app.test_cli_runner()
+    runner.invoke(args=['abrir-evento', 'Regata de Verão'])
+    for i in range(1, 3):
+        inscrever(cliente, enviar(cliente, i), i)
+    runner.invoke(args=['abrir-evento', 'Regata de Inverno'])
+    for i in range(3, 7):
+        inscrever(cliente, enviar(cliente, i), i)
+
+    atual = cliente.get('/carona/economia', headers=admin).json
+    assert atual['inscritos'] == 4 and atual['carros_evitados'] == 3
+    anterior = cliente.get('/carona/economia?evento=Regata de Verão', headers=admin).json
+    assert anterior['inscritos'] == 2 and anterior['carros_evitados'] == 1
+    assert cliente.get('/carona/economia?evento=Inexistente', headers=admin).status_code == 404
@@ -0,0 +1,48 @@
+"""Reenvios: a mesma chave de idempotência e o mesmo email no mesmo evento não duplicam respostas"""
+from conftest import formulario
+
+
+def enviar(cliente, *respostas):
+    resposta = cliente.post('/submit-lote', json={'respostas': list(respostas)})
+    assert resposta.status_code == 200, resposta.json
+    return [(item['id'], item['status']) for item in resposta.json['resultados']]
+
+
+def test_mesma_chave_devolve_a_mesma_resposta(app, cliente):
+    [(primeira, status)] = enviar(cliente, formulario(1, chave_idempotencia='a'))
+    assert status == 'criado'
+    # Reenvio da fila offline, inclusive repetido dentro do mesmo lote
+    assert enviar(cliente, formulario(1, chave_idempotencia='a'), formulario(1, chave_idempotencia='a')) == [
+        (primeira, 'duplicado'), (primeira, 'duplicado')]
+    assert app.RespostaEmissao.query.count() == 1
+    assert app.ChaveIdempotencia.query.count() == 1
+
+
+def test_mesmo_email_no_evento_atualiza_no_lugar(app, cliente):
+    app.app.test_cli_runner().invoke(args=['abrir-evento', 'Regata de Verão'])
+    [(primeira, _)] = enviar(cliente, formulario(1, chave_idempotencia='a'))
+    # Outra chave (outro aparelho), email com outra caixa: é a mesma pessoa no mesmo evento
+    [(segunda, status)] = enviar(cliente, formulario(1, chave_idempotencia='b', email='Participante1@Exemplo.com ',
+                                                     distancia_cidade='300'))
+    assert (segunda, status) == (primeira, 'atualizado')
+    resposta = app.db.session.get(app.RespostaEmissao, primeira)
+    assert float(resposta.distancia_cidade) == 300
+    assert app.RespostaEmissao.query.count() == 1
+    # A chave nova também passa a apontar para a resposta atualizada
+    assert enviar(cliente, formulario(1, chave_idempotencia='b')) == [(primeira, 'duplicado')]
+
+
+def test_modo_manter_preserva_a_primeira(app, cliente):
+    app.app.test_cli_runner().invoke(args=['abrir-evento', 'Regata de Verão', '--deduplicacao', 'manter'])
+    [(primeira, _)] = enviar(cliente, formulario(1, chave_idempotencia='a'))
+    assert enviar(cliente, formulario(1, chave_idempotencia='b', distancia_cidade='300')) == [(primeira, 'duplicado')]
+    assert float(app.db.session.get(app.RespostaEmissao, primeira).distancia_cidade) == 120
+
+
+def test_mesmo_email_em_eventos_diferentes(app, cliente):
+    runner = app.app.test_cli_runner()
+    runner.invoke(args=['abrir-evento', 'Regata de Verão'])
+    [(verao, _)] = enviar(cliente, formulario(1, chave_idempotencia='a'))
+    runner.invoke(args=['abrir-evento', 'Regata de Inverno'])
+    [(inverno, status)] = enviar(cliente, formulario(1, chave_idempotencia='b'))
+    assert status == 'criado' and inverno != verao
@@ -0,0 +1,80 @@
+"""Feed de alterações retomado pelo cursor e snapshot colunar atualizado pelo feed"""
+import json
+import uuid
+
+import numpy as np
+
+from conftest import formulario
+
+
+def enviar(cliente, *indices, **campos):
+    resposta = cliente.post('/submit-lote', json={'respostas': [
+        formulario(i, chave_idempotencia=uuid.uuid4().hex, **campos) for i in indices]})
+    assert resposta.status_code == 200, resposta.json
+    return [item['id'] for item in resposta.json['resultados']]
+
+
+def ler_feed(cliente, admin, cursor='', limite=2):
+    """Lê o feed até o fim, página por página; devolve [(operacao, id)] e o cursor para retomar"""
+    lidas = []
+    while True:
+        resposta = cliente.get(f"/alteracoes?cursor={cursor}&limite={limite}", headers=admin)
+        assert resposta.status_code == 200
+        lidas += [(linha['operacao'], linha['id']) for linha in map(json.loads, resposta.get_data(as_text=True).splitlines())]
+        cursor = resposta.headers['X-Proximo-Cursor']
+        if resposta.headers['X-Mais-Alteracoes'] == '0':
+            return lidas, cursor
+
+
+def remover(app, resposta_id):
+    app.db.session.delete(app.db.session.get(app.RespostaEmissao, resposta_id))
+    app.db.session.commit()
+
+
+def test_feed_retoma_do_cursor(app, cliente, admin):
+    app.app.test_cli_runner().invoke(args=['abrir-evento', 'Regata de Verão'])
+    ids = enviar(cliente, *range(5))
+    lidas, cursor = ler_feed(cliente, admin)
+    assert lidas == [('insert', i) for i in ids]
+    # Nada novo: o mesmo cursor volta vazio e não anda
+    assert ler_feed(cliente, admin, cursor) == ([], cursor)
+
+    enviar(cliente, 1, distancia_cidade='300')
+    remover(app, ids[3])
+    [novo] = enviar(cliente, 7)
+    lidas, _ = ler_feed(cliente, admin, cursor)
+    assert lidas == [('update', ids[1]), ('delete', ids[3]), ('insert', novo)]
+
+    # Cada linha traz o próprio cursor: retomar dela não repete a linha
+    primeira = json.loads(cliente.get(f"/alteracoes?cursor={cursor}", headers=admin).get_data(as_text=True).splitlines()[0])
+    assert ler_feed(cliente, admin, primeira['cursor'])[0] == lidas[1:]
+    assert cliente.get('/alteracoes?cursor=invalido', headers=admin).status_code == 400
+
+
+def colunas_comparaveis(app, colunas):
+    """Categóricas pelos rótulos: os códigos dependem da ordem em que as categorias apareceram"""
+    return {nome: app.rotulos_snapshot(colunas, nome[len('codigo__'):]) if nome.startswith('codigo__') else valores
+            for nome, valores in colunas.items() if nome != 'categorias'}
+
+
+def test_snapshot_incremental_igual_a_recarga(app, cliente, admin):
+    app.app.test_cli_runner().invoke(args=['abrir-evento', 'Regata de Verão'])
+    ids = enviar(cliente, *range(6))
+    app.snapshot_respostas(situacoes=None)
+    carregado = app._snapshot_respostas
+
+    enviar(cliente, 2, distancia_cidade='300', pais_origem='Portugal', gasto_hospedagem='')
+    remover(app, ids[4])
+    cliente.post(f"/revisao/{ids[0]}", json={'acao': 'rejeitar'}, headers=admin)
+    enviar(cliente, 8, 9, tipo_participante='Outro')
+    incremental = app.snapshot_respostas(situacoes=None)
+
+    with app.sessao_leitura() as sessao:
+        recarga = app._carregar_snapshot(sessao, app._snapshot_respostas.geracao).selecionar(situacoes=None)
+    esperado, obtido = colunas_comparaveis(app, recarga), colunas_comparaveis(app, incremental)
+    assert esperado.keys() == obtido.keys()
+    for nome in esperado:
+        np.testing.assert_array_equal(obtido[nome], esperado[nome], err_msg=nome)
+    assert len(obtido['id']) == 7
+    # O snapshot do processo não foi recarregado: só as alterações do feed foram aplicadas
+    assert app._snapshot_respostas is carregado
@@ -0,0 +1,45 @@
+"""PDF do participante montado a partir das partes fixas reaproveitadas (ParagrafoFixo)"""
+import re
+from io import BytesIO
+
+from reportlab.platypus import Spacer
+
+import app as modulo_app
+
+
+def registro(email='participante@exemplo.com'):
+    return {
+        'id': 1, 'email': email, 'pais_origem_pt': 'Brasil', 'pais_origem_en': 'Brazil',
+        'tipo_participante': 'Velejador(a)', 'transporte_cidade': 'carro', 'distancia_cidade': 120.0,
+        'transporte_local': 'bicicleta/a pé', 'distancia_local': 5.0, 'dias_evento': 3,
+        'emissao_total': 11.74,
+    }
+
+
+def test_paragrafo_fixo_quebra_entre_paginas():
+    estilos = modulo_app.estilos_relatorio()
+    paragrafo = modulo_app.ParagrafoFixo("texto longo " * 400, estilos['normal'])
+    metades = paragrafo.split(400, 30)
+    assert len(metades) == 2
+    assert all(isinstance(metade, modulo_app.ParagrafoFixo) for metade in metades)
+
+    # A mesma cópia do modelo atravessa a quebra de página num documento de verdade
+    buffer = BytesIO()
+    documento = modulo_app.documento_pdf(buffer, "teste")
+    documento.build([Spacer(1, 600), paragrafo])
+    assert int(re.search(rb'/Count (\d+)', buffer.getvalue()).group(1)) >= 2
+
+
+def test_partes_fixas_reaproveitadas_entre_pdfs(monkeypatch):
+    # Falhar no PDF detalhado cairia no simples; aqui isso tem de ser um erro
+    def sem_fallback(registro):
+        raise AssertionError("gerar_pdf caiu no PDF simples")
+    monkeypatch.setattr(modulo_app, 'gerar_pdf_simples', sem_fallback)
+
+    primeiro = modulo_app.gerar_pdf(registro('primeiro@exemplo.com')).getvalue()
+    segundo = modulo_app.gerar_pdf(registro('segundo@exemplo.com')).getvalue()
+    assert primeiro.startswith(b'%PDF') and segundo.startswith(b'%PDF')
+    assert primeiro != segundo
+    # As partes fixas guardadas na thread não são consumidas pelo build
+    terceiro = modulo_app.gerar_pdf(registro('primeiro@exemplo.com')).getvalue()
+    assert len(terceiro) == len(primeiro)
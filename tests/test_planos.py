@@ -0,0 +1,35 @@
+"""Consultas críticas não podem voltar a varrer respostas_emissao inteira
+
+Roda contra um SQLite temporário semeado com respostas sintéticas. Para conferir
+com PostgreSQL, aponte PLANOS_BANCO_URL para um banco descartável.
+"""
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def engine(tmp_path_factory):
+    url = os.environ.get('PLANOS_BANCO_URL') or f"sqlite:///{tmp_path_factory.mktemp('planos') / 'planos.db'}"
+    engine = create_engine(app._normalizar_url_banco(url))
+    app.preparar_banco_planos(engine, respostas=2000)
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize('nome', list(app.CONSULTAS_CRITICAS))
+def test_consulta_critica_usa_indice(engine, nome):
+    linhas, varre_respostas = app.plano_consulta_critica(engine, nome)
+    assert not varre_respostas, f"{nome} varre respostas_emissao:\n" + "\n".join(linhas)
+
+
+def test_deteccao_de_varredura(engine):
+    # Sem filtro a tabela é lida inteira: garante que a verificação enxerga a varredura
+    _, varridas = app.plano_consulta(engine, "SELECT * FROM respostas_emissao")
+    assert app.RespostaEmissao.__tablename__ in varridas
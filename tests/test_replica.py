@@ -0,0 +1,27 @@
+"""status-replica mede a réplica na hora, sem depender da thread de verificação do processo"""
+from sqlalchemy import create_engine
+
+
+def test_status_replica_mede_na_hora(app, monkeypatch, tmp_path):
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setitem(app.db.engines, 'replica', replica)
+    monkeypatch.setattr(app, '_estado_replica', dict(app._estado_replica))
+
+    saida = app.app.test_cli_runner().invoke(args=['status-replica']).output
+    assert f"Leituras: sqlite:///{tmp_path / 'replica.db'}" in saida
+    assert "Atraso da réplica: 0.0s" in saida
+
+
+def test_status_replica_atrasada_le_do_primario(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.db.engines, 'replica', create_engine(f"sqlite:///{tmp_path / 'replica.db'}"))
+    monkeypatch.setattr(app, '_estado_replica', dict(app._estado_replica))
+    monkeypatch.setattr(app, '_medir_atraso_replica', lambda engine: app.REPLICA_ATRASO_MAXIMO + 30)
+
+    saida = app.app.test_cli_runner().invoke(args=['status-replica']).output
+    assert f"Leituras: {app.db.engine.url}" in saida
+    assert f"Atraso da réplica: {app.REPLICA_ATRASO_MAXIMO + 30:.1f}s" in saida
+
+
+def test_status_sem_replica(app):
+    saida = app.app.test_cli_runner().invoke(args=['status-replica']).output
+    assert "Leituras: primário" in saida
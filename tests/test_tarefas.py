@@ -0,0 +1,91 @@
+"""Fila de tarefas: reserva com lease, checkpoint por lote e retomada depois de falha ou cancelamento"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy.orm import Session
+
+from conftest import formulario
+
+
+@pytest.fixture
+def fila(app, cliente, monkeypatch):
+    """Cinco respostas com a emissão desatualizada e lotes de duas"""
+    monkeypatch.setattr(app, 'TAREFAS_LOTE', 2)
+    monkeypatch.setattr(app, 'TAREFAS_PAUSA_MS', 0)
+    monkeypatch.setattr(app, 'TAREFAS_ESPERA_FALHA_SEGUNDOS', 0)
+    cliente.post('/submit-lote', json={'respostas': [formulario(i, chave_idempotencia=str(i)) for i in range(5)]})
+    app.RespostaEmissao.query.update({'emissao_total': Decimal('0')})
+    app.db.session.commit()
+    return app
+
+
+def emissoes_zeradas(app):
+    app.db.session.expire_all()
+    return app.RespostaEmissao.query.filter(app.RespostaEmissao.emissao_total == 0).count()
+
+
+def test_falha_retoma_do_ultimo_lote_confirmado(fila, monkeypatch):
+    contar, executar_lote = fila.TIPOS_TAREFA['recalcular_emissoes']
+    lotes = []
+
+    def falha_no_segundo_lote(sessao, parametros, checkpoint):
+        lotes.append(checkpoint)
+        if len(lotes) == 2:
+            raise RuntimeError("queda no meio da tarefa")
+        return executar_lote(sessao, parametros, checkpoint)
+    monkeypatch.setitem(fila.TIPOS_TAREFA, 'recalcular_emissoes', (contar, falha_no_segundo_lote))
+
+    tarefa_id = fila.enfileirar_tarefa('recalcular_emissoes').id
+    sessao = Session(bind=fila.db.engine)
+    assert fila.executar_tarefa(sessao, fila.reservar_tarefa(sessao, 'w1'), 'w1') == 'pendente'
+    # O primeiro lote ficou gravado junto com o checkpoint; o segundo foi desfeito
+    assert emissoes_zeradas(fila) == 3
+    tarefa = fila.db.session.get(fila.Tarefa, tarefa_id)
+    assert (tarefa.falhas, tarefa.processados) == (1, 2)
+
+    assert fila.executar_tarefa(sessao, fila.reservar_tarefa(sessao, 'w2'), 'w2') == 'concluida'
+    assert lotes[2] == lotes[1] == {'ultimo_id': 2, 'alteradas': 2}
+    fila.db.session.expire_all()
+    tarefa = fila.db.session.get(fila.Tarefa, tarefa_id)
+    assert (tarefa.situacao, tarefa.processados, tarefa.total) == ('concluida', 5, 5)
+    assert emissoes_zeradas(fila) == 0
+    sessao.close()
+
+
+def test_lease_vencido_passa_a_tarefa_para_outro_worker(fila):
+    tarefa_id = fila.enfileirar_tarefa('recalcular_emissoes').id
+    primeiro, segundo = Session(bind=fila.db.engine), Session(bind=fila.db.engine)
+    tarefa = fila.reservar_tarefa(primeiro, 'w1')
+    assert tarefa.situacao == 'executando'
+    assert fila.reservar_tarefa(segundo, 'w2') is None
+
+    # w1 parou de dar sinal além do lease: w2 assume e w1 não grava mais nada
+    fila.Tarefa.query.filter_by(id=tarefa_id).update({'batimento_em': datetime.utcnow() - timedelta(
+        seconds=fila.TAREFAS_LEASE_SEGUNDOS + 1)})
+    fila.db.session.commit()
+    assert fila.reservar_tarefa(segundo, 'w2').worker == 'w2'
+    assert fila.executar_tarefa(primeiro, tarefa, 'w1') == 'executando'
+    assert emissoes_zeradas(fila) == 5
+    assert fila.executar_tarefa(segundo, fila.db.session.get(fila.Tarefa, tarefa_id), 'w2') == 'concluida'
+    assert emissoes_zeradas(fila) == 0
+    primeiro.close()
+    segundo.close()
+
+
+def test_cancelada_e_retomada(fila):
+    tarefa_id = fila.enfileirar_tarefa('recalcular_emissoes').id
+    assert fila.cancelar_tarefa(tarefa_id).situacao == 'cancelada'
+    sessao = Session(bind=fila.db.engine)
+    assert fila.reservar_tarefa(sessao, 'w1') is None
+    assert fila.retomar_tarefa(tarefa_id).situacao == 'pendente'
+    with pytest.raises(ValueError):
+        fila.retomar_tarefa(tarefa_id)
+    fila.laco_worker_tarefas(ate_esvaziar=True)
+    assert emissoes_zeradas(fila) == 0
+    sessao.close()
+
+
+def test_tipo_desconhecido(fila):
+    with pytest.raises(ValueError, match='Tipo de tarefa desconhecido'):
+        fila.enfileirar_tarefa('apagar_tudo')
@@ -0,0 +1,73 @@
+"""Validação do questionário: valores fora das listas são recusados, nunca repassados aos relatórios"""
+from io import BytesIO
+
+import pytest
+
+from conftest import formulario
+
+
+@pytest.mark.parametrize('campos, mensagem', [
+    ({'pais_origem': 'Atlântida'}, 'País de origem desconhecido'),
+    ({'pais_origem': '<b Atlântida'}, 'País de origem desconhecido'),
+    ({'tipo_participante': 'Torcedor(a)'}, 'Tipo de participante desconhecido'),
+    ({'tipo_participante': ''}, 'tipo de participante'),
+])
+def test_valores_fora_das_listas_sao_recusados(app, campos, mensagem):
+    with pytest.raises(ValueError, match=mensagem):
+        app.processar_formulario(formulario(1, **campos))
+
+
+def test_pais_aceita_nome_em_ingles(app):
+    assert app.processar_formulario(formulario(1, pais_origem='Brazil'))['pais_origem_pt'] == 'Brasil'
+
+
+def test_lote_com_pais_desconhecido_nao_grava(app, cliente):
+    resposta = cliente.post('/submit-lote', json={'respostas': [formulario(1), formulario(2, pais_origem='Atlântida')]})
+    assert resposta.status_code == 400
+    assert app.RespostaEmissao.query.count() == 0
+
+
+def test_relatorio_do_evento_escapa_textos_gravados(app):
+    # Linhas antigas ou importadas podem ter texto livre: ele não pode virar marcação do Paragraph
+    dados = {
+        'paises': {'<b Atlântida': (1, 10.0)},
+        'emissoes_tipo_participante': {'Outro <i>': (1, 10.0)},
+    }
+    elementos = app._secao_paises_evento(dados) + app._secao_tipos_evento(dados)
+    buffer = BytesIO()
+    app.documento_pdf(buffer, "teste").build(elementos)
+    assert buffer.getvalue().startswith(b'%PDF')
+
+
+def test_lote_e_tudo_ou_nada(app, cliente):
+    resposta = cliente.post('/submit-lote', json={'respostas': [
+        formulario(1, chave_idempotencia='a'),
+        formulario(2, chave_idempotencia='b', distancia_cidade='muito'),
+        formulario(3),
+    ]})
+    assert resposta.status_code == 400
+    assert [(erro['indice'], erro['chave_idempotencia']) for erro in resposta.json['erros']] == [(1, 'b'), (2, None)]
+    assert app.RespostaEmissao.query.count() == 0
+    assert app.ChaveIdempotencia.query.count() == 0
+    assert app.AlteracaoResposta.query.count() == 0
+
+
+def test_valor_atipico_fica_em_quarentena(app, cliente, admin, monkeypatch):
+    monkeypatch.setattr(app, 'ATIPICOS_MINIMO_AMOSTRAS', 5)
+    monkeypatch.setattr(app, 'ATIPICOS_CACHE_SEGUNDOS', 0)
+    normais = [formulario(i, chave_idempotencia=f"n{i}", distancia_cidade=str(100 + 10 * i)) for i in range(8)]
+    assert cliente.post('/submit-lote', json={'respostas': normais}).status_code == 200
+
+    resposta = cliente.post('/submit-lote', json={'respostas': [
+        formulario(9, chave_idempotencia='atipica', distancia_cidade='40000')]})
+    [resultado] = resposta.json['resultados']
+    atipica = app.db.session.get(app.RespostaEmissao, resultado['id'])
+    assert atipica.situacao == 'pendente'
+    assert 'distancia_cidade (carro)' in atipica.motivos_revisao
+    # Fora dos agregados até alguém revisar
+    assert app.calcular_agregados()['total_respostas'] == 8
+    assert [r['id'] for r in cliente.get('/revisao', headers=admin).json['respostas']] == [atipica.id]
+
+    assert cliente.post(f"/revisao/{atipica.id}", json={'acao': 'aceitar'}, headers=admin).status_code == 200
+    assert app.calcular_agregados()['total_respostas'] == 9
+    assert cliente.get('/revisao', headers=admin).json['respostas'] == []